@@ -0,0 +1,271 @@
+from function import create_multi_agents
+from utils.db_client import DbClient, create_db_client
+from utils.models import load_llm_with_cache, load_llm_with_stream
+from utils.prompt_cache import get_prompt_cache_callback
+from engines.query_analyzer import QueryAnalyzerOutput
+from engines.query_rewriter import QueryRewriterOutput
+from engines.task_planner import SubTask, TaskPlannerOutput
+from engines.sql_query_generator import SqlQueryGeneratorOutput
+from engines.plan_sql_generator import PlanSqlGeneratorOutput
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+import logging
+
+QUERIES = [
+    "List the top 3 categories I spent most on last month",
+    "How much did I spend on groceries this year?",
+    "Show my last 5 transactions",
+    "What is my current balance?",
+]
+
+
+# Stands in for a chat model with a fixed response time: sleeps, then answers with canned
+# outputs. Sync calls block their thread while async calls yield to the event loop, the same
+# way the openai client behaves, so a node still running sync shows up in the throughput.
+class SimulatedLLM(RunnableLambda):
+    def __init__(self, latency: float, outputs: Dict[Any, Any]):
+        self.latency = latency
+        self.outputs = outputs
+        super().__init__(self._respond, afunc=self._arespond)
+
+    def _respond(self, prompt, schema=None):
+        time.sleep(self.latency)
+        return self.outputs[schema]
+
+    async def _arespond(self, prompt, schema=None):
+        await asyncio.sleep(self.latency)
+        return self.outputs[schema]
+
+    def with_structured_output(self, schema):
+        return RunnableLambda(
+            lambda prompt: self._respond(prompt, schema),
+            afunc=lambda prompt: self._arespond(prompt, schema),
+        )
+
+
+class SimulatedDbClient(DbClient):
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def execute_sql_query(self, sql_query: str, page_size: int = None):
+        await asyncio.sleep(self.latency)
+        db_result = {"columns": ["category", "total"], "rows": [["groceries", 120.5]]}
+        return db_result, "success"
+
+
+def simulated_outputs(client_id: int, bank_id: int, account_id: int) -> Dict:
+    outputs = {
+        QueryAnalyzerOutput: QueryAnalyzerOutput(
+            classified_result="valid_transactional",
+            classified_reason="Simulated classification.",
+        ),
+        QueryRewriterOutput: QueryRewriterOutput(
+            rewritten_query="List the top 3 categories I spent most on in 2024",
+            reasoning="Simulated rewrite.",
+        ),
+        TaskPlannerOutput: TaskPlannerOutput(
+            query_understanding="Simulated plan.",
+            execution_plan=[
+                SubTask(
+                    step="1",
+                    operation="AGGREGATE",
+                    description="Sum debits per category.",
+                    fields_involved=["category", "debit"],
+                    conditions="None",
+                )
+            ],
+            expected_output_structure="Categories with their spending.",
+        ),
+        SqlQueryGeneratorOutput: SqlQueryGeneratorOutput(
+            sql_query=f"SELECT category, SUM(debit) AS total_spending FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} GROUP BY category ORDER BY total_spending DESC LIMIT 3"
+        ),
+        None: AIMessage(content="You spent the most on groceries."),
+    }
+    outputs[PlanSqlGeneratorOutput] = PlanSqlGeneratorOutput(
+        task_plan=outputs[TaskPlannerOutput],
+        generated_sql=outputs[SqlQueryGeneratorOutput],
+    )
+    return outputs
+
+
+def initial_state(query: str, client_id: int, bank_id: int, account_id: int) -> Dict:
+    return {
+        "messages": [HumanMessage(content=query)],
+        "query": query,
+        "query_classified_result": "",
+        "query_classified_reason": "",
+        "rewritten_query": "",
+        "rewritten_query_reason": "",
+        "client_id": client_id,
+        "account_id": account_id,
+        "bank_id": bank_id,
+        "action_plan": [],
+        "query_understanding": "",
+        "expected_output_structure": "",
+        "sql_query": "",
+        "database_results": {"columns": [], "rows": []},
+        "database_status": "",
+        "sql_template_hit": False,
+        "sql_plan_cache_hit": False,
+        "answer": "",
+    }
+
+
+# One chat session: consecutive turns on its own thread_id
+async def run_session(graph, turns: int, args) -> List[float]:
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    latencies = []
+    for turn in range(turns):
+        state = initial_state(
+            QUERIES[turn % len(QUERIES)], args.client_id, args.bank_id, args.account_id
+        )
+        start = perf_counter()
+        await graph.ainvoke(input=state, config=config)
+        latencies.append((perf_counter() - start) * 1000)
+    return latencies
+
+
+async def run_level(graph, sessions: int, args) -> Dict[str, float]:
+    start = perf_counter()
+    results = await asyncio.gather(
+        *(run_session(graph, args.turns, args) for _ in range(sessions))
+    )
+    seconds = perf_counter() - start
+    latencies = sorted(latency for session in results for latency in session)
+    return {
+        "sessions": sessions,
+        "turns": len(latencies),
+        "seconds": seconds,
+        "turns_per_second": len(latencies) / seconds,
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def build_graph(args) -> Tuple[Any, str]:
+    outputs = simulated_outputs(args.client_id, args.bank_id, args.account_id)
+    if args.real_models:
+        llm_stream, llm_cache = load_llm_with_stream(), load_llm_with_cache()
+        models = "configured models"
+    else:
+        llm_stream = llm_cache = SimulatedLLM(args.llm_latency, outputs)
+        models = f"simulated models ({args.llm_latency * 1000:.0f} ms per call)"
+    if args.real_db:
+        db_client = create_db_client()
+        db = "configured db client"
+    else:
+        db_client = SimulatedDbClient(args.db_latency)
+        db = f"simulated db ({args.db_latency * 1000:.0f} ms per query)"
+    graph = create_multi_agents(
+        llm_stream=llm_stream,
+        llm_cache=llm_cache,
+        db_client=db_client,
+        speculative=args.speculative,
+        fused=args.fused,
+        plan_cache=args.plan_cache,
+        templates=args.templates,
+    )
+    rewrite = "speculative rewrite" if args.speculative else "sequential rewrite"
+    planning = "fused planning" if args.fused else "two-step planning"
+    if args.plan_cache:
+        planning += " behind the sql plan cache"
+    if args.templates:
+        planning += " and sql templates"
+    return graph, f"{models}, {db}, {rewrite}, {planning}"
+
+
+async def main(args):
+    graph, setup = build_graph(args)
+    print(f"Concurrent chat sessions, {args.turns} turns each, {setup}")
+    print(
+        f"{'sessions':>9}{'turns':>7}{'seconds':>9}{'turns/s':>9}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}"
+    )
+    report = []
+    with get_prompt_cache_callback() as cache_cb:
+        for sessions in args.sessions:
+            result = await run_level(graph, sessions, args)
+            report.append(result)
+            print(
+                f"{result['sessions']:>9}{result['turns']:>7}{result['seconds']:>9.2f}"
+                f"{result['turns_per_second']:>9.2f}{result['mean_ms']:>10.1f}"
+                f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+            )
+
+    # Only models reporting their usage (e.g. --real-models) show up here
+    prompt_cache = cache_cb.usage.stats()
+    if prompt_cache:
+        print(
+            f"{'node':<26}{'calls':>7}{'prompt tok':>12}{'cached tok':>12}{'cached':>8}"
+        )
+        for node, usage in prompt_cache.items():
+            print(
+                f"{node:<26}{usage['calls']:>7}{usage['prompt_tokens']:>12}"
+                f"{usage['cached_tokens']:>12}{usage['cached_ratio']:>8.1%}"
+            )
+    if args.json:
+        args.json.write_text(
+            json.dumps(
+                {"setup": setup, "levels": report, "prompt_cache": prompt_cache},
+                indent=2,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark chat throughput of the agents graph against the number of concurrent sessions"
+    )
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument(
+        "--real-models",
+        action="store_true",
+        help="Call the configured openai models instead of simulated ones",
+    )
+    parser.add_argument(
+        "--real-db",
+        action="store_true",
+        help="Query through the configured db client (DB_CLIENT_BACKEND)",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Rewrite the query while it is being analyzed",
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Plan the task and generate its sql in one llm call",
+    )
+    parser.add_argument(
+        "--plan-cache",
+        action="store_true",
+        help="Reuse cached sql plans (every simulated turn plans the same query)",
+    )
+    parser.add_argument(
+        "--templates",
+        action="store_true",
+        help="Fill the sql of recognized intents from templates (every simulated rewrite matches one)",
+    )
+    parser.add_argument("--client-id", type=int, default=1)
+    parser.add_argument("--bank-id", type=int, default=1)
+    parser.add_argument("--account-id", type=int, default=1)
+    parser.add_argument("--json", type=Path, default=None, help="Write results here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
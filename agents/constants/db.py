@@ -1,5 +1,39 @@
+import os
+
+# Backend used to run sql queries: "http" calls the db service, "embedded" runs the db
+# service logic in-process on the sqlite files (single-node deployments)
+DB_CLIENT_BACKEND = os.getenv("DB_CLIENT_BACKEND", "http")
+# Directory of the db service modules, for the embedded backend. The shard layout is read
+# from the same DB_SHARD_DIR / DB_SHARD_COUNT variables as the db service.
+DB_EMBEDDED_MODULE_DIR = os.getenv(
+    "DB_EMBEDDED_MODULE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db"),
+)
+
 # DB_EXECUTE_SQL_QUERY_URL = "http://localhost:8070/api/db/execute-query" # local
 DB_EXECUTE_SQL_QUERY_URL = "http://db:8070/api/db/execute-query"  # docker
+# DB_STREAM_SQL_QUERY_URL = "http://localhost:8070/api/db/execute-query/stream" # local
+DB_STREAM_SQL_QUERY_URL = "http://db:8070/api/db/execute-query/stream"  # docker
+
+# Request header selecting the wire format of query results (records, columnar or msgpack)
+DB_RESULT_FORMAT_HEADER = "X-Result-Format"
+
+# Pooled http client of the db service: keep-alive connections shared by all chats, timeouts in
+# seconds, and retries with jittered exponential backoff on connection failures and 503s
+DB_HTTP_MAX_CONNECTIONS = int(os.getenv("DB_HTTP_MAX_CONNECTIONS", "50"))
+DB_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("DB_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+DB_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("DB_HTTP_KEEPALIVE_EXPIRY", "30"))
+DB_HTTP_CONNECT_TIMEOUT = float(os.getenv("DB_HTTP_CONNECT_TIMEOUT", "3"))
+DB_HTTP_READ_TIMEOUT = float(os.getenv("DB_HTTP_READ_TIMEOUT", "30"))
+DB_HTTP_POOL_TIMEOUT = float(os.getenv("DB_HTTP_POOL_TIMEOUT", "10"))
+DB_HTTP_MAX_RETRIES = int(os.getenv("DB_HTTP_MAX_RETRIES", "3"))
+DB_HTTP_RETRY_BACKOFF = float(os.getenv("DB_HTTP_RETRY_BACKOFF", "0.2"))
+DB_HTTP_RETRY_MAX_BACKOFF = float(os.getenv("DB_HTTP_RETRY_MAX_BACKOFF", "5"))
+
+# Maximum number of rows pulled into the graph state for the response crafter
+DB_RESULT_PAGE_SIZE = int(os.getenv("DB_RESULT_PAGE_SIZE", "500"))
 
 DB_TABLE_SCHEMA = """Table: transactions
 Description: stores financial transaction records for clients across various banks and accounts.
@@ -34,3 +68,36 @@ debit:
 credit:
     - REAL
     - Amount credited"""
+
+
+DB_SUMMARY_TABLES_SCHEMA = """Table: monthly_category_summary
+Description: pre-aggregated monthly totals per account and category, kept up to date from transactions.
+
+client_id:
+    - INTEGER
+bank_id:
+    - INTEGER
+account_id:
+    - INTEGER
+month:
+    - TEXT ('YYYY-MM', e.g. '2023-07')
+    - Calendar month of the aggregated transactions
+category:
+    - TEXT (lower-cased, '' when the transaction has no category)
+total_debit:
+    - REAL
+    - Sum of debit in the month for the category (0 when none)
+total_credit:
+    - REAL
+    - Sum of credit in the month for the category (0 when none)
+transaction_count:
+    - INTEGER
+    - Number of transactions in the month for the category
+
+Table: monthly_merchant_summary
+Description: same as monthly_category_summary, grouped by merchant instead of category.
+
+client_id, bank_id, account_id, month, total_debit, total_credit, transaction_count:
+    - Same as monthly_category_summary
+merchant:
+    - TEXT (lower-cased, '' when the transaction has no merchant)"""
@@ -0,0 +1,72 @@
+import os
+
+# Start the query rewrite together with the query analysis instead of after it. Saves one llm
+# round trip on transactional queries, at the cost of a discarded rewrite on the others.
+SPECULATIVE_REWRITE = os.getenv("AGENTS_SPECULATIVE_REWRITE", "false").lower() == "true"
+
+# Plan the task and generate its sql in a single llm call instead of two, so the schema and
+# instructions are sent once and the action plan is not serialized back into a second prompt
+FUSED_PLAN_SQL = os.getenv("AGENTS_FUSED_PLAN_SQL", "false").lower() == "true"
+
+# Exact-key cache of the sql planned for a rewritten query, skipping task planning and sql
+# generation on a hit. Entries expire after the ttl and the least recently used are evicted
+# beyond the maximum number of entries.
+SQL_PLAN_CACHE_ENABLED = (
+    os.getenv("AGENTS_SQL_PLAN_CACHE_ENABLED", "true").lower() == "true"
+)
+SQL_PLAN_CACHE_TTL_SECONDS = float(
+    os.getenv("AGENTS_SQL_PLAN_CACHE_TTL_SECONDS", "3600")
+)
+SQL_PLAN_CACHE_MAX_ENTRIES = int(
+    os.getenv("AGENTS_SQL_PLAN_CACHE_MAX_ENTRIES", "10000")
+)
+
+# Fill the sql of frequent, fully recognized intents (top categories or merchants, totals spent
+# or received, last transactions) from templates, without planning or generating it with the llm
+SQL_TEMPLATES_ENABLED = (
+    os.getenv("AGENTS_SQL_TEMPLATES_ENABLED", "true").lower() == "true"
+)
+# Category and merchant names a template may be filled with, read per account from the summary
+# tables and kept for the ttl; accounts beyond the maximum are evicted, least recent first
+SQL_TEMPLATE_KEYWORDS_TTL_SECONDS = float(
+    os.getenv("AGENTS_SQL_TEMPLATE_KEYWORDS_TTL_SECONDS", "600")
+)
+SQL_TEMPLATE_KEYWORDS_MAX_ACCOUNTS = int(
+    os.getenv("AGENTS_SQL_TEMPLATE_KEYWORDS_MAX_ACCOUNTS", "10000")
+)
+SQL_TEMPLATE_KEYWORDS_MAX_VALUES = int(
+    os.getenv("AGENTS_SQL_TEMPLATE_KEYWORDS_MAX_VALUES", "2000")
+)
+
+# Chat history sent to the llm: the current query with the last turns verbatim, older turns
+# folded into a summary kept per thread, all within a token budget per node
+CHAT_HISTORY_MANAGED = (
+    os.getenv("AGENTS_CHAT_HISTORY_MANAGED", "true").lower() == "true"
+)
+CHAT_HISTORY_RECENT_TURNS = int(os.getenv("AGENTS_CHAT_HISTORY_RECENT_TURNS", "3"))
+CHAT_HISTORY_TOKEN_BUDGETS = {
+    "query_analyzer": int(os.getenv("AGENTS_QUERY_ANALYZER_HISTORY_TOKENS", "1000")),
+    "query_rewriter": int(os.getenv("AGENTS_QUERY_REWRITER_HISTORY_TOKENS", "1500")),
+    "conversational_responder": int(
+        os.getenv("AGENTS_CONVERSATIONAL_RESPONDER_HISTORY_TOKENS", "1000")
+    ),
+}
+CHAT_HISTORY_MAX_THREADS = int(os.getenv("AGENTS_CHAT_HISTORY_MAX_THREADS", "10000"))
+
+# Graph checkpoints, kept per thread_id: "memory" or "sqlite" (on disk, survives restarts).
+# Only the latest checkpoints of a thread are kept. Threads not used within the ttl are
+# evicted, and the least recently used ones beyond the maximum number of threads or, in memory,
+# beyond the maximum size. The sqlite backend is pruned at most once per interval.
+CHECKPOINTER_BACKEND = os.getenv("AGENTS_CHECKPOINTER_BACKEND", "memory")
+CHECKPOINTS_PER_THREAD = int(os.getenv("AGENTS_CHECKPOINTS_PER_THREAD", "2"))
+CHECKPOINT_TTL_SECONDS = float(os.getenv("AGENTS_CHECKPOINT_TTL_SECONDS", "21600"))
+CHECKPOINT_MAX_THREADS = int(os.getenv("AGENTS_CHECKPOINT_MAX_THREADS", "10000"))
+CHECKPOINT_MAX_BYTES = int(
+    os.getenv("AGENTS_CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024))
+)
+CHECKPOINT_SQLITE_PATH = os.getenv(
+    "AGENTS_CHECKPOINT_SQLITE_PATH", "./checkpoints/checkpoints.db"
+)
+CHECKPOINT_PRUNE_INTERVAL_SECONDS = float(
+    os.getenv("AGENTS_CHECKPOINT_PRUNE_INTERVAL_SECONDS", "60")
+)
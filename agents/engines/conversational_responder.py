@@ -3,28 +3,31 @@ from constants.models import CONVERSATIONAL_RESPONDER_SYSTEM_PROMPT
 from langchain_core.prompts import ChatPromptTemplate
 from typing import List, Union
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import Runnable, RunnableConfig
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+CONVERSATIONAL_RESPONDER_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", CONVERSATIONAL_RESPONDER_SYSTEM_PROMPT)
+)
+
+
+def build_conversational_responder_chain(llm) -> Runnable:
+    return CONVERSATIONAL_RESPONDER_PROMPT | llm
+
+
 # To enable stream response
 # Remove 'config' param and change 'ainvoke' to 'invoke' for testing
 async def respond_conversational(
-    llm: ChatOpenAI,
+    chain: Runnable,
     query: str,
     classified_result: str,
     classified_reason: str,
     chat_history: List[Union[HumanMessage, AIMessage]],
     config: RunnableConfig,
 ) -> str:
-    prompt = ChatPromptTemplate.from_messages(
-        ("system", CONVERSATIONAL_RESPONDER_SYSTEM_PROMPT)
-    )
-    chain = prompt | llm
-
     try:
         response = await chain.ainvoke(
             {
@@ -46,13 +49,13 @@ async def respond_conversational(
 
 if __name__ == "__main__":
     # Test respond_conversational locally
-    llm = load_llm()
+    chain = build_conversational_responder_chain(load_llm())
     query = "List my transactions for that thing I bought"
     classified_result = "ambiguous"
     classified_reason = "The query 'List my transactions for that thing I bought' lacks specific details such as the timeframe, the account from which the transaction was made, or the specific item purchased. The phrase 'that thing' is vague and does not provide enough context to identify which transaction the user is referring to."
     chat_history = [HumanMessage(content=query)]
     response = respond_conversational(
-        llm=llm,
+        chain=chain,
         query=query,
         classified_result=classified_result,
         classified_reason=classified_reason,
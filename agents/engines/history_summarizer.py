@@ -0,0 +1,52 @@
+from utils.models import load_llm
+from constants.models import HISTORY_SUMMARIZER_SYSTEM_PROMPT
+from langchain_core.prompts import ChatPromptTemplate
+from typing import List, Optional, Union
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.runnables import Runnable
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+HISTORY_SUMMARIZER_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", HISTORY_SUMMARIZER_SYSTEM_PROMPT)
+)
+
+
+def build_history_summarizer_chain(llm) -> Runnable:
+    return HISTORY_SUMMARIZER_PROMPT | llm
+
+
+# Folds the new messages into the running summary. Returns None on failure, so the caller keeps
+# the previous summary rather than an error message.
+async def asummarize_history(
+    chain: Runnable,
+    summary: str,
+    messages: List[Union[HumanMessage, AIMessage]],
+) -> Optional[str]:
+    try:
+        response = await chain.ainvoke(
+            {"summary": summary or "None", "messages": messages}
+        )
+        return response.content
+    except Exception as e:
+        logger.info(
+            f"Unexpected error occurred when executing 'asummarize_history': {e}"
+        )
+        return None
+
+
+if __name__ == "__main__":
+    # Test asummarize_history locally
+    chain = build_history_summarizer_chain(load_llm())
+    summary = ""
+    messages = [
+        HumanMessage(content="What were my top 3 spending categories in March 2025?"),
+        AIMessage(
+            content="In March 2025 you spent the most on Groceries (420.50), Dining (210.00) and Transport (95.20)."
+        ),
+    ]
+    response = asyncio.run(asummarize_history(chain, summary, messages))
+    print(response)
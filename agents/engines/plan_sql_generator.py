@@ -0,0 +1,105 @@
+from utils.models import load_llm
+from constants.models import PLAN_SQL_GENERATOR_SYSTEM_PROMPT
+from constants.db import DB_TABLE_SCHEMA, DB_SUMMARY_TABLES_SCHEMA
+from pydantic import BaseModel, Field
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from engines.task_planner import TaskPlannerOutput
+from engines.sql_query_generator import SqlQueryGeneratorOutput
+from typing import Any, Dict, Union
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Create a structured output for plan_sql_generator, holding what task_planner and
+# sql_query_generator return separately, so both come out of a single llm call
+class PlanSqlGeneratorOutput(BaseModel):
+    task_plan: TaskPlannerOutput = Field(
+        ..., description="The task plan decomposing the rewritten query."
+    )
+    generated_sql: SqlQueryGeneratorOutput = Field(
+        ..., description="The SQL query implementing the task plan."
+    )
+
+
+PLAN_SQL_GENERATOR_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", PLAN_SQL_GENERATOR_SYSTEM_PROMPT)
+)
+
+
+def build_plan_sql_generator_chain(llm) -> Runnable:
+    return PLAN_SQL_GENERATOR_PROMPT | llm.with_structured_output(
+        PlanSqlGeneratorOutput
+    )
+
+
+def plan_and_generate_sql_query_inputs(
+    rewritten_query: str, client_id: int, bank_id: int, account_id: int
+) -> Dict[str, Any]:
+    return {
+        "client_id": client_id,
+        "bank_id": bank_id,
+        "account_id": account_id,
+        "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ),
+        "rewritten_query": rewritten_query,
+        "schema": DB_TABLE_SCHEMA,
+        "summary_schema": DB_SUMMARY_TABLES_SCHEMA,
+    }
+
+
+def plan_and_generate_sql_query(
+    chain: Runnable, rewritten_query: str, client_id: int, bank_id: int, account_id: int
+) -> Union[PlanSqlGeneratorOutput, str]:
+    try:
+        response = chain.invoke(
+            plan_and_generate_sql_query_inputs(
+                rewritten_query, client_id, bank_id, account_id
+            )
+        )
+        return response
+    except Exception as e:
+        error_msg = f"Unexpected error occurred when executing 'plan_and_generate_sql_query': {e}"
+        logger.info(error_msg)
+        return error_msg
+
+
+# Async entry point for the graph, so the llm call doesn't hold a worker thread
+async def aplan_and_generate_sql_query(
+    chain: Runnable, rewritten_query: str, client_id: int, bank_id: int, account_id: int
+) -> Union[PlanSqlGeneratorOutput, str]:
+    try:
+        response = await chain.ainvoke(
+            plan_and_generate_sql_query_inputs(
+                rewritten_query, client_id, bank_id, account_id
+            )
+        )
+        return response
+    except Exception as e:
+        error_msg = f"Unexpected error occurred when executing 'aplan_and_generate_sql_query': {e}"
+        logger.info(error_msg)
+        return error_msg
+
+
+if __name__ == "__main__":
+    # Test plan_and_generate_sql_query locally
+    chain = build_plan_sql_generator_chain(load_llm())
+    client_id = 2
+    bank_id = 1
+    account_id = 1
+    rewritten_query = "List the top 3 categories I saved most on July 2023"
+    response = plan_and_generate_sql_query(
+        chain=chain,
+        rewritten_query=rewritten_query,
+        client_id=client_id,
+        bank_id=bank_id,
+        account_id=account_id,
+    )
+    if response is not None:
+        print(response.task_plan.query_understanding)
+        print(response.task_plan.execution_plan)
+        print(response.generated_sql.sql_query)
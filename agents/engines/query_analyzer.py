@@ -3,7 +3,8 @@ from constants.models import QUERY_ANALYZER_SYSTEM_PROMPT
 from constants.db import DB_TABLE_SCHEMA
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
-from typing import Literal, List, Union
+from langchain_core.runnables import Runnable
+from typing import Any, Dict, Literal, List, Union
 from langchain_core.messages import HumanMessage, AIMessage
 import logging
 
@@ -21,31 +22,53 @@ class QueryAnalyzerOutput(BaseModel):
     )
 
 
+# Parsed and bound to the output schema once, when the graph is built, then reused on every call
+QUERY_ANALYZER_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", QUERY_ANALYZER_SYSTEM_PROMPT)
+)
+
+
+def build_query_analyzer_chain(llm) -> Runnable:
+    return QUERY_ANALYZER_PROMPT | llm.with_structured_output(QueryAnalyzerOutput)
+
+
+def analyze_query_inputs(
+    query: str, chat_history: List[Union[HumanMessage, AIMessage]]
+) -> Dict[str, Any]:
+    return {"chat_history": chat_history, "query": query, "schema": DB_TABLE_SCHEMA}
+
+
 def analyze_query(
-    llm, query: str, chat_history: List[Union[HumanMessage, AIMessage]]
+    chain: Runnable, query: str, chat_history: List[Union[HumanMessage, AIMessage]]
 ) -> Union[QueryAnalyzerOutput, str]:
-    prompt = ChatPromptTemplate.from_messages(("system", QUERY_ANALYZER_SYSTEM_PROMPT))
+    try:
+        response = chain.invoke(analyze_query_inputs(query, chat_history))
+        return response
+    except Exception as e:
+        error_msg = f"Unexpected error occurred when executing 'analyze_query': {e}"
+        logger.info(error_msg)
+        return error_msg
 
-    chain = prompt | llm
 
+# Async entry point for the graph, so the llm call doesn't hold a worker thread
+async def aanalyze_query(
+    chain: Runnable, query: str, chat_history: List[Union[HumanMessage, AIMessage]]
+) -> Union[QueryAnalyzerOutput, str]:
     try:
-        response = chain.invoke(
-            {"chat_history": chat_history, "query": query, "schema": DB_TABLE_SCHEMA}
-        )
+        response = await chain.ainvoke(analyze_query_inputs(query, chat_history))
         return response
     except Exception as e:
-        error_msg = f"Unexpected error occurred when executing 'analyze_query': {e}"
+        error_msg = f"Unexpected error occurred when executing 'aanalyze_query': {e}"
         logger.info(error_msg)
         return error_msg
 
 
 if __name__ == "__main__":
     # Test analyze_query locally
-    llm = load_llm()
-    llm = llm.with_structured_output(QueryAnalyzerOutput)
+    chain = build_query_analyzer_chain(load_llm())
     query = "List my transactions for that thing I bought"
     chat_history = [HumanMessage(content=query)]
-    response = analyze_query(llm=llm, query=query, chat_history=chat_history)
+    response = analyze_query(chain=chain, query=query, chat_history=chat_history)
     if response is not None:
         print(response.classified_result)
         print(response.classified_reason)
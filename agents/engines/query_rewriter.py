@@ -3,8 +3,9 @@ from constants.models import QUERY_REWRITER_SYSTEM_PROMPT
 from constants.db import DB_TABLE_SCHEMA
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from langchain_core.messages import HumanMessage, AIMessage
-from typing import List, Union
+from typing import Any, Dict, List, Union
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import logging
@@ -23,26 +24,40 @@ class QueryRewriterOutput(BaseModel):
     )
 
 
+QUERY_REWRITER_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", QUERY_REWRITER_SYSTEM_PROMPT)
+)
+
+
+def build_query_rewriter_chain(llm) -> Runnable:
+    return QUERY_REWRITER_PROMPT | llm.with_structured_output(QueryRewriterOutput)
+
+
+def rewrite_query_inputs(
+    query: str,
+    chat_history: List[Union[HumanMessage, AIMessage]],
+    rewritten_query: str,
+) -> Dict[str, Any]:
+    return {
+        "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ),
+        "query": query,
+        "chat_history": chat_history,
+        "schema": DB_TABLE_SCHEMA,
+        "rewritten_query": rewritten_query,
+    }
+
+
 def rewrite_query(
-    llm,
+    chain: Runnable,
     query: str,
     chat_history: List[Union[HumanMessage, AIMessage]],
     rewritten_query: str,
 ) -> Union[QueryRewriterOutput, str]:
-    prompt = ChatPromptTemplate.from_messages(("system", QUERY_REWRITER_SYSTEM_PROMPT))
-    chain = prompt | llm
-
     try:
         response = chain.invoke(
-            {
-                "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                ),
-                "query": query,
-                "chat_history": chat_history,
-                "schema": DB_TABLE_SCHEMA,
-                "rewritten_query": rewritten_query,
-            }
+            rewrite_query_inputs(query, chat_history, rewritten_query)
         )
         return response
     except Exception as e:
@@ -51,15 +66,35 @@ def rewrite_query(
         return error_msg
 
 
+# Async entry point for the graph, so the llm call doesn't hold a worker thread
+async def arewrite_query(
+    chain: Runnable,
+    query: str,
+    chat_history: List[Union[HumanMessage, AIMessage]],
+    rewritten_query: str,
+) -> Union[QueryRewriterOutput, str]:
+    try:
+        response = await chain.ainvoke(
+            rewrite_query_inputs(query, chat_history, rewritten_query)
+        )
+        return response
+    except Exception as e:
+        error_msg = f"Unexpected error occurred when executing 'arewrite_query': {e}"
+        logger.info(error_msg)
+        return error_msg
+
+
 if __name__ == "__main__":
     # Test rewrite_query locally
-    llm = load_llm()
-    llm = llm.with_structured_output(QueryRewriterOutput)
+    chain = build_query_rewriter_chain(load_llm())
     query = "List the top 3 categories I spent most on last month"
     chat_history = [HumanMessage(content=query)]
     rewritten_query = ""
     response = rewrite_query(
-        llm=llm, query=query, chat_history=chat_history, rewritten_query=rewritten_query
+        chain=chain,
+        query=query,
+        chat_history=chat_history,
+        rewritten_query=rewritten_query,
     )
     if response is not None:
         print(response.rewritten_query)
@@ -2,28 +2,37 @@ from constants.models import RESPONSE_CRAFTER_SYSTEM_PROMPT
 from utils.models import load_llm
 from langchain_core.prompts import ChatPromptTemplate
 from typing import Dict, List, Any
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import Runnable, RunnableConfig
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+RESPONSE_CRAFTER_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", RESPONSE_CRAFTER_SYSTEM_PROMPT)
+)
+
+
+def build_response_crafter_chain(llm) -> Runnable:
+    return RESPONSE_CRAFTER_PROMPT | llm
+
+
 # To enable stream response
 # Remove 'config' param and change 'ainvoke' to 'invoke' for testing
 async def craft_response(
-    llm,
+    chain: Runnable,
     rewritten_query: str,
-    database_results: List[Dict[str, Any]],
+    database_results: Dict[str, List[Any]],
+    database_status: str,
     config: RunnableConfig,
 ) -> str:
-    prompt = ChatPromptTemplate.from_messages(
-        ("system", RESPONSE_CRAFTER_SYSTEM_PROMPT)
-    )
-    chain = prompt | llm
-
     try:
         response = await chain.ainvoke(
-            {"rewritten_query": rewritten_query, "database_results": database_results},
+            {
+                "rewritten_query": rewritten_query,
+                "database_results": database_results,
+                "database_status": database_status,
+            },
             config=config,
         )
         return response.content
@@ -35,15 +44,22 @@ async def craft_response(
 
 if __name__ == "__main__":
     # Test craft_response locally
-    llm = load_llm()
+    chain = build_response_crafter_chain(load_llm())
     rewritten_query = "List the top 3 categories I saved most on July 2023"
-    database_results = [
-        {"category": "restaurants", "total_savings": 5536.862},
-        {"category": "transfer deposit", "total_savings": 540.0},
-        {"category": "uncategorized", "total_savings": 15.0},
-    ]
+    database_results = {
+        "columns": ["category", "total_savings"],
+        "rows": [
+            ["restaurants", 5536.862],
+            ["transfer deposit", 540.0],
+            ["uncategorized", 15.0],
+        ],
+    }
+    database_status = "success"
     response = craft_response(
-        llm=llm, rewritten_query=rewritten_query, database_results=database_results
+        chain=chain,
+        rewritten_query=rewritten_query,
+        database_results=database_results,
+        database_status=database_status,
     )
     if response is not None:
         print(response)
@@ -1,10 +1,11 @@
 from utils.models import load_llm
 from constants.models import SQL_QUERY_GENERATOR_SYSTEM_PROMPT
-from constants.db import DB_TABLE_SCHEMA
+from constants.db import DB_TABLE_SCHEMA, DB_SUMMARY_TABLES_SCHEMA
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from engines.task_planner import SubTask
-from typing import List, Union
+from typing import Any, Dict, List, Union
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import logging
@@ -18,8 +19,44 @@ class SqlQueryGeneratorOutput(BaseModel):
     sql_query: str = Field(..., description="The generated SQL query.")
 
 
+SQL_QUERY_GENERATOR_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", SQL_QUERY_GENERATOR_SYSTEM_PROMPT)
+)
+
+
+def build_sql_query_generator_chain(llm) -> Runnable:
+    return SQL_QUERY_GENERATOR_PROMPT | llm.with_structured_output(
+        SqlQueryGeneratorOutput
+    )
+
+
+def generate_sql_query_inputs(
+    rewritten_query: str,
+    action_plan: List[SubTask],
+    query_understanding: str,
+    expected_output_structure: str,
+    client_id: int,
+    bank_id: int,
+    account_id: int,
+) -> Dict[str, Any]:
+    return {
+        "rewritten_query": rewritten_query,
+        "schema": DB_TABLE_SCHEMA,
+        "summary_schema": DB_SUMMARY_TABLES_SCHEMA,
+        "action_plan": action_plan,
+        "query_understanding": query_understanding,
+        "expected_output_structure": expected_output_structure,
+        "client_id": client_id,
+        "bank_id": bank_id,
+        "account_id": account_id,
+        "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ),
+    }
+
+
 def generate_sql_query(
-    llm,
+    chain: Runnable,
     rewritten_query: str,
     action_plan: List[SubTask],
     query_understanding: str,
@@ -28,26 +65,17 @@ def generate_sql_query(
     bank_id: int,
     account_id: int,
 ) -> Union[SqlQueryGeneratorOutput, str]:
-    prompt = ChatPromptTemplate.from_messages(
-        ("system", SQL_QUERY_GENERATOR_SYSTEM_PROMPT)
-    )
-    chain = prompt | llm
-
     try:
         response = chain.invoke(
-            {
-                "rewritten_query": rewritten_query,
-                "schema": DB_TABLE_SCHEMA,
-                "action_plan": action_plan,
-                "query_understanding": query_understanding,
-                "expected_output_structure": expected_output_structure,
-                "client_id": client_id,
-                "bank_id": bank_id,
-                "account_id": account_id,
-                "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                ),
-            }
+            generate_sql_query_inputs(
+                rewritten_query,
+                action_plan,
+                query_understanding,
+                expected_output_structure,
+                client_id,
+                bank_id,
+                account_id,
+            )
         )
         return response
     except Exception as e:
@@ -58,10 +86,41 @@ def generate_sql_query(
         return error_msg
 
 
+# Async entry point for the graph, so the llm call doesn't hold a worker thread
+async def agenerate_sql_query(
+    chain: Runnable,
+    rewritten_query: str,
+    action_plan: List[SubTask],
+    query_understanding: str,
+    expected_output_structure: str,
+    client_id: int,
+    bank_id: int,
+    account_id: int,
+) -> Union[SqlQueryGeneratorOutput, str]:
+    try:
+        response = await chain.ainvoke(
+            generate_sql_query_inputs(
+                rewritten_query,
+                action_plan,
+                query_understanding,
+                expected_output_structure,
+                client_id,
+                bank_id,
+                account_id,
+            )
+        )
+        return response
+    except Exception as e:
+        error_msg = (
+            f"Unexpected error occurred when executing 'agenerate_sql_query': {e}"
+        )
+        logger.info(error_msg)
+        return error_msg
+
+
 if __name__ == "__main__":
     # Test generate_sql_query locally
-    llm = load_llm()
-    llm = llm.with_structured_output(SqlQueryGeneratorOutput)
+    chain = build_sql_query_generator_chain(load_llm())
     client_id = 2
     bank_id = 1
     account_id = 1
@@ -99,7 +158,7 @@ if __name__ == "__main__":
     query_understanding = "The user wants to retrieve the top 3 categories where they saved the most money during July 2023, based on their transaction records."
     expected_output_structure = "The final result should be a list of the top 3 categories with the highest total savings, including the category name and the total amount saved in each category."
     response = generate_sql_query(
-        llm=llm,
+        chain=chain,
         rewritten_query=rewritten_query,
         action_plan=action_plan,
         query_understanding=query_understanding,
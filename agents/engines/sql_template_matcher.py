@@ -0,0 +1,388 @@
+from utils.query_text import Period, local_today, normalize_query, resolve_period
+from utils.db_client import DbClient
+from constants.graph import (
+    SQL_TEMPLATE_KEYWORDS_TTL_SECONDS,
+    SQL_TEMPLATE_KEYWORDS_MAX_ACCOUNTS,
+    SQL_TEMPLATE_KEYWORDS_MAX_VALUES,
+)
+from pydantic import BaseModel, Field
+from datetime import date, timedelta
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import calendar
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default number of rows for "top categories" or "recent transactions" without a number
+DEFAULT_TOP_N = 5
+DEFAULT_LAST_N = 10
+MAX_N = 100
+
+# Optional lead-in of a request, e.g. "can you show me", "what were"
+_LEAD = r"(?:(?:please |can you |could you )*(?:show|list|give|tell|get|find)(?: me)? |what (?:are|were|is|was) |which (?:are|were) )?(?:the )?"
+# A category or merchant name, only filled when the account has one by that name (see
+# SqlTemplateKeywords)
+_KEYWORD = r"(?P<keyword>[a-z0-9&.\-/]+(?: [a-z0-9&.\-/]+){0,3})"
+
+_TOP_SPENDING = re.compile(
+    rf"{_LEAD}(?:my )?top (?:(?P<n>\d+) )?(?:spending )?(?P<dimension>categories|category|merchants|merchant)"
+    r"(?: (?:where |that )?i (?:spent|spend) (?:the )?most(?: money)?(?: on| at)?| by (?:total )?spending)?"
+)
+_MOST_SPENDING = re.compile(
+    r"(?:which|what) (?P<dimension>categories|category|merchants|merchant) (?:did|have) i (?:spent|spend) (?:the )?most(?: money)?(?: on| at)?"
+)
+_TOTAL_SPENT = re.compile(
+    rf"{_LEAD}(?:how much (?:money )?(?:did|have) i (?:spent|spend)|(?:my )?total (?:spending|spend|expenses|expenditure|amount spent))"
+    rf"(?: in total)?(?: (?:on|at|for) {_KEYWORD})?(?: in total)?"
+)
+_TOTAL_RECEIVED = re.compile(
+    rf"{_LEAD}(?:how much (?:money )?(?:did|have) i (?:receive|received|earn|earned|get|got)|(?:my )?total (?:income|earnings|deposits|credits|amount received))"
+    rf"(?: in total)?(?: from {_KEYWORD})?(?: in total)?"
+)
+_LAST_TRANSACTIONS = re.compile(
+    rf"{_LEAD}(?:my )?(?:(?P<n_first>\d+) )?(?:last|latest|most recent|recent) (?:(?P<n>\d+) )?(?P<noun>transactions|transaction)"
+    rf"(?: (?:at|to|from|with|on|for) {_KEYWORD})?"
+)
+
+
+# Create a structured output for sql_template_matcher, matching the one of sql_query_generator
+class SqlTemplateOutput(BaseModel):
+    intent: str = Field(..., description="The template the rewritten query matched.")
+    sql_query: str = Field(..., description="The SQL query filled from the template.")
+
+
+# Slot values are written as escaped sql literals, never pasted in as text: the db service
+# lifts every literal into a bound parameter before running the query (see db/statements.py)
+def sql_literal(value) -> str:
+    if isinstance(value, bool) or not isinstance(value, (int, str, date)):
+        raise TypeError(f"Unsupported sql template value: {value!r}")
+    if isinstance(value, int):
+        return str(int(value))
+    text = value.isoformat() if isinstance(value, date) else value
+    return "'" + text.replace("'", "''") + "'"
+
+
+def ids_filter(client_id: int, bank_id: int, account_id: int) -> str:
+    return f"client_id = {sql_literal(client_id)} AND bank_id = {sql_literal(bank_id)} AND account_id = {sql_literal(account_id)}"
+
+
+# A half-open range on the bare column, so the (client_id, bank_id, account_id,
+# transaction_date) index serves it; dates carry a time of day, hence the day after the end
+def date_filter(period: Optional[Period]) -> str:
+    if period is None:
+        return ""
+    start, end = period
+    return f" AND transaction_date >= {sql_literal(start)} AND transaction_date < {sql_literal(end + timedelta(days=1))}"
+
+
+# Exact match on the columns holding the keyword, as (column, stored value) pairs
+def keyword_filter(keyword: Optional[List[Tuple[str, str]]]) -> str:
+    if not keyword:
+        return ""
+    return f" AND ({' OR '.join(f'{column} = {sql_literal(value)}' for column, value in keyword)})"
+
+
+def month_filter(months: Optional[Tuple[str, str]]) -> str:
+    if months is None:
+        return ""
+    return f" AND month BETWEEN {sql_literal(months[0])} AND {sql_literal(months[1])}"
+
+
+# Whole calendar months can be read from the summary tables, as 'YYYY-MM' bounds
+def whole_months(period: Optional[Period]) -> Optional[Tuple[str, str]]:
+    if period is None:
+        return None
+    start, end = period
+    if start.day != 1 or end.day != calendar.monthrange(end.year, end.month)[1]:
+        return None
+    return start.strftime("%Y-%m"), end.strftime("%Y-%m")
+
+
+# Summary table and column of a top spending dimension, as the query names it
+_DIMENSIONS = {
+    "category": "category",
+    "categories": "category",
+    "merchant": "merchant",
+    "merchants": "merchant",
+}
+
+
+# Category and merchant names of an account, by their normalized wording, with the columns
+# and stored values they were found in
+Keywords = Dict[str, List[Tuple[str, str]]]
+
+
+def count_slot(match: re.Match, default: int) -> int:
+    n = match.groupdict().get("n") or match.groupdict().get("n_first")
+    return int(n) if n else default
+
+
+def top_spending_sql(
+    match: re.Match,
+    ids: str,
+    period: Optional[Period],
+    keyword: Optional[List[Tuple[str, str]]],
+) -> str:
+    dimension = _DIMENSIONS[match.group("dimension")]
+    # "top category" asks for one row, "top categories" for a few
+    n = count_slot(
+        match, DEFAULT_TOP_N if match.group("dimension").endswith("s") else 1
+    )
+    months = whole_months(period)
+    if period is None or months is not None:
+        return f"SELECT {dimension}, SUM(total_debit) AS total_spending FROM monthly_{dimension}_summary WHERE {ids} AND {dimension} <> ''{month_filter(months)} GROUP BY {dimension} ORDER BY total_spending DESC LIMIT {sql_literal(n)}"
+    return f"SELECT {dimension}, COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE {ids} AND {dimension} <> ''{date_filter(period)} GROUP BY {dimension} ORDER BY total_spending DESC LIMIT {sql_literal(n)}"
+
+
+def total_sql(
+    column: str,
+    alias: str,
+    ids: str,
+    period: Optional[Period],
+    keyword: Optional[List[Tuple[str, str]]],
+) -> str:
+    months = whole_months(period)
+    if not keyword and (period is None or months is not None):
+        return f"SELECT COALESCE(SUM(total_{column}), 0) AS {alias} FROM monthly_category_summary WHERE {ids}{month_filter(months)}"
+    return f"SELECT COALESCE(SUM({column}), 0) AS {alias} FROM transactions WHERE {ids}{date_filter(period)}{keyword_filter(keyword)}"
+
+
+def total_spent_sql(
+    match: re.Match,
+    ids: str,
+    period: Optional[Period],
+    keyword: Optional[List[Tuple[str, str]]],
+) -> str:
+    return total_sql("debit", "total_spending", ids, period, keyword)
+
+
+def total_received_sql(
+    match: re.Match,
+    ids: str,
+    period: Optional[Period],
+    keyword: Optional[List[Tuple[str, str]]],
+) -> str:
+    return total_sql("credit", "total_income", ids, period, keyword)
+
+
+def last_transactions_sql(
+    match: re.Match,
+    ids: str,
+    period: Optional[Period],
+    keyword: Optional[List[Tuple[str, str]]],
+) -> str:
+    # "last transaction" asks for one row, "last transactions" for a few
+    n = count_slot(match, DEFAULT_LAST_N if match.group("noun").endswith("s") else 1)
+    return f"SELECT transaction_date, description, category, merchant, debit, credit FROM transactions WHERE {ids}{date_filter(period)}{keyword_filter(keyword)} ORDER BY transaction_date DESC LIMIT {sql_literal(n)}"
+
+
+# Intents with the pattern a query must match in full, and the sql builder filling its slots
+_TEMPLATES: List[
+    Tuple[
+        str,
+        re.Pattern,
+        Callable[
+            [re.Match, str, Optional[Period], Optional[List[Tuple[str, str]]]], str
+        ],
+    ]
+] = [
+    ("top_spending", _TOP_SPENDING, top_spending_sql),
+    ("top_spending", _MOST_SPENDING, top_spending_sql),
+    ("total_spent", _TOTAL_SPENT, total_spent_sql),
+    ("total_received", _TOTAL_RECEIVED, total_received_sql),
+    ("last_transactions", _LAST_TRANSACTIONS, last_transactions_sql),
+]
+
+
+# Counts template lookups and hits per intent, for the hit rate of the fast path
+class SqlTemplateStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits: Dict[str, int] = {}
+
+    def record(self, intent: Optional[str]):
+        with self._lock:
+            self.lookups += 1
+            if intent is not None:
+                self.hits[intent] = self.hits.get(intent, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                "lookups": self.lookups,
+                "hits": hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "hits_by_intent": dict(self.hits),
+            }
+
+
+_stats = SqlTemplateStats()
+
+
+def get_sql_template_stats() -> SqlTemplateStats:
+    return _stats
+
+
+def keywords_sql(client_id: int, bank_id: int, account_id: int) -> str:
+    ids = ids_filter(client_id, bank_id, account_id)
+    return f"SELECT 'category' AS kind, category AS value FROM monthly_category_summary WHERE {ids} AND category <> '' GROUP BY category UNION ALL SELECT 'merchant' AS kind, merchant AS value FROM monthly_merchant_summary WHERE {ids} AND merchant <> '' GROUP BY merchant"
+
+
+# Category and merchant names of each account, read once from the summary tables through the
+# db client and kept for a while, least recently used accounts evicted. Only these fill the
+# keyword slot of a template: other words ("on weekends", "uber rides", "my credit card")
+# would be searched as a name, and find nothing rather than answer the question.
+class SqlTemplateKeywords:
+    def __init__(
+        self,
+        db_client: DbClient,
+        ttl_seconds: float = SQL_TEMPLATE_KEYWORDS_TTL_SECONDS,
+        max_accounts: int = SQL_TEMPLATE_KEYWORDS_MAX_ACCOUNTS,
+        max_values: int = SQL_TEMPLATE_KEYWORDS_MAX_VALUES,
+    ):
+        self.db_client = db_client
+        self.ttl_seconds = ttl_seconds
+        self.max_accounts = max_accounts
+        self.max_values = max_values
+        self._entries: "OrderedDict[Tuple[int, int, int], Tuple[float, Keywords]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_failures = 0
+
+    # Without the names of an account (the db failing), no keyword slot is filled
+    async def get(self, client_id: int, bank_id: int, account_id: int) -> Keywords:
+        account = (client_id, bank_id, account_id)
+        with self._lock:
+            entry = self._entries.get(account)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(account)
+                return entry[1]
+
+        db_result, db_status = await self.db_client.execute_sql_query(
+            keywords_sql(*account), page_size=self.max_values
+        )
+        with self._lock:
+            # A truncated list still only holds names the account has
+            if db_status not in ("success", "truncated"):
+                self.load_failures += 1
+                return {}
+            keywords: Keywords = {}
+            for column, value in db_result["rows"]:
+                if column in ("category", "merchant") and isinstance(value, str):
+                    keywords.setdefault(normalize_query(value), []).append(
+                        (column, value)
+                    )
+            self.loads += 1
+            self._entries.pop(account, None)
+            self._entries[account] = (time.monotonic() + self.ttl_seconds, keywords)
+            while len(self._entries) > self.max_accounts:
+                self._entries.popitem(last=False)
+            return keywords
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "accounts": len(self._entries),
+                "loads": self.loads,
+                "load_failures": self.load_failures,
+            }
+
+
+# Fill the sql of a rewritten query straight from a template, without any llm call. Only
+# queries a template explains word for word (besides one period), naming a category or
+# merchant among the account's keywords if any, match; anything else returns None and takes
+# the llm path.
+def match_sql_template(
+    rewritten_query: str,
+    client_id: int,
+    bank_id: int,
+    account_id: int,
+    keywords: Optional[Keywords] = None,
+    today: Optional[date] = None,
+) -> Optional[SqlTemplateOutput]:
+    try:
+        period, rest = resolve_period(
+            normalize_query(rewritten_query), today or local_today()
+        )
+    except ValueError:
+        _stats.record(None)
+        return None
+
+    for intent, pattern, build_sql in _TEMPLATES:
+        match = pattern.fullmatch(rest)
+        if match is None:
+            continue
+        keyword = match.groupdict().get("keyword")
+        if keyword and keyword not in (keywords or {}):
+            continue
+        if not 1 <= count_slot(match, 1) <= MAX_N:
+            continue
+        sql_query = build_sql(
+            match,
+            ids_filter(client_id, bank_id, account_id),
+            period,
+            (keywords or {}).get(keyword),
+        )
+        _stats.record(intent)
+        return SqlTemplateOutput(intent=intent, sql_query=sql_query)
+
+    _stats.record(None)
+    return None
+
+
+if __name__ == "__main__":
+    # Test match_sql_template locally
+    keywords = {
+        "groceries": [("category", "groceries")],
+        "amazon": [("merchant", "amazon")],
+        "starbucks": [("merchant", "starbucks")],
+        "uber": [("merchant", "uber")],
+        "restaurants": [("category", "restaurants")],
+    }
+    for rewritten_query in [
+        "List the top 3 categories I spent the most on in March 2024",
+        "How much did I spend on groceries last month?",
+        "Show my last 5 transactions at Amazon",
+        "What is my spending on groceries per month in 2023?",
+    ]:
+        response = match_sql_template(
+            rewritten_query=rewritten_query,
+            client_id=2,
+            bank_id=1,
+            account_id=1,
+            keywords=keywords,
+        )
+        print(rewritten_query)
+        print(response.sql_query if response is not None else "No template matched")
+
+    # Words that are not a category or merchant of the account take the llm path
+    for rewritten_query in [
+        "How much did I spend on weekends in March 2024?",
+        "How much did I spend on Uber rides?",
+        "How much did I spend at Starbucks on weekends?",
+        "How much did I spend on my credit card last month?",
+        "How much did I spend on dining out?",
+    ]:
+        assert (
+            match_sql_template(rewritten_query, 2, 1, 1, keywords=keywords) is None
+        ), rewritten_query
+    assert match_sql_template("How much did I spend on groceries?", 2, 1, 1) is None
+
+    # One row for "last transaction", a few for "last transactions"
+    for rewritten_query, limit in [
+        ("What was my last transaction?", "LIMIT 1"),
+        ("Show my last transaction at Amazon", "LIMIT 1"),
+        ("Show my last transactions at Amazon", f"LIMIT {DEFAULT_LAST_N}"),
+        ("Show my last 3 transactions", "LIMIT 3"),
+    ]:
+        response = match_sql_template(rewritten_query, 2, 1, 1, keywords=keywords)
+        assert response.sql_query.endswith(limit), (rewritten_query, response)
+    print(get_sql_template_stats().stats())
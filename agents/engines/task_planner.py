@@ -1,9 +1,10 @@
 from utils.models import load_llm
 from constants.models import TASK_PLANNER_SYSTEM_PROMPT
-from constants.db import DB_TABLE_SCHEMA
+from constants.db import DB_TABLE_SCHEMA, DB_SUMMARY_TABLES_SCHEMA
 from pydantic import BaseModel, Field
-from typing import List, Union
+from typing import Any, Dict, List, Union
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import logging
@@ -40,24 +41,37 @@ class TaskPlannerOutput(BaseModel):
     )
 
 
+TASK_PLANNER_PROMPT = ChatPromptTemplate.from_messages(
+    ("system", TASK_PLANNER_SYSTEM_PROMPT)
+)
+
+
+def build_task_planner_chain(llm) -> Runnable:
+    return TASK_PLANNER_PROMPT | llm.with_structured_output(TaskPlannerOutput)
+
+
+def plan_task_inputs(
+    rewritten_query: str, client_id: int, bank_id: int, account_id: int
+) -> Dict[str, Any]:
+    return {
+        "client_id": client_id,
+        "bank_id": bank_id,
+        "account_id": account_id,
+        "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ),
+        "rewritten_query": rewritten_query,
+        "schema": DB_TABLE_SCHEMA,
+        "summary_schema": DB_SUMMARY_TABLES_SCHEMA,
+    }
+
+
 def plan_task(
-    llm, rewritten_query: str, client_id: int, bank_id: int, account_id: int
+    chain: Runnable, rewritten_query: str, client_id: int, bank_id: int, account_id: int
 ) -> Union[TaskPlannerOutput, str]:
-    prompt = ChatPromptTemplate.from_messages(("system", TASK_PLANNER_SYSTEM_PROMPT))
-    chain = prompt | llm
-
     try:
         response = chain.invoke(
-            {
-                "client_id": client_id,
-                "bank_id": bank_id,
-                "account_id": account_id,
-                "date_time": datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                ),
-                "rewritten_query": rewritten_query,
-                "schema": DB_TABLE_SCHEMA,
-            }
+            plan_task_inputs(rewritten_query, client_id, bank_id, account_id)
         )
         return response
     except Exception as e:
@@ -66,16 +80,30 @@ def plan_task(
         return error_msg
 
 
+# Async entry point for the graph, so the llm call doesn't hold a worker thread
+async def aplan_task(
+    chain: Runnable, rewritten_query: str, client_id: int, bank_id: int, account_id: int
+) -> Union[TaskPlannerOutput, str]:
+    try:
+        response = await chain.ainvoke(
+            plan_task_inputs(rewritten_query, client_id, bank_id, account_id)
+        )
+        return response
+    except Exception as e:
+        error_msg = f"Unexpected error occurred when executing 'aplan_task': {e}"
+        logger.info(error_msg)
+        return error_msg
+
+
 if __name__ == "__main__":
     # Test plan_task locally
-    llm = load_llm()
-    llm = llm.with_structured_output(TaskPlannerOutput)
+    chain = build_task_planner_chain(load_llm())
     client_id = 2
     bank_id = 1
     account_id = 1
     rewritten_query = "List the top 3 categories I saved most on July 2023"
     response = plan_task(
-        llm=llm,
+        chain=chain,
         rewritten_query=rewritten_query,
         client_id=client_id,
         bank_id=bank_id,
@@ -1,20 +1,41 @@
 from utils.models import load_llm_with_cache, load_llm_with_stream
-from constants.db import DB_EXECUTE_SQL_QUERY_URL
-from engines.query_analyzer import QueryAnalyzerOutput, analyze_query
-from engines.query_rewriter import QueryRewriterOutput, rewrite_query
-from engines.task_planner import TaskPlannerOutput, plan_task
+from utils.db_client import DbClient, create_db_client
+from utils.plan_cache import get_sql_plan_cache, sql_plan_key
+from utils.chat_history import ChatHistoryManager
+from utils.checkpointer import create_checkpointer
+from constants.graph import (
+    SPECULATIVE_REWRITE,
+    FUSED_PLAN_SQL,
+    SQL_PLAN_CACHE_ENABLED,
+    SQL_TEMPLATES_ENABLED,
+    CHAT_HISTORY_MANAGED,
+    CHAT_HISTORY_TOKEN_BUDGETS,
+)
+from engines.query_analyzer import aanalyze_query, build_query_analyzer_chain
+from engines.query_rewriter import arewrite_query, build_query_rewriter_chain
+from engines.task_planner import aplan_task, build_task_planner_chain
 from engines.sql_query_generator import (
-    SqlQueryGeneratorOutput,
-    generate_sql_query,
+    agenerate_sql_query,
+    build_sql_query_generator_chain,
+)
+from engines.plan_sql_generator import (
+    aplan_and_generate_sql_query,
+    build_plan_sql_generator_chain,
 )
-from engines.response_crafter import craft_response
-from engines.conversational_responder import respond_conversational
-from langgraph.checkpoint.memory import MemorySaver
+from engines.sql_template_matcher import SqlTemplateKeywords, match_sql_template
+from engines.response_crafter import build_response_crafter_chain, craft_response
+from engines.conversational_responder import (
+    build_conversational_responder_chain,
+    respond_conversational,
+)
+from engines.history_summarizer import build_history_summarizer_chain
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import END, StateGraph
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import HumanMessage, AIMessage
-from typing import TypedDict, List, Union, Any, Literal
-import requests
+from typing import TypedDict, List, Dict, Union, Any, Literal, Tuple
+from time import perf_counter
+import asyncio
 import logging
 
 
@@ -36,22 +57,84 @@ class AgentState(TypedDict):
     query_understanding: str
     expected_output_structure: str
     sql_query: str
-    database_results: List[Any]
+    database_results: Dict[str, List[Any]]
+    database_status: str
+    sql_template_hit: bool
+    sql_plan_cache_hit: bool
     answer: str
 
 
-def create_multi_agents() -> StateGraph.compile:
-    # Initialize memory
-    memory = MemorySaver()
+# Await a node's coroutine, along with how long it took in milliseconds
+async def timed(coroutine) -> Tuple[Any, float]:
+    start = perf_counter()
+    result = await coroutine
+    return result, (perf_counter() - start) * 1000
+
+
+# The models, db client and checkpointer are loaded from the configuration unless given (e.g. by benchmark.py)
+def create_multi_agents(
+    llm_stream=None,
+    llm_cache=None,
+    db_client: DbClient = None,
+    speculative: bool = SPECULATIVE_REWRITE,
+    fused: bool = FUSED_PLAN_SQL,
+    plan_cache: bool = SQL_PLAN_CACHE_ENABLED,
+    templates: bool = SQL_TEMPLATES_ENABLED,
+    managed_history: bool = CHAT_HISTORY_MANAGED,
+    checkpointer: BaseCheckpointSaver = None,
+) -> StateGraph.compile:
+    # Initialize memory, bounded per thread and in total (see utils/checkpointer.py)
+    memory = checkpointer or create_checkpointer()
+
+    llm_stream = llm_stream or load_llm_with_stream()
+    llm_cache = llm_cache or load_llm_with_cache()
+    # One db client per graph, its connection pool is shared by all concurrent chats
+    db_client = db_client or create_db_client()
+    sql_plan_cache = get_sql_plan_cache()
+    template_keywords = SqlTemplateKeywords(db_client)
+
+    # Chains are built once per graph, not per turn: parsing the prompts and binding the output
+    # schemas to the llm costs more cpu than everything else a node does
+    query_analyzer_chain = build_query_analyzer_chain(llm_cache)
+    query_rewriter_chain = build_query_rewriter_chain(llm_cache)
+    task_planner_chain = build_task_planner_chain(llm_cache)
+    sql_query_generator_chain = build_sql_query_generator_chain(llm_cache)
+    plan_sql_generator_chain = build_plan_sql_generator_chain(llm_cache)
+    response_crafter_chain = build_response_crafter_chain(llm_stream)
+    conversational_responder_chain = build_conversational_responder_chain(llm_stream)
+    # Summaries are made outside of any node, so the streaming llm's tokens are never streamed
+    # back, and are not looked up in the semantic cache where similar histories would collide
+    history_manager = ChatHistoryManager(build_history_summarizer_chain(llm_stream))
 
-    llm_stream = load_llm_with_stream()
-    llm_cache = load_llm_with_cache()
+    # The chat history given to a node's prompt, within the node's token budget
+    def chat_history(state: AgentState, config: RunnableConfig, node: str):
+        if not managed_history:
+            return state["messages"]
+        return history_manager.history(
+            thread_id=config["configurable"]["thread_id"],
+            messages=state["messages"],
+            token_budget=CHAT_HISTORY_TOKEN_BUDGETS[node],
+        )
+
+    def state_sql_plan_key(state: AgentState):
+        return sql_plan_key(
+            rewritten_query=state["rewritten_query"],
+            client_id=state["client_id"],
+            bank_id=state["bank_id"],
+            account_id=state["account_id"],
+        )
 
-    def execute_analyze_query(state: AgentState):
-        analyze_result = analyze_query(
-            llm=llm_cache.with_structured_output(QueryAnalyzerOutput),
+    async def execute_analyze_query(state: AgentState, config: RunnableConfig):
+        # Every turn starts here, so this is where older turns get folded into the summary
+        if managed_history:
+            history_manager.update_summary(
+                thread_id=config["configurable"]["thread_id"],
+                messages=state["messages"],
+            )
+        analyze_result = await aanalyze_query(
+            chain=query_analyzer_chain,
             query=state["query"],
-            chat_history=state["messages"],
+            chat_history=chat_history(state, config, "query_analyzer"),
         )
         logger.info(f"Query Analyze Result: {analyze_result.classified_result}\n\n")
         return {
@@ -59,11 +142,11 @@ def create_multi_agents() -> StateGraph.compile:
             "query_classified_reason": analyze_result.classified_reason,
         }
 
-    def execute_rewrite_query(state: AgentState):
-        rewrite_result = rewrite_query(
-            llm=llm_cache.with_structured_output(QueryRewriterOutput),
+    async def execute_rewrite_query(state: AgentState, config: RunnableConfig):
+        rewrite_result = await arewrite_query(
+            chain=query_rewriter_chain,
             query=state["query"],
-            chat_history=state["messages"],
+            chat_history=chat_history(state, config, "query_rewriter"),
             rewritten_query=state["rewritten_query"],
         )
         logger.info(f"Rewritten Query: {rewrite_result.rewritten_query}")
@@ -73,9 +156,43 @@ def create_multi_agents() -> StateGraph.compile:
             "rewritten_query_reason": rewrite_result.reasoning,
         }
 
-    def execute_plan_task(state: AgentState):
-        action_plan = plan_task(
-            llm=llm_cache.with_structured_output(TaskPlannerOutput),
+    # Analysis and rewrite both only need the query and the chat history, so in speculative mode
+    # the rewrite runs alongside the analysis. Its result is kept for transactional queries and
+    # thrown away (cancelling the llm call if still running) for the conversational path.
+    async def execute_analyze_and_rewrite_query(
+        state: AgentState, config: RunnableConfig
+    ):
+        start = perf_counter()
+        rewrite_task = asyncio.create_task(timed(execute_rewrite_query(state, config)))
+        try:
+            analyze_update = await execute_analyze_query(state, config)
+        except BaseException:
+            rewrite_task.cancel()
+            raise
+        analysis_ms = (perf_counter() - start) * 1000
+
+        if analyze_update["query_classified_result"] != "valid_transactional":
+            if rewrite_task.done() and not rewrite_task.exception():
+                wasted_ms = rewrite_task.result()[1]
+            else:
+                rewrite_task.cancel()
+                wasted_ms = analysis_ms
+            await asyncio.gather(rewrite_task, return_exceptions=True)
+            logger.info(
+                f"Speculative rewrite discarded, {wasted_ms:.0f} ms of rewriting wasted\n\n"
+            )
+            return analyze_update
+
+        rewrite_update, rewrite_ms = await rewrite_task
+        saved_ms = analysis_ms + rewrite_ms - (perf_counter() - start) * 1000
+        logger.info(
+            f"Speculative rewrite kept, {saved_ms:.0f} ms saved over analyzing then rewriting\n\n"
+        )
+        return {**analyze_update, **rewrite_update}
+
+    async def execute_plan_task(state: AgentState):
+        action_plan = await aplan_task(
+            chain=task_planner_chain,
             rewritten_query=state["rewritten_query"],
             client_id=state["client_id"],
             bank_id=state["bank_id"],
@@ -92,9 +209,9 @@ def create_multi_agents() -> StateGraph.compile:
             "expected_output_structure": action_plan.expected_output_structure,
         }
 
-    def execute_generate_sql_query(state: AgentState):
-        sql_query = generate_sql_query(
-            llm=llm_cache.with_structured_output(SqlQueryGeneratorOutput),
+    async def execute_generate_sql_query(state: AgentState):
+        sql_query = await agenerate_sql_query(
+            chain=sql_query_generator_chain,
             rewritten_query=state["rewritten_query"],
             action_plan=state["action_plan"],
             query_understanding=state["query_understanding"],
@@ -106,34 +223,103 @@ def create_multi_agents() -> StateGraph.compile:
         logger.info(f"SQL Query: {sql_query.sql_query}\n\n")
         return {"sql_query": sql_query.sql_query}
 
-    def execute_sql_query_in_db(state: AgentState):
-        db_result = []
-        db_response = requests.post(
-            url=DB_EXECUTE_SQL_QUERY_URL, json={"sql_query": state["sql_query"]}
+    # Fused mode: the task plan and its sql come out of one llm call
+    async def execute_plan_and_generate_sql_query(state: AgentState):
+        plan_sql = await aplan_and_generate_sql_query(
+            chain=plan_sql_generator_chain,
+            rewritten_query=state["rewritten_query"],
+            client_id=state["client_id"],
+            bank_id=state["bank_id"],
+            account_id=state["account_id"],
         )
-        if db_response.status_code == 200 and db_response.json()["status"] == "success":
-            db_result = db_response.json()["formatted_results"]
-            logger.info(f"Database Results: {db_result}")
-            return {"database_results": db_result}
-        else:
-            return {"database_results": db_result}
+        action_plan = plan_sql.task_plan
+        logger.info(f"Query Understanding: {action_plan.query_understanding}")
+        logger.info(f"Action Plan: {action_plan.execution_plan}")
+        logger.info(
+            f"Expected Output Structure: {action_plan.expected_output_structure}"
+        )
+        logger.info(f"SQL Query: {plan_sql.generated_sql.sql_query}\n\n")
+        return {
+            "action_plan": action_plan.execution_plan,
+            "query_understanding": action_plan.query_understanding,
+            "expected_output_structure": action_plan.expected_output_structure,
+            "sql_query": plan_sql.generated_sql.sql_query,
+        }
+
+    # Frequent intents get their sql from a template, anything a template does not fully
+    # explain goes on to the llm path (see engines/sql_template_matcher.py)
+    async def execute_match_sql_template(state: AgentState):
+        keywords = await template_keywords.get(
+            client_id=state["client_id"],
+            bank_id=state["bank_id"],
+            account_id=state["account_id"],
+        )
+        template = match_sql_template(
+            rewritten_query=state["rewritten_query"],
+            client_id=state["client_id"],
+            bank_id=state["bank_id"],
+            account_id=state["account_id"],
+            keywords=keywords,
+        )
+        if template is None:
+            return {"sql_template_hit": False}
+        logger.info(f"SQL Template Hit ({template.intent}): {template.sql_query}\n\n")
+        return {
+            "action_plan": [],
+            "query_understanding": f"Answered by the {template.intent} sql template.",
+            "expected_output_structure": "",
+            "sql_query": template.sql_query,
+            "sql_template_hit": True,
+        }
+
+    # The same rewritten query, ids and date window always get the same sql, so a cached plan
+    # skips task planning and sql generation altogether (see utils/plan_cache.py)
+    def execute_lookup_sql_plan(state: AgentState):
+        plan = sql_plan_cache.get(state_sql_plan_key(state))
+        if plan is None:
+            return {"sql_plan_cache_hit": False}
+        logger.info(f"SQL Plan Cache Hit: {plan['sql_query']}\n\n")
+        return {**plan, "sql_plan_cache_hit": True}
+
+    # Results stay columnar, next to the db verdict for the response crafter (see utils/db_client.py)
+    async def execute_sql_query_in_db(state: AgentState):
+        db_result, db_status = await db_client.execute_sql_query(state["sql_query"])
+        logger.info(f"Database Results: {db_result}")
+        # Only llm planned sql that ran successfully is worth reusing
+        if (
+            plan_cache
+            and db_status in ("success", "truncated")
+            and not state["sql_plan_cache_hit"]
+            and not state["sql_template_hit"]
+        ):
+            sql_plan_cache.put(
+                state_sql_plan_key(state),
+                {
+                    "action_plan": state["action_plan"],
+                    "query_understanding": state["query_understanding"],
+                    "expected_output_structure": state["expected_output_structure"],
+                    "sql_query": state["sql_query"],
+                },
+            )
+        return {"database_results": db_result, "database_status": db_status}
 
     async def execute_craft_response(state: AgentState, config: RunnableConfig):
         answer = await craft_response(
-            llm=llm_stream,
+            chain=response_crafter_chain,
             rewritten_query=state["rewritten_query"],
             database_results=state["database_results"],
+            database_status=state["database_status"],
             config=config,
         )
         return {"answer": answer}
 
     async def execute_respond_conversational(state: AgentState, config: RunnableConfig):
         response = await respond_conversational(
-            llm=llm_stream,
+            chain=conversational_responder_chain,
             query=state["query"],
             classified_result=state["query_classified_result"],
             classified_reason=state["query_classified_reason"],
-            chat_history=state["messages"],
+            chat_history=chat_history(state, config, "conversational_responder"),
             config=config,
         )
         return {"answer": response}
@@ -145,25 +331,68 @@ def create_multi_agents() -> StateGraph.compile:
         else:
             return "conversational"
 
+    def sql_template_routing(state: AgentState) -> Literal["hit", "miss"]:
+        return "hit" if state["sql_template_hit"] else "miss"
+
+    def sql_plan_routing(state: AgentState) -> Literal["hit", "miss"]:
+        return "hit" if state["sql_plan_cache_hit"] else "miss"
+
     workflow = StateGraph(AgentState)
 
-    workflow.add_node("query_analyzer", execute_analyze_query)
+    if speculative:
+        workflow.add_node("query_analyzer", execute_analyze_and_rewrite_query)
+    else:
+        workflow.add_node("query_analyzer", execute_analyze_query)
+        workflow.add_node("query_rewriter", execute_rewrite_query)
     workflow.add_node("conversational_responder", execute_respond_conversational)
-    workflow.add_node("query_rewriter", execute_rewrite_query)
-    workflow.add_node("task_planner", execute_plan_task)
-    workflow.add_node("sql_query_generator", execute_generate_sql_query)
+    if fused:
+        workflow.add_node("plan_sql_generator", execute_plan_and_generate_sql_query)
+        planner = "plan_sql_generator"
+    else:
+        workflow.add_node("task_planner", execute_plan_task)
+        workflow.add_node("sql_query_generator", execute_generate_sql_query)
+        planner = "task_planner"
+    # Rewritten queries go through the templates, then the plan cache, when enabled
+    after_template = planner
+    if plan_cache:
+        workflow.add_node("sql_plan_cache", execute_lookup_sql_plan)
+        after_template = "sql_plan_cache"
+    after_rewrite = after_template
+    if templates:
+        workflow.add_node("sql_template", execute_match_sql_template)
+        after_rewrite = "sql_template"
     workflow.add_node("sql_query_executor", execute_sql_query_in_db)
     workflow.add_node("response_crafter", execute_craft_response)
 
+    # The speculative analyzer has already rewritten transactional queries
     workflow.add_conditional_edges(
         "query_analyzer",
         initial_routing,
-        {"rewrite": "query_rewriter", "conversational": "conversational_responder"},
+        {
+            "rewrite": after_rewrite if speculative else "query_rewriter",
+            "conversational": "conversational_responder",
+        },
     )
 
-    workflow.add_edge("query_rewriter", "task_planner")
-    workflow.add_edge("task_planner", "sql_query_generator")
-    workflow.add_edge("sql_query_generator", "sql_query_executor")
+    if not speculative:
+        workflow.add_edge("query_rewriter", after_rewrite)
+    if templates:
+        workflow.add_conditional_edges(
+            "sql_template",
+            sql_template_routing,
+            {"hit": "sql_query_executor", "miss": after_template},
+        )
+    if plan_cache:
+        workflow.add_conditional_edges(
+            "sql_plan_cache",
+            sql_plan_routing,
+            {"hit": "sql_query_executor", "miss": planner},
+        )
+    if fused:
+        workflow.add_edge("plan_sql_generator", "sql_query_executor")
+    else:
+        workflow.add_edge("task_planner", "sql_query_generator")
+        workflow.add_edge("sql_query_generator", "sql_query_executor")
     workflow.add_edge("sql_query_executor", "response_crafter")
 
     workflow.add_edge("conversational_responder", END)
@@ -0,0 +1,118 @@
+from function import create_multi_agents
+from benchmark import QUERIES, SimulatedDbClient, initial_state, simulated_outputs
+from overhead_benchmark import mock_llm, mock_openai_transport
+from utils.prompt_cache import get_prompt_cache_callback
+from langchain_core.messages import AIMessage, HumanMessage
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import uuid
+import logging
+
+# A crafted answer of typical length, kept in the client-side history after every turn
+SESSION_ANSWER = """Here are your top 3 spending categories for last month:
+
+| Category | Amount | Transactions |
+|----------|--------|--------------|
+| Groceries | 412.35 | 14 |
+| Dining | 268.90 | 9 |
+| Transport | 143.10 | 21 |
+
+Groceries made up almost half of your spending, mostly at your usual supermarket. Dining went up
+compared to the month before, while transport stayed about the same. Let me know if you want a
+breakdown by merchant or a comparison with earlier months."""
+
+NODES = ["query_analyzer", "query_rewriter", "task_planner", "sql_query_generator", "response_crafter"]  # fmt: skip
+
+
+# One long chat session on a single thread, the client sending the whole conversation every
+# turn like app.py does. Returns the prompt tokens of every turn, per node and for all llm
+# calls, the summaries made in the background included.
+async def run_session(managed_history: bool, args) -> List[Dict]:
+    prompt_tokens: List[int] = []
+    transport = mock_openai_transport(
+        simulated_outputs(args.client_id, args.bank_id, args.account_id),
+        prompt_tokens,
+    )
+    graph = create_multi_agents(
+        llm_stream=mock_llm(transport, streaming=True),
+        llm_cache=mock_llm(transport, streaming=False),
+        db_client=SimulatedDbClient(0),
+        plan_cache=False,
+        templates=False,
+        managed_history=managed_history,
+    )
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    history = []
+    turns = []
+    for turn in range(args.turns):
+        query = QUERIES[turn % len(QUERIES)]
+        state = initial_state(query, args.client_id, args.bank_id, args.account_id)
+        state["messages"] = history + [HumanMessage(content=query)]
+        calls = len(prompt_tokens)
+        with get_prompt_cache_callback() as cb:
+            await graph.ainvoke(input=state, config=config)
+        # In production a summary is made while the turn's own llm calls are in flight, the
+        # mocked ones answer instantly so let it finish before the next turn
+        await asyncio.sleep(0.05)
+        usage = cb.usage.stats()
+        turns.append(
+            {
+                "turn": turn + 1,
+                "messages": len(state["messages"]),
+                "nodes": {
+                    node: usage.get(node, {}).get("prompt_tokens", 0) for node in NODES
+                },
+                "all_calls": sum(prompt_tokens[calls:]),
+            }
+        )
+        history = state["messages"] + [AIMessage(content=SESSION_ANSWER)]
+    return turns
+
+
+def print_session(title: str, turns: List[Dict], every: int):
+    print(title)
+    print(
+        f"{'turn':>5}{'messages':>10}"
+        + "".join(f"{node[:14]:>16}" for node in NODES)
+        + f"{'all calls':>12}"
+    )
+    for result in turns:
+        if result["turn"] % every and result["turn"] != 1:
+            continue
+        print(
+            f"{result['turn']:>5}{result['messages']:>10}"
+            + "".join(f"{result['nodes'][node]:>16}" for node in NODES)
+            + f"{result['all_calls']:>12}"
+        )
+
+
+async def main(args):
+    full = await run_session(False, args)
+    managed = await run_session(True, args)
+
+    print(
+        f"Prompt tokens per turn over a {args.turns}-turn session, mocked openai transport"
+    )
+    print_session("Full chat history", full, args.every)
+    print_session("Managed chat history", managed, args.every)
+    if args.json:
+        args.json.write_text(json.dumps({"full": full, "managed": managed}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the prompt tokens per turn of a long chat session, with the full or the managed chat history"
+    )
+    parser.add_argument("--turns", type=int, default=50, help="Turns in the session")
+    parser.add_argument("--every", type=int, default=5, help="Print every n-th turn")
+    parser.add_argument("--client-id", type=int, default=1)
+    parser.add_argument("--bank-id", type=int, default=1)
+    parser.add_argument("--account-id", type=int, default=1)
+    parser.add_argument("--json", type=Path, default=None, help="Write results here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
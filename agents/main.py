@@ -2,8 +2,13 @@ import os
 import warnings
 import logging
 from function import create_multi_agents
+from utils.db_client import create_db_client
+from utils.plan_cache import get_sql_plan_cache
+from engines.sql_template_matcher import get_sql_template_stats
+from utils.prompt_cache import get_prompt_cache_callback, get_prompt_cache_usage
 import sys
 from typing import List, Union, AsyncGenerator
+from contextlib import asynccontextmanager
 import json
 from langchain_core.messages import HumanMessage, AIMessage
 from pydantic import BaseModel
@@ -60,15 +65,26 @@ class AgentsRequest(BaseModel):
     account_id: int
 
 
+# One db client for the graph, its pooled connections are released on shutdown
+db_client = create_db_client()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await db_client.aclose()
+
+
 # Initialize fastapi
 app = FastAPI(
     title="Financial Chatbot API",
     description="APIs for responding queries and check health",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Initialize the graph
-graph = create_multi_agents()
+graph = create_multi_agents(db_client=db_client)
 
 
 async def generate_stream(request: AgentsRequest) -> AsyncGenerator[str, None]:
@@ -93,14 +109,18 @@ async def generate_stream(request: AgentsRequest) -> AsyncGenerator[str, None]:
         "query_understanding": "",
         "expected_output_structure": "",
         "sql_query": "",
-        "database_results": [],
+        "database_results": {"columns": [], "rows": []},
+        "database_status": "",
+        "sql_template_hit": False,
+        "sql_plan_cache_hit": False,
         "answer": "",
     }
 
     start = perf_counter()
 
-    # Initialize openai callback function to track tokens and costs info
-    with get_openai_callback() as cb:
+    # Initialize openai callback function to track tokens and costs info, and the prompt
+    # cache callback to track the cached prompt tokens of each node
+    with get_openai_callback() as cb, get_prompt_cache_callback() as cache_cb:
 
         # Stream the response
         async for msg, metadata in graph.astream(
@@ -112,7 +132,8 @@ async def generate_stream(request: AgentsRequest) -> AsyncGenerator[str, None]:
         logger.info(f"Total Tokens: {cb.total_tokens}")
         logger.info(f"Prompt Tokens: {cb.prompt_tokens}")
         logger.info(f"Completion Tokens: {cb.completion_tokens}")
-        logger.info(f"Total Cost (USD): ${cb.total_cost}\n")
+        logger.info(f"Total Cost (USD): ${cb.total_cost}")
+        logger.info(f"Prompt Cache Usage: {cache_cb.usage.stats()}\n")
 
     logger.info(graph.get_state(config).values)
 
@@ -136,12 +157,14 @@ async def generate_stream(request: AgentsRequest) -> AsyncGenerator[str, None]:
             ),
             "sql_query": final_state.get("sql_query", ""),
             "database_results": str(final_state.get("database_results", "")),
+            "database_status": final_state.get("database_status", ""),
         },
         "openai_info": {
             "total_tokens": cb.total_tokens,
             "prompt_tokens": cb.prompt_tokens,
             "completion_tokens": cb.prompt_tokens,
             "total_cost": f"{cb.total_cost} USD",
+            "prompt_cache": cache_cb.usage.stats(),
         },
     }
 
@@ -172,6 +195,26 @@ async def response_query(request: AgentsRequest):
     )
 
 
+@app.get("/api/sql-plan-cache/stats")
+def sql_plan_cache_stats():
+    return get_sql_plan_cache().stats()
+
+
+@app.get("/api/sql-templates/stats")
+def sql_template_stats():
+    return get_sql_template_stats().stats()
+
+
+@app.get("/api/prompt-cache/stats")
+def prompt_cache_stats():
+    return get_prompt_cache_usage().stats()
+
+
+@app.get("/api/checkpointer/stats")
+def checkpointer_stats():
+    return graph.checkpointer.stats()
+
+
 @app.get("/api/health")
 def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,247 @@
+from function import create_multi_agents
+from benchmark import QUERIES, SimulatedDbClient, initial_state, simulated_outputs
+from constants.models import MODEL_NAME
+from engines.query_analyzer import aanalyze_query, build_query_analyzer_chain
+from engines.query_rewriter import arewrite_query, build_query_rewriter_chain
+from engines.task_planner import aplan_task, build_task_planner_chain
+from engines.sql_query_generator import (
+    agenerate_sql_query,
+    build_sql_query_generator_chain,
+)
+from engines.plan_sql_generator import (
+    aplan_and_generate_sql_query,
+    build_plan_sql_generator_chain,
+)
+from engines.response_crafter import build_response_crafter_chain, craft_response
+from engines.conversational_responder import (
+    build_conversational_responder_chain,
+    respond_conversational,
+)
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_openai import ChatOpenAI
+from pathlib import Path
+from time import perf_counter, process_time
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import httpx
+import json
+import statistics
+import uuid
+import logging
+
+ANSWER = "You spent the most on groceries."
+
+
+# Answers openai chat completion requests in-process and instantly, with the canned output of
+# the requested schema, so only the python side of each llm call (prompt formatting, schema
+# binding, request building, response parsing) is left to measure. Prompt tokens are estimated
+# from the request, about 4 characters per token, and appended to `prompt_tokens` if given.
+def mock_openai_transport(
+    outputs: Dict, prompt_tokens: Optional[List[int]] = None
+) -> httpx.MockTransport:
+    outputs_by_name = {
+        schema.__name__: output.model_dump_json()
+        for schema, output in outputs.items()
+        if schema is not None
+    }
+
+    def completion(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        response_format = body.get("response_format")
+        content = (
+            outputs_by_name[response_format["json_schema"]["name"]]
+            if response_format
+            else ANSWER
+        )
+        message = {"role": "assistant", "content": content}
+        tokens = sum(len(str(m["content"])) for m in body["messages"]) // 4
+        if prompt_tokens is not None:
+            prompt_tokens.append(tokens)
+        usage = {
+            "prompt_tokens": tokens,
+            "completion_tokens": 1,
+            "total_tokens": tokens + 1,
+        }
+        if not body.get("stream"):
+            return httpx.Response(
+                200,
+                json={
+                    "id": "benchmark",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [
+                        {"index": 0, "message": message, "finish_reason": "stop"}
+                    ],
+                    "usage": usage,
+                },
+            )
+        chunks = [
+            {"choices": [{"index": 0, "delta": message, "finish_reason": None}]},
+            {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+            {"choices": [], "usage": usage},
+        ]
+        events = "".join(
+            "data: "
+            + json.dumps(
+                {
+                    "id": "benchmark",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    **chunk,
+                }
+            )
+            + "\n\n"
+            for chunk in chunks
+        )
+        return httpx.Response(
+            200,
+            content=(events + "data: [DONE]\n\n").encode(),
+            headers={"content-type": "text/event-stream"},
+        )
+
+    return httpx.MockTransport(completion)
+
+
+def mock_llm(transport: httpx.MockTransport, streaming: bool) -> ChatOpenAI:
+    return ChatOpenAI(
+        model=MODEL_NAME,
+        temperature=0,
+        api_key="benchmark",
+        streaming=streaming,
+        stream_usage=streaming,
+        http_client=httpx.Client(transport=transport),
+        http_async_client=httpx.AsyncClient(transport=transport),
+    )
+
+
+# One call of every engine with fixed arguments, given its chain
+def engine_calls(args) -> List[Tuple[str, Callable, bool, Callable]]:
+    rewritten_query = QUERIES[0]
+    ids = {
+        "client_id": args.client_id,
+        "bank_id": args.bank_id,
+        "account_id": args.account_id,
+    }
+    chat_history = [HumanMessage(content=rewritten_query)]
+    config = RunnableConfig()
+    return [
+        ("query_analyzer", build_query_analyzer_chain, False, lambda chain: aanalyze_query(chain, rewritten_query, chat_history)),
+        ("query_rewriter", build_query_rewriter_chain, False, lambda chain: arewrite_query(chain, rewritten_query, chat_history, "")),
+        ("task_planner", build_task_planner_chain, False, lambda chain: aplan_task(chain, rewritten_query, **ids)),
+        ("sql_query_generator", build_sql_query_generator_chain, False, lambda chain: agenerate_sql_query(chain, rewritten_query, [], "", "", **ids)),
+        ("plan_sql_generator", build_plan_sql_generator_chain, False, lambda chain: aplan_and_generate_sql_query(chain, rewritten_query, **ids)),
+        ("response_crafter", build_response_crafter_chain, True, lambda chain: craft_response(chain, rewritten_query, {"columns": [], "rows": []}, "success", config)),
+        ("conversational_responder", build_conversational_responder_chain, True, lambda chain: respond_conversational(chain, rewritten_query, "general", "", chat_history, config)),
+    ]  # fmt: skip
+
+
+async def cpu_ms(call) -> float:
+    start = process_time()
+    await call()
+    return (process_time() - start) * 1000
+
+
+# Median cpu per engine call when the chain is built for the call, as the engines used to do,
+# against a chain built once beforehand, as the graph does now. Samples alternate between both.
+async def measure_engines(llm_cache, llm_stream, args) -> List[Dict]:
+    results = []
+    for name, build_chain, streaming, call in engine_calls(args):
+        llm = llm_stream if streaming else llm_cache
+        chain = build_chain(llm)
+        per_call, prebuilt = [], []
+        for sample in range(args.warmup + args.turns):
+            per_call_ms = await cpu_ms(lambda: call(build_chain(llm)))
+            prebuilt_ms = await cpu_ms(lambda: call(chain))
+            if sample >= args.warmup:
+                per_call.append(per_call_ms)
+                prebuilt.append(prebuilt_ms)
+        results.append(
+            {
+                "engine": name,
+                "per_call_ms": statistics.median(per_call),
+                "prebuilt_ms": statistics.median(prebuilt),
+            }
+        )
+    return results
+
+
+# Each turn runs on a fresh thread so the chat history, and with it the prompts, stay the same size
+async def measure_turns(graph, args) -> Dict[str, float]:
+    cpu_ms, wall_ms = [], []
+    for turn in range(args.warmup + args.turns):
+        state = initial_state(
+            QUERIES[turn % len(QUERIES)], args.client_id, args.bank_id, args.account_id
+        )
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        cpu_start, wall_start = process_time(), perf_counter()
+        await graph.ainvoke(input=state, config=config)
+        if turn >= args.warmup:
+            cpu_ms.append((process_time() - cpu_start) * 1000)
+            wall_ms.append((perf_counter() - wall_start) * 1000)
+    return {
+        "cpu_ms": statistics.fmean(cpu_ms),
+        "cpu_p50_ms": statistics.median(cpu_ms),
+        "wall_ms": statistics.fmean(wall_ms),
+    }
+
+
+async def main(args):
+    transport = mock_openai_transport(
+        simulated_outputs(args.client_id, args.bank_id, args.account_id)
+    )
+    llm_cache = mock_llm(transport, streaming=False)
+    llm_stream = mock_llm(transport, streaming=True)
+    graph = create_multi_agents(
+        llm_stream=llm_stream,
+        llm_cache=llm_cache,
+        db_client=SimulatedDbClient(0),
+        fused=args.fused,
+        plan_cache=False,
+        templates=False,
+    )
+
+    engines = await measure_engines(llm_cache, llm_stream, args)
+    turn = await measure_turns(graph, args)
+
+    print(f"Python-side cpu over {args.turns} calls and turns, mocked openai transport")
+    print(f"{'engine':<26}{'chain per call':>16}{'prebuilt chain':>16}{'saved':>10}")
+    for result in engines:
+        print(
+            f"{result['engine']:<26}{result['per_call_ms']:>13.2f} ms"
+            f"{result['prebuilt_ms']:>13.2f} ms"
+            f"{result['per_call_ms'] - result['prebuilt_ms']:>7.2f} ms"
+        )
+    planning = "fused planning" if args.fused else "two-step planning"
+    print(
+        f"Graph turn with prebuilt chains, {planning}: {turn['cpu_ms']:.2f} ms mean, "
+        f"{turn['cpu_p50_ms']:.2f} ms p50 cpu"
+    )
+    if args.json:
+        args.json.write_text(json.dumps({"engines": engines, "turn": turn}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the python-side cpu cost of a chat turn, without llm or db latency"
+    )
+    parser.add_argument(
+        "--turns", type=int, default=200, help="Calls per engine and graph turns"
+    )
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Plan the task and generate its sql in one llm call",
+    )
+    parser.add_argument("--client-id", type=int, default=1)
+    parser.add_argument("--bank-id", type=int, default=1)
+    parser.add_argument("--account-id", type=int, default=1)
+    parser.add_argument("--json", type=Path, default=None, help="Write results here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
@@ -0,0 +1,197 @@
+from utils.models import load_llm
+from utils.db_client import create_db_client
+from engines.task_planner import aplan_task, build_task_planner_chain
+from engines.sql_query_generator import (
+    agenerate_sql_query,
+    build_sql_query_generator_chain,
+)
+from engines.plan_sql_generator import (
+    aplan_and_generate_sql_query,
+    build_plan_sql_generator_chain,
+)
+from langchain_community.callbacks.manager import get_openai_callback
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import statistics
+import logging
+
+# Rewritten queries, as query_rewriter hands them over, with a reference sql answering them.
+# Dates are explicit so the reference stays valid over time; they fall inside the range of the
+# synthetic databases written by db/synthetic.py.
+QUERY_CORPUS: List[Tuple[str, str]] = [
+    ("What is my current balance?", "SELECT COALESCE(SUM(credit), 0) - COALESCE(SUM(debit), 0) AS balance FROM transactions WHERE {ids}"),
+    ("How much did I spend in total in 2023?", "SELECT COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE {ids} AND strftime('%Y', transaction_date) = '2023'"),
+    ("How much income did I receive in 2024?", "SELECT COALESCE(SUM(credit), 0) AS total_income FROM transactions WHERE {ids} AND strftime('%Y', transaction_date) = '2024'"),
+    ("List the top 3 categories I spent the most on in March 2024", "SELECT category, COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE {ids} AND strftime('%Y-%m', transaction_date) = '2024-03' GROUP BY category ORDER BY total_spending DESC LIMIT 3"),
+    ("How much did I spend on amazon in 2024?", "SELECT COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE {ids} AND strftime('%Y', transaction_date) = '2024' AND (LOWER(description) LIKE '%amazon%' OR LOWER(category) LIKE '%amazon%' OR LOWER(merchant) LIKE '%amazon%')"),
+    ("What was my total spending for each month of 2023?", "SELECT strftime('%Y-%m', transaction_date) AS month, COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE {ids} AND strftime('%Y', transaction_date) = '2023' GROUP BY month ORDER BY month"),
+    ("How many transactions did I make in the groceries category in 2023?", "SELECT COUNT(*) AS transaction_count FROM transactions WHERE {ids} AND strftime('%Y', transaction_date) = '2023' AND LOWER(category) = 'groceries'"),
+    ("Show my 5 most recent transactions before 2024-07-01", "SELECT transaction_date, description, debit, credit FROM transactions WHERE {ids} AND date(transaction_date) < date('2024-07-01') ORDER BY transaction_date DESC LIMIT 5"),
+]  # fmt: skip
+
+
+def normalize_value(value: Any) -> Any:
+    return round(value, 2) if isinstance(value, float) else value
+
+
+# A generated query is correct when it returns as many rows as the reference and every
+# reference row is found, value for value, in a distinct generated row. Extra columns and
+# row order are not held against it.
+def results_match(reference: Dict, generated: Dict) -> bool:
+    if len(reference["rows"]) != len(generated["rows"]):
+        return False
+    remaining = [[normalize_value(value) for value in row] for row in generated["rows"]]
+    for row in reference["rows"]:
+        values = [normalize_value(value) for value in row]
+        match = next(
+            (
+                candidate
+                for candidate in remaining
+                if all(
+                    candidate.count(value) >= values.count(value) for value in values
+                )
+            ),
+            None,
+        )
+        if match is None:
+            return False
+        remaining.remove(match)
+    return True
+
+
+async def run_two_step(chains, rewritten_query: str, args) -> Optional[str]:
+    action_plan = await aplan_task(
+        chain=chains["task_planner"],
+        rewritten_query=rewritten_query,
+        client_id=args.client_id,
+        bank_id=args.bank_id,
+        account_id=args.account_id,
+    )
+    if isinstance(action_plan, str):
+        return None
+    sql_query = await agenerate_sql_query(
+        chain=chains["sql_query_generator"],
+        rewritten_query=rewritten_query,
+        action_plan=action_plan.execution_plan,
+        query_understanding=action_plan.query_understanding,
+        expected_output_structure=action_plan.expected_output_structure,
+        client_id=args.client_id,
+        bank_id=args.bank_id,
+        account_id=args.account_id,
+    )
+    return None if isinstance(sql_query, str) else sql_query.sql_query
+
+
+async def run_fused(chains, rewritten_query: str, args) -> Optional[str]:
+    plan_sql = await aplan_and_generate_sql_query(
+        chain=chains["plan_sql_generator"],
+        rewritten_query=rewritten_query,
+        client_id=args.client_id,
+        bank_id=args.bank_id,
+        account_id=args.account_id,
+    )
+    return None if isinstance(plan_sql, str) else plan_sql.generated_sql.sql_query
+
+
+async def benchmark_mode(name: str, run, chains, db_client, args) -> Dict:
+    ids = f"client_id = {args.client_id} AND bank_id = {args.bank_id} AND account_id = {args.account_id}"
+    cases = []
+    for _ in range(args.repeat):
+        for rewritten_query, reference_sql in QUERY_CORPUS:
+            with get_openai_callback() as cb:
+                start = perf_counter()
+                sql_query = await run(chains, rewritten_query, args)
+                latency_ms = (perf_counter() - start) * 1000
+            correct = False
+            if sql_query is not None:
+                reference, _ = await db_client.execute_sql_query(
+                    reference_sql.format(ids=ids)
+                )
+                generated, status = await db_client.execute_sql_query(sql_query)
+                correct = status == "success" and results_match(reference, generated)
+            cases.append(
+                {
+                    "query": rewritten_query,
+                    "sql_query": sql_query,
+                    "correct": correct,
+                    "latency_ms": latency_ms,
+                    "prompt_tokens": cb.prompt_tokens,
+                    "completion_tokens": cb.completion_tokens,
+                    "cost_usd": cb.total_cost,
+                }
+            )
+    latencies = sorted(case["latency_ms"] for case in cases)
+    return {
+        "mode": name,
+        "cases": cases,
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "prompt_tokens": statistics.fmean(case["prompt_tokens"] for case in cases),
+        "completion_tokens": statistics.fmean(
+            case["completion_tokens"] for case in cases
+        ),
+        "cost_usd": sum(case["cost_usd"] for case in cases),
+        "correct": sum(case["correct"] for case in cases),
+    }
+
+
+async def main(args):
+    # No semantic cache, every call reaches the model
+    llm = load_llm()
+    chains = {
+        "task_planner": build_task_planner_chain(llm),
+        "sql_query_generator": build_sql_query_generator_chain(llm),
+        "plan_sql_generator": build_plan_sql_generator_chain(llm),
+    }
+    db_client = create_db_client()
+    modes = {"two-step": run_two_step, "fused": run_fused}
+    report = []
+    try:
+        for name in args.modes:
+            report.append(
+                await benchmark_mode(name, modes[name], chains, db_client, args)
+            )
+    finally:
+        await db_client.aclose()
+
+    print(
+        f"Planning and sql generation over {len(QUERY_CORPUS)} queries x {args.repeat}"
+    )
+    print(
+        f"{'mode':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'prompt tok':>12}{'compl tok':>11}{'cost usd':>10}{'correct':>9}"
+    )
+    for result in report:
+        print(
+            f"{result['mode']:<10}{result['mean_ms']:>10.0f}{result['p50_ms']:>10.0f}"
+            f"{result['p95_ms']:>10.0f}{result['prompt_tokens']:>12.0f}"
+            f"{result['completion_tokens']:>11.0f}{result['cost_usd']:>10.4f}"
+            f"{str(result['correct']) + '/' + str(len(result['cases'])):>9}"
+        )
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the two-step planner and sql generator against the fused single call"
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["two-step", "fused"],
+        default=["two-step", "fused"],
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--client-id", type=int, default=1)
+    parser.add_argument("--bank-id", type=int, default=1)
+    parser.add_argument("--account-id", type=int, default=1)
+    parser.add_argument("--json", type=Path, default=None, help="Write results here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
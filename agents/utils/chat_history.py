@@ -0,0 +1,186 @@
+from constants.graph import CHAT_HISTORY_RECENT_TURNS, CHAT_HISTORY_MAX_THREADS
+from engines.history_summarizer import asummarize_history
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import Runnable
+from collections import OrderedDict
+from typing import Any, Dict, List
+import asyncio
+import contextvars
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Rough token count of a message, about 4 characters per token plus the message framing. Only
+# used to fit the history in a budget, so it does not need the model's tokenizer.
+def estimate_tokens(message: BaseMessage) -> int:
+    return len(str(message.content)) // 4 + 4
+
+
+# Index of the first message of the last `turns` turns, each turn starting at a user message
+def turns_start(messages: List[BaseMessage], turns: int) -> int:
+    seen = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            seen += 1
+            if seen == turns:
+                return index
+    return 0
+
+
+# The client sends the whole conversation on every request, ending with the current query. The
+# llm gets the current query and the last few turns verbatim, preceded by a summary of the older
+# turns, trimmed to a token budget per node so prompts stop growing with the conversation.
+# Summaries are kept per thread and updated in the background, off the critical path: a turn
+# uses the summary as of its start, and messages not summarized yet are sent verbatim instead.
+class ChatHistoryManager:
+    def __init__(
+        self,
+        summarizer_chain: Runnable,
+        recent_turns: int = CHAT_HISTORY_RECENT_TURNS,
+        max_threads: int = CHAT_HISTORY_MAX_THREADS,
+    ):
+        self.summarizer_chain = summarizer_chain
+        self.recent_turns = recent_turns
+        self.max_threads = max_threads
+        self._lock = threading.Lock()
+        # thread_id -> summary and the number of leading messages it covers, least recent first
+        self._threads: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.summaries = 0
+        self.summary_failures = 0
+        self.evictions = 0
+
+    # Start of the messages sent verbatim when the summary is up to date
+    def _recent_start(self, messages: List[BaseMessage]) -> int:
+        return turns_start(messages, self.recent_turns + 1)
+
+    def _summary(self, thread_id: str, messages: List[BaseMessage]) -> Dict[str, Any]:
+        thread = self._threads.get(thread_id)
+        # A history shorter than the summary was reset or edited client-side
+        if thread is None or thread["summarized"] > len(messages):
+            return {"summary": "", "summarized": 0}
+        self._threads.move_to_end(thread_id)
+        return thread
+
+    def history(
+        self, thread_id: str, messages: List[BaseMessage], token_budget: int
+    ) -> List[BaseMessage]:
+        with self._lock:
+            thread = self._summary(thread_id, messages)
+        summary, summarized = thread["summary"], thread["summarized"]
+
+        history = (
+            [SystemMessage(content=f"Summary of the earlier conversation: {summary}")]
+            if summary
+            else []
+        )
+        budget = token_budget - sum(estimate_tokens(message) for message in history)
+        start = min(summarized, self._recent_start(messages))
+
+        # Newest first, always keeping the current query
+        recent = []
+        for message in reversed(messages[start:]):
+            tokens = estimate_tokens(message)
+            if recent and tokens > budget:
+                break
+            recent.append(message)
+            budget -= tokens
+        return history + recent[::-1]
+
+    # Summarizes the messages that left the recent turns since the last summary, unless a summary
+    # of this thread is already being made
+    def update_summary(self, thread_id: str, messages: List[BaseMessage]):
+        end = self._recent_start(messages)
+        with self._lock:
+            thread = self._summary(thread_id, messages)
+            if end <= thread["summarized"] or thread_id in self._tasks:
+                return
+            # Start from an empty context: the summarizer is not part of the node that started
+            # it, so its tokens must not reach the node's callbacks or the streamed response.
+            # The task copies the context it is created in (create_task's `context` argument
+            # only exists from python 3.11).
+            self._tasks[thread_id] = contextvars.Context().run(
+                asyncio.create_task,
+                self._summarize(
+                    thread_id,
+                    thread["summary"],
+                    messages[thread["summarized"] : end],
+                    end,
+                ),
+            )
+
+    async def _summarize(
+        self,
+        thread_id: str,
+        summary: str,
+        messages: List[BaseMessage],
+        summarized: int,
+    ):
+        try:
+            new_summary = await asummarize_history(
+                chain=self.summarizer_chain, summary=summary, messages=messages
+            )
+            with self._lock:
+                if new_summary is None:
+                    self.summary_failures += 1
+                    return
+                self.summaries += 1
+                self._threads[thread_id] = {
+                    "summary": new_summary,
+                    "summarized": summarized,
+                }
+                self._threads.move_to_end(thread_id)
+                while len(self._threads) > self.max_threads:
+                    self._threads.popitem(last=False)
+                    self.evictions += 1
+        finally:
+            with self._lock:
+                self._tasks.pop(thread_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "threads": len(self._threads),
+                "summaries": self.summaries,
+                "summary_failures": self.summary_failures,
+                "summaries_in_progress": len(self._tasks),
+                "evictions": self.evictions,
+            }
+
+
+if __name__ == "__main__":
+    # Test update_summary locally: the summary is made in the background, outside the context
+    # (callbacks, streaming) of the node that started it
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    node_context = contextvars.ContextVar("node_context", default=None)
+    summarized_in = []
+
+    def summarize(prompt_value):
+        summarized_in.append(node_context.get())
+        return AIMessage(content="The user asked about their spending.")
+
+    async def main():
+        manager = ChatHistoryManager(RunnableLambda(summarize), recent_turns=1)
+        messages = []
+        for turn in range(3):
+            messages += [
+                HumanMessage(content=f"query {turn}"),
+                AIMessage(content="answer"),
+            ]
+        messages.append(HumanMessage(content="query 3"))
+
+        node_context.set("node")
+        manager.update_summary("thread", messages)
+        await asyncio.gather(*manager._tasks.values())
+
+        assert summarized_in == [None], summarized_in
+        history = manager.history("thread", messages, token_budget=1000)
+        assert history[0].content.endswith("The user asked about their spending.")
+        assert history[1:] == messages[-3:], history
+        print(manager.stats())
+
+    asyncio.run(main())
@@ -0,0 +1,660 @@
+from constants.graph import (
+    CHECKPOINTER_BACKEND,
+    CHECKPOINTS_PER_THREAD,
+    CHECKPOINT_TTL_SECONDS,
+    CHECKPOINT_MAX_THREADS,
+    CHECKPOINT_MAX_BYTES,
+    CHECKPOINT_SQLITE_PATH,
+    CHECKPOINT_PRUNE_INTERVAL_SECONDS,
+)
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langchain_core.runnables import RunnableConfig
+from collections import OrderedDict
+from pathlib import Path
+from time import monotonic, time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+import asyncio
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_config(
+    thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]
+) -> Optional[RunnableConfig]:
+    if not checkpoint_id:
+        return None
+    return {
+        "configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint_id,
+        }
+    }
+
+
+def matches_metadata(metadata: CheckpointMetadata, filter: Optional[Dict]) -> bool:
+    return not filter or all(
+        metadata.get(key) == value for key, value in filter.items()
+    )
+
+
+# A thread's checkpoints in memory, each stored serialized with its pending writes. Only the
+# latest `checkpoints_per_thread` of a thread are kept: a turn starts from the latest one, the
+# older ones (each holding the full database results of its turn) are never read again.
+# Threads are kept least recently used first. One not used within the ttl is evicted, as are
+# the least recently used ones beyond `max_threads` or while the serialized checkpoints take
+# more than `max_bytes`.
+class BoundedMemorySaver(BaseCheckpointSaver):
+    def __init__(
+        self,
+        checkpoints_per_thread: int = CHECKPOINTS_PER_THREAD,
+        ttl_seconds: float = CHECKPOINT_TTL_SECONDS,
+        max_threads: int = CHECKPOINT_MAX_THREADS,
+        max_bytes: int = CHECKPOINT_MAX_BYTES,
+    ):
+        super().__init__()
+        self.checkpoints_per_thread = checkpoints_per_thread
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # thread_id -> last use and checkpoint_ns -> checkpoint_id -> saved checkpoint
+        self._threads: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self.bytes = 0
+        self.evictions = {"ttl": 0, "max_threads": 0, "max_bytes": 0}
+        self.pruned_checkpoints = 0
+
+    def _remove_thread(self, thread_id: str):
+        thread = self._threads.pop(thread_id)
+        for checkpoints in thread["namespaces"].values():
+            for saved in checkpoints.values():
+                self.bytes -= saved["bytes"]
+
+    def _evict(self, now: float):
+        while self._threads:
+            thread_id, thread = next(iter(self._threads.items()))
+            if now - thread["accessed"] > self.ttl_seconds:
+                reason = "ttl"
+            elif len(self._threads) > self.max_threads:
+                reason = "max_threads"
+            # Never the thread being written, even when it alone is over the size
+            elif self.bytes > self.max_bytes and len(self._threads) > 1:
+                reason = "max_bytes"
+            else:
+                break
+            self._remove_thread(thread_id)
+            self.evictions[reason] += 1
+
+    # The thread's checkpoints of a namespace, marked as used, or None if there are none
+    def _checkpoints(
+        self, thread_id: str, checkpoint_ns: str, now: float
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            return None
+        if now - thread["accessed"] > self.ttl_seconds:
+            self._remove_thread(thread_id)
+            self.evictions["ttl"] += 1
+            return None
+        thread["accessed"] = now
+        self._threads.move_to_end(thread_id)
+        return thread["namespaces"].get(checkpoint_ns)
+
+    def _tuple(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: str,
+        saved: Dict[str, Any],
+        writes: List[Tuple[str, str, Tuple[str, bytes]]],
+        metadata: Optional[CheckpointMetadata] = None,
+    ) -> CheckpointTuple:
+        return CheckpointTuple(
+            config=checkpoint_config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint=self.serde.loads_typed(saved["checkpoint"]),
+            metadata=metadata or self.serde.loads_typed(saved["metadata"]),
+            parent_config=checkpoint_config(thread_id, checkpoint_ns, saved["parent"]),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed(value))
+                for task_id, channel, value in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            checkpoints = self._checkpoints(thread_id, checkpoint_ns, monotonic())
+            if not checkpoints:
+                return None
+            checkpoint_id = get_checkpoint_id(config) or max(checkpoints)
+            saved = checkpoints.get(checkpoint_id)
+            if saved is None:
+                return None
+            writes = [write[:3] for write in saved["writes"].values()]
+        return self._tuple(thread_id, checkpoint_ns, checkpoint_id, saved, writes)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        config_checkpoint_ns = (
+            config["configurable"].get("checkpoint_ns") if config else None
+        )
+        config_checkpoint_id = get_checkpoint_id(config) if config else None
+        before_checkpoint_id = get_checkpoint_id(before) if before else None
+        with self._lock:
+            thread_ids = (
+                [config["configurable"]["thread_id"]] if config else list(self._threads)
+            )
+            found = [
+                (thread_id, checkpoint_ns, checkpoint_id, saved, list(saved["writes"].values()))
+                for thread_id in thread_ids
+                if thread_id in self._threads
+                for checkpoint_ns, checkpoints in self._threads[thread_id]["namespaces"].items()
+                if config_checkpoint_ns is None or checkpoint_ns == config_checkpoint_ns
+                for checkpoint_id, saved in sorted(checkpoints.items(), reverse=True)
+                if not config_checkpoint_id or checkpoint_id == config_checkpoint_id
+                if not before_checkpoint_id or checkpoint_id < before_checkpoint_id
+            ]  # fmt: skip
+
+        for thread_id, checkpoint_ns, checkpoint_id, saved, writes in found:
+            if limit is not None and limit <= 0:
+                break
+            metadata = self.serde.loads_typed(saved["metadata"])
+            if not matches_metadata(metadata, filter):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield self._tuple(
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                saved,
+                [write[:3] for write in writes],
+                metadata,
+            )
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        saved = {
+            "checkpoint": self.serde.dumps_typed(checkpoint),
+            "metadata": self.serde.dumps_typed(metadata),
+            "parent": config["configurable"].get("checkpoint_id"),
+            "writes": {},
+        }
+        saved["bytes"] = len(saved["checkpoint"][1]) + len(saved["metadata"][1])
+
+        with self._lock:
+            now = monotonic()
+            if self._checkpoints(thread_id, checkpoint_ns, now) is None:
+                self._threads.setdefault(thread_id, {"accessed": now, "namespaces": {}})
+            checkpoints = self._threads[thread_id]["namespaces"].setdefault(
+                checkpoint_ns, {}
+            )
+            if checkpoint["id"] in checkpoints:
+                self.bytes -= checkpoints[checkpoint["id"]]["bytes"]
+            checkpoints[checkpoint["id"]] = saved
+            self.bytes += saved["bytes"]
+
+            for checkpoint_id in sorted(checkpoints)[: -self.checkpoints_per_thread]:
+                self.bytes -= checkpoints.pop(checkpoint_id)["bytes"]
+                self.pruned_checkpoints += 1
+            self._evict(now)
+
+        return checkpoint_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        serialized = [
+            (WRITES_IDX_MAP.get(channel, idx), channel, self.serde.dumps_typed(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+
+        with self._lock:
+            now = monotonic()
+            saved = (self._checkpoints(thread_id, checkpoint_ns, now) or {}).get(
+                checkpoint_id
+            )
+            # Its checkpoint was pruned or evicted meanwhile
+            if saved is None:
+                return
+            for idx, channel, value in serialized:
+                key = (task_id, idx)
+                # Regular writes are kept as first saved, special writes (errors,
+                # interrupts...) replace the previous one
+                if idx >= 0 and key in saved["writes"]:
+                    continue
+                if key in saved["writes"]:
+                    saved["bytes"] -= len(saved["writes"][key][2][1])
+                    self.bytes -= len(saved["writes"][key][2][1])
+                saved["writes"][key] = (task_id, channel, value, task_path)
+                saved["bytes"] += len(value[1])
+                self.bytes += len(value[1])
+            self._evict(now)
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            if thread_id in self._threads:
+                self._remove_thread(thread_id)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ):
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str):
+        self.delete_thread(thread_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "threads": len(self._threads),
+                "checkpoints": sum(
+                    len(checkpoints)
+                    for thread in self._threads.values()
+                    for checkpoints in thread["namespaces"].values()
+                ),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": dict(self.evictions),
+                "pruned_checkpoints": self.pruned_checkpoints,
+            }
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE INDEX IF NOT EXISTS checkpoints_updated_at ON checkpoints (updated_at);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+# Same policy as BoundedMemorySaver, on disk: checkpoints survive restarts and are shared by
+# the workers of a host. Older checkpoints of a thread are deleted as new ones are saved, and
+# at most once per `prune_interval_seconds` the threads not updated within the ttl, then the
+# least recently updated ones beyond `max_threads`. The async methods run the sqlite calls in
+# a worker thread so they do not block the event loop.
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    def __init__(
+        self,
+        path: str = CHECKPOINT_SQLITE_PATH,
+        checkpoints_per_thread: int = CHECKPOINTS_PER_THREAD,
+        ttl_seconds: float = CHECKPOINT_TTL_SECONDS,
+        max_threads: int = CHECKPOINT_MAX_THREADS,
+        prune_interval_seconds: float = CHECKPOINT_PRUNE_INTERVAL_SECONDS,
+    ):
+        super().__init__()
+        self.path = path
+        self.checkpoints_per_thread = checkpoints_per_thread
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.prune_interval_seconds = prune_interval_seconds
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._last_prune = monotonic()
+        self.evictions = {"ttl": 0, "max_threads": 0}
+        self.pruned_checkpoints = 0
+
+    def _tuple(self, row: Tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id = row[:4]
+        type_, checkpoint, metadata_type, metadata = row[4:]
+        with self._lock:
+            writes = self._conn.execute(
+                "SELECT task_id, channel, type, value FROM writes"
+                " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+                " ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            ).fetchall()
+        return CheckpointTuple(
+            config=checkpoint_config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=checkpoint_config(
+                thread_id, checkpoint_ns, parent_checkpoint_id
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,"
+            " type, checkpoint, metadata_type, metadata FROM checkpoints"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND updated_at >= ?"
+        )
+        params = [thread_id, checkpoint_ns, time() - self.ttl_seconds]
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        with self._lock:
+            row = self._conn.execute(
+                query + " ORDER BY checkpoint_id DESC LIMIT 1", params
+            ).fetchone()
+        return self._tuple(row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,"
+            " type, checkpoint, metadata_type, metadata FROM checkpoints WHERE 1 = 1"
+        )
+        params = []
+        if config:
+            query += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if (
+                checkpoint_ns := config["configurable"].get("checkpoint_ns")
+            ) is not None:
+                query += " AND checkpoint_ns = ?"
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < ?"
+            params.append(before_checkpoint_id)
+        with self._lock:
+            rows = self._conn.execute(
+                query + " ORDER BY checkpoint_id DESC", params
+            ).fetchall()
+
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            checkpoint_tuple = self._tuple(row)
+            if not matches_metadata(checkpoint_tuple.metadata, filter):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(metadata)
+
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    serialized_checkpoint,
+                    metadata_type,
+                    serialized_metadata,
+                    time(),
+                ),
+            )
+            self.pruned_checkpoints += self._conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+                " AND checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints"
+                " WHERE thread_id = ? AND checkpoint_ns = ?"
+                " ORDER BY checkpoint_id DESC LIMIT ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    thread_id,
+                    checkpoint_ns,
+                    self.checkpoints_per_thread,
+                ),
+            ).rowcount
+            self._conn.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ?"
+                " AND checkpoint_id NOT IN (SELECT checkpoint_id FROM checkpoints"
+                " WHERE thread_id = ? AND checkpoint_ns = ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+            )
+
+        if monotonic() - self._last_prune >= self.prune_interval_seconds:
+            self.prune()
+        return checkpoint_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # Regular writes are kept as first saved, special writes (errors, interrupts...)
+        # replace the previous one
+        query = (
+            "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            if all(channel in WRITES_IDX_MAP for channel, _ in writes)
+            else "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        rows = [
+            (
+                thread_id,
+                checkpoint_ns,
+                checkpoint_id,
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                *self.serde.dumps_typed(value),
+                task_path,
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(query, rows)
+
+    def _delete_threads(self, thread_ids: List[str]):
+        for thread_id in thread_ids:
+            self._conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,)
+            )
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def delete_thread(self, thread_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._delete_threads([thread_id])
+
+    # Deletes the threads not updated within the ttl, then the least recently updated beyond
+    # the maximum number of threads
+    def prune(self):
+        with self._lock, self._conn:
+            self._last_prune = monotonic()
+            self._conn.execute("BEGIN")
+            expired = [
+                thread_id
+                for (thread_id,) in self._conn.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id"
+                    " HAVING MAX(updated_at) < ?",
+                    (time() - self.ttl_seconds,),
+                )
+            ]
+            self._delete_threads(expired)
+            self.evictions["ttl"] += len(expired)
+
+            over = [
+                thread_id
+                for (thread_id,) in self._conn.execute(
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id"
+                    " ORDER BY MAX(updated_at) DESC LIMIT -1 OFFSET ?",
+                    (self.max_threads,),
+                )
+            ]
+            self._delete_threads(over)
+            self.evictions["max_threads"] += len(over)
+        if expired or over:
+            logger.info(
+                f"Checkpoints pruned: {len(expired)} expired and {len(over)} least recently used threads"
+            )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            threads, checkpoints = self._conn.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ).fetchone()
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+            return {
+                "backend": "sqlite",
+                "threads": threads,
+                "checkpoints": checkpoints,
+                "bytes": page_count * page_size,
+                "evictions": dict(self.evictions),
+                "pruned_checkpoints": self.pruned_checkpoints,
+            }
+
+
+# Pick the checkpointer backend configured through AGENTS_CHECKPOINTER_BACKEND
+def create_checkpointer(backend: str = CHECKPOINTER_BACKEND) -> BaseCheckpointSaver:
+    if backend == "memory":
+        return BoundedMemorySaver()
+    if backend == "sqlite":
+        return SqliteCheckpointSaver()
+    raise ValueError(f"Unknown checkpointer backend: {backend}")
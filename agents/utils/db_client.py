@@ -0,0 +1,232 @@
+from constants.db import (
+    DB_CLIENT_BACKEND,
+    DB_EMBEDDED_MODULE_DIR,
+    DB_STREAM_SQL_QUERY_URL,
+    DB_RESULT_PAGE_SIZE,
+    DB_RESULT_FORMAT_HEADER,
+    DB_HTTP_MAX_CONNECTIONS,
+    DB_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    DB_HTTP_KEEPALIVE_EXPIRY,
+    DB_HTTP_CONNECT_TIMEOUT,
+    DB_HTTP_READ_TIMEOUT,
+    DB_HTTP_POOL_TIMEOUT,
+    DB_HTTP_MAX_RETRIES,
+    DB_HTTP_RETRY_BACKOFF,
+    DB_HTTP_RETRY_MAX_BACKOFF,
+)
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import importlib.util
+import asyncio
+import httpx
+import json
+import random
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Query results are kept columnar ({"columns": [...], "rows": [[...], ...]}) next to the db
+# verdict ("success", "truncated", "too_expensive", "rejected" or "error"), so the response
+# crafter can tell the user why no data came back, or that only the first page of rows did
+class DbClient(ABC):
+    @abstractmethod
+    async def execute_sql_query(
+        self, sql_query: str, page_size: int = DB_RESULT_PAGE_SIZE
+    ) -> Tuple[Dict[str, List[Any]], str]:
+        pass
+
+    async def aclose(self):
+        pass
+
+
+def empty_result() -> Dict[str, List[Any]]:
+    return {"columns": [], "rows": []}
+
+
+# Raised for responses worth retrying: the db executor queue is full (503)
+class RetryableDbResponse(Exception):
+    def __init__(self, retry_after: Optional[float]):
+        super().__init__(f"Database busy, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+# Full jitter exponential backoff, never shorter than the delay the db service asked for
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    delay = random.uniform(
+        0, min(DB_HTTP_RETRY_MAX_BACKOFF, DB_HTTP_RETRY_BACKOFF * 2**attempt)
+    )
+    return max(delay, retry_after or 0)
+
+
+# Talks to the db service over one pooled async http client shared by every chat, consuming
+# its NDJSON stream batch by batch. Queries are read-only, so failed attempts are safe to
+# repeat; retries cover connection failures, timeouts and a saturated db executor.
+class HttpDbClient(DbClient):
+    def __init__(self, url: str = DB_STREAM_SQL_QUERY_URL):
+        self.url = url
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=DB_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=DB_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=DB_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                DB_HTTP_READ_TIMEOUT,
+                connect=DB_HTTP_CONNECT_TIMEOUT,
+                pool=DB_HTTP_POOL_TIMEOUT,
+            ),
+        )
+
+    async def _stream_query(
+        self, sql_query: str, page_size: int
+    ) -> Tuple[Dict[str, List[Any]], str]:
+        db_result = empty_result()
+        db_status = "success"
+        async with self._client.stream(
+            "POST",
+            self.url,
+            json={"sql_query": sql_query, "page_size": page_size},
+            headers={DB_RESULT_FORMAT_HEADER: "columnar"},
+        ) as db_response:
+            if db_response.status_code == 503:
+                retry_after = db_response.headers.get("Retry-After")
+                raise RetryableDbResponse(float(retry_after) if retry_after else None)
+            if db_response.status_code != 200:
+                logger.info(f"Database request failed: {db_response.status_code}")
+                return empty_result(), "error"
+
+            async for line in db_response.aiter_lines():
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record.get("type") == "rows":
+                    db_result["rows"].extend(record["rows"])
+                elif record.get("type") == "header":
+                    db_result["columns"] = record["columns"]
+                elif record.get("type") == "end":
+                    if record.get("next_cursor"):
+                        logger.info(
+                            f"Database results truncated at {record['row_count']} rows"
+                        )
+                        db_status = "truncated"
+                elif record.get("type") == "error" or "status" in record:
+                    # Errors arrive either as a plain status document or as the last stream line
+                    logger.info(f"Database {record['status']}: {record.get('message')}")
+                    return empty_result(), record["status"]
+
+        return db_result, db_status
+
+    async def execute_sql_query(
+        self, sql_query: str, page_size: int = DB_RESULT_PAGE_SIZE
+    ) -> Tuple[Dict[str, List[Any]], str]:
+        for attempt in range(DB_HTTP_MAX_RETRIES + 1):
+            try:
+                return await self._stream_query(sql_query, page_size)
+            except (httpx.TransportError, RetryableDbResponse) as e:
+                if attempt == DB_HTTP_MAX_RETRIES:
+                    logger.info(
+                        f"Unexpected error occurred when executing 'HttpDbClient.execute_sql_query': {e}"
+                    )
+                    return empty_result(), "error"
+                delay = retry_delay(attempt, getattr(e, "retry_after", None))
+                logger.info(
+                    f"Database request attempt {attempt + 1} failed ({e!r}), retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+            except (httpx.HTTPError, json.JSONDecodeError) as e:
+                logger.info(
+                    f"Unexpected error occurred when executing 'HttpDbClient.execute_sql_query': {e}"
+                )
+                return empty_result(), "error"
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+# Runs the db service logic in-process on its own connection pools, for single-node
+# deployments where the agents can read the sqlite files directly. The db modules are
+# loaded from module_dir; its function module is registered as db_function since the
+# agents have a function module of their own.
+class EmbeddedDbClient(DbClient):
+    def __init__(self, module_dir: Path = DB_EMBEDDED_MODULE_DIR):
+        module_dir = Path(module_dir).resolve()
+        if str(module_dir) not in sys.path:
+            sys.path.append(str(module_dir))
+        spec = importlib.util.spec_from_file_location(
+            "db_function", module_dir / "function.py"
+        )
+        self._db = importlib.util.module_from_spec(spec)
+        sys.modules["db_function"] = self._db
+        spec.loader.exec_module(self._db)
+
+        from shards import ShardRouter, ShardRoutingError
+        from indexes import ensure_indexes
+        from aggregates import refresh_aggregates
+        from pool import get_pool
+
+        self._routing_error = ShardRoutingError
+        self._router = ShardRouter()
+        # The same startup work as the db service, which this backend stands in for
+        for shard_path in self._router.shard_paths():
+            ensure_indexes(db_path=shard_path)
+            refresh_aggregates(db_path=shard_path)
+            get_pool(db_path=shard_path)
+        logger.info(
+            f"Embedded db client serving {[path.name for path in self._router.shard_paths()]}"
+        )
+
+    # sqlite calls block, so they run on a worker thread off the event loop
+    async def execute_sql_query(
+        self, sql_query: str, page_size: int = DB_RESULT_PAGE_SIZE
+    ) -> Tuple[Dict[str, List[Any]], str]:
+        return await asyncio.to_thread(self._execute_sql_query, sql_query, page_size)
+
+    def _execute_sql_query(
+        self, sql_query: str, page_size: int
+    ) -> Tuple[Dict[str, List[Any]], str]:
+        try:
+            db_path = self._router.route_query(sql_query)
+        except self._routing_error as e:
+            logger.info(f"Database error: {e}")
+            return empty_result(), "error"
+
+        result = self._db.stream_sql_query(
+            db_path=db_path, query=sql_query, page_size=page_size
+        )
+        if result["status"] != "success":
+            logger.info(f"Database {result['status']}: {result.get('message')}")
+            return empty_result(), result["status"]
+
+        stream = result["stream"]
+        try:
+            # Rows as lists, the same shape the http backend decodes from json
+            rows = [list(row) for batch in stream for row in batch]
+        finally:
+            stream.close()
+        if stream.error is not None:
+            logger.info(f"Database {stream.error['status']}: {stream.error['message']}")
+            return empty_result(), stream.error["status"]
+        db_result = {"columns": stream.columns, "rows": rows}
+        if stream.next_cursor:
+            logger.info(f"Database results truncated at {stream.row_count} rows")
+            return db_result, "truncated"
+        return db_result, "success"
+
+    async def aclose(self):
+        from version import close_all_watchers
+        from pool import close_all_pools
+
+        close_all_watchers()
+        close_all_pools()
+
+
+# Pick the db backend configured through DB_CLIENT_BACKEND ("http" or "embedded")
+def create_db_client(backend: str = DB_CLIENT_BACKEND) -> DbClient:
+    if backend == "http":
+        return HttpDbClient()
+    if backend == "embedded":
+        return EmbeddedDbClient()
+    raise ValueError(f"Unknown db client backend: {backend}")
@@ -0,0 +1,189 @@
+from constants.graph import SQL_PLAN_CACHE_TTL_SECONDS, SQL_PLAN_CACHE_MAX_ENTRIES
+from utils.query_text import (
+    Period,
+    explicit_periods,
+    local_today,
+    normalize_query,
+    resolve_date_windows,
+)
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import calendar
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Plans are shared by queries with the same wording, ids and resolved date windows
+def sql_plan_key(
+    rewritten_query: str,
+    client_id: int,
+    bank_id: int,
+    account_id: int,
+    today: Optional[date] = None,
+) -> Tuple:
+    today = today or local_today()
+    query = normalize_query(rewritten_query)
+    return (
+        query,
+        client_id,
+        bank_id,
+        account_id,
+        tuple(resolve_date_windows(query, today)),
+    )
+
+
+# Time the sql reads when it runs rather than when it was generated
+_SQL_NOW = re.compile(
+    r"'now'|\bcurrent_(?:date|time|timestamp)\b|\blocaltime\b", re.IGNORECASE
+)
+# Date ('2025-03-01', '2025-03-01 09:30:00'), month ('2025-03') and year ('2025') literals
+_SQL_DATE = re.compile(r"'(\d{4}-\d{2}-\d{2})(?:[ T][\d:.]+)?'")
+_SQL_MONTH = re.compile(r"'(\d{4})-(\d{2})'")
+_SQL_YEAR = re.compile(r"'((?:19|20)\d{2})'")
+
+
+# Periods of the date literals, each with how far past the end of a key period it may fall:
+# a day for dates, used as exclusive upper bounds, none for whole months and years
+def sql_literal_periods(sql_query: str) -> List[Tuple[Period, timedelta]]:
+    periods = []
+    for match in _SQL_DATE.finditer(sql_query):
+        day = date.fromisoformat(match.group(1))
+        periods.append(((day, day), timedelta(days=1)))
+    for match in _SQL_MONTH.finditer(sql_query):
+        year, month = int(match.group(1)), int(match.group(2))
+        if 1 <= month <= 12:
+            last_day = calendar.monthrange(year, month)[1]
+            periods.append(
+                ((date(year, month, 1), date(year, month, last_day)), timedelta(0))
+            )
+    for match in _SQL_YEAR.finditer(sql_query):
+        year = int(match.group(1))
+        periods.append(((date(year, 1, 1), date(year, 12, 31)), timedelta(0)))
+    return periods
+
+
+# The sql planned for a key is only reusable under that key if its dates are the key's dates.
+# The key resolves relative periods ("last month") to dates as of the request, while the llm
+# writes its own date arithmetic: sql reading the clock ('now', current_date) is fine on the
+# day it was generated only, and every date, month or year literal must fall within a period
+# of the key (a date a day past its end allowed, for exclusive upper bounds).
+def sql_matches_key(sql_query: str, key: Tuple) -> bool:
+    if _SQL_NOW.search(sql_query):
+        return False
+    query, windows = key[0], key[-1]
+    periods = explicit_periods(query) + [
+        tuple(date.fromisoformat(day) for day in window.split(".."))
+        for window in windows
+        if ".." in window
+    ]
+    return all(
+        any(
+            start <= literal_end and literal_start <= end + slack
+            for start, end in periods
+        )
+        for (literal_start, literal_end), slack in sql_literal_periods(sql_query)
+    )
+
+
+# Thread-safe LRU cache of sql plans with a time to live per entry
+class SqlPlanCache:
+    def __init__(
+        self,
+        max_entries: int = SQL_PLAN_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = SQL_PLAN_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, plan: Dict[str, Any]):
+        cacheable = sql_matches_key(plan["sql_query"], key)
+        with self._lock:
+            if not cacheable:
+                self.rejections += 1
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, plan)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+            }
+
+
+_cache: Optional[SqlPlanCache] = None
+_cache_lock = threading.Lock()
+
+
+# Get (or lazily create) the process-wide sql plan cache
+def get_sql_plan_cache() -> SqlPlanCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SqlPlanCache()
+    return _cache
+
+
+if __name__ == "__main__":
+    # Test sql_matches_key locally: a date may be the exclusive upper bound of a period, a month
+    # or year literal has to be one of the key's months or years
+    today = date(2024, 6, 15)
+    key = sql_plan_key("How much did I spend in 2023?", 1, 1, 1, today=today)
+    for sql_query, cacheable in [
+        ("SELECT SUM(debit) FROM transactions WHERE strftime('%Y', transaction_date) = '2023'", True),
+        ("SELECT SUM(debit) FROM transactions WHERE transaction_date >= '2023-01-01' AND transaction_date < '2024-01-01'", True),
+        ("SELECT SUM(debit) FROM transactions WHERE strftime('%Y', transaction_date) = '2024'", False),
+        ("SELECT SUM(debit) FROM transactions WHERE strftime('%Y-%m', transaction_date) = '2024-01'", False),
+        ("SELECT SUM(debit) FROM transactions WHERE transaction_date >= date('now', 'start of year')", False),
+    ]:  # fmt: skip
+        assert sql_matches_key(sql_query, key) == cacheable, sql_query
+
+    key = sql_plan_key("How much did I spend last year?", 1, 1, 1, today=today)
+    assert sql_matches_key("SELECT SUM(debit) FROM transactions WHERE strftime('%Y', transaction_date) = '2023'", key)  # fmt: skip
+    assert not sql_matches_key("SELECT SUM(debit) FROM transactions WHERE strftime('%Y', transaction_date) = '2024'", key)  # fmt: skip
+    print(key, "ok")
@@ -0,0 +1,105 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Generator, Optional
+from uuid import UUID
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Prompt and cached prompt tokens per graph node, as reported by the api. The provider caches
+# the longest prompt prefix it has seen recently, so the static instructions and schemas come
+# first in every system prompt and the per-request context last (see constants/models.py).
+class PromptCacheUsage:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.nodes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, node: str, prompt_tokens: int, cached_tokens: int):
+        with self._lock:
+            usage = self.nodes.setdefault(
+                node, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            )
+            usage["calls"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["cached_tokens"] += cached_tokens
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                node: {
+                    **usage,
+                    "cached_ratio": (
+                        usage["cached_tokens"] / usage["prompt_tokens"]
+                        if usage["prompt_tokens"]
+                        else 0.0
+                    ),
+                }
+                for node, usage in self.nodes.items()
+            }
+
+
+_usage = PromptCacheUsage()
+
+
+# Process-wide totals, across all requests
+def get_prompt_cache_usage() -> PromptCacheUsage:
+    return _usage
+
+
+# Records the usage of every chat model call under the graph node it ran in, for one request
+# and into the process-wide totals
+class PromptCacheCallbackHandler(BaseCallbackHandler):
+    run_inline = True
+
+    def __init__(self):
+        self.usage = PromptCacheUsage()
+        self._run_nodes: Dict[UUID, str] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages,
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ):
+        self._run_nodes[run_id] = (metadata or {}).get("langgraph_node", "unknown")
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        node = self._run_nodes.pop(run_id, "unknown")
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage_metadata = getattr(message, "usage_metadata", None)
+                if not usage_metadata:
+                    continue
+                prompt_tokens = usage_metadata.get("input_tokens", 0)
+                cached_tokens = (usage_metadata.get("input_token_details") or {}).get(
+                    "cache_read"
+                ) or 0
+                self.usage.record(node, prompt_tokens, cached_tokens)
+                _usage.record(node, prompt_tokens, cached_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._run_nodes.pop(run_id, None)
+
+
+prompt_cache_callback_var: ContextVar[Optional[PromptCacheCallbackHandler]] = (
+    ContextVar("prompt_cache_callback", default=None)
+)
+register_configure_hook(prompt_cache_callback_var, True)
+
+
+# Same usage as get_openai_callback: every llm call made within the context is recorded
+@contextmanager
+def get_prompt_cache_callback() -> Generator[PromptCacheCallbackHandler, None, None]:
+    cb = PromptCacheCallbackHandler()
+    prompt_cache_callback_var.set(cb)
+    yield cb
+    prompt_cache_callback_var.set(None)
@@ -0,0 +1,172 @@
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Callable, List, Optional, Tuple
+import calendar
+import re
+
+# Helpers reading the wording of rewritten queries, shared by the sql plan cache and the sql
+# templates. Queries are normalized first, so the patterns only see lower-cased words.
+_WORD = re.compile(r"[a-z0-9&]+(?:[.\-/][a-z0-9]+)*")
+
+_UNITS = "day|week|month|year"
+_MONTH_NUMBERS = {
+    name.lower(): number
+    for names in (calendar.month_name, calendar.month_abbr)
+    for number, name in enumerate(names)
+    if name
+}
+_MONTHS = "|".join(_MONTH_NUMBERS)
+_DATE = r"\d{4}-\d{2}-\d{2}"
+# Optional lead-in words, removed together with the period they introduce
+_IN = r"\b(?:(?:in|during|over|for|on) )?(?:the )?"
+
+# Relative periods, resolved against today
+_RELATIVE_SPAN = re.compile(rf"{_IN}(?:last|past|previous) (\d+) ({_UNITS})s?\b")
+_CURRENT_PERIOD = re.compile(rf"{_IN}(?:this|current) ({_UNITS})\b")
+_PREVIOUS_PERIOD = re.compile(rf"{_IN}(?:last|previous) ({_UNITS})\b")
+_DAY = re.compile(rf"{_IN}(today|yesterday)\b")
+
+# Explicit periods
+_DATE_RANGE = re.compile(
+    rf"{_IN}(?:between|from) ({_DATE}) (?:and|to|until) ({_DATE})\b"
+)
+_SINGLE_DATE = re.compile(rf"{_IN}({_DATE})\b")
+_MONTH_OF_YEAR = re.compile(rf"{_IN}({_MONTHS}) (\d{{4}})\b")
+_YEAR = re.compile(rf"{_IN}((?:19|20)\d{{2}})\b")
+
+# Words whose meaning depends on when the query is asked, e.g. "recent", "last transaction"
+_RELATIVE_MARKER = re.compile(
+    r"\b(?:today|yesterday|tomorrow|now|current|currently|recent|recently|latest|last|past|previous|this|ago|so far|to date|ytd)\b"
+)
+# A month named without its year is read relative to the current date as well
+_MONTH_WITHOUT_YEAR = re.compile(rf"\b(?:{_MONTHS})\b(?! \d{{4}}\b)")
+
+Period = Tuple[date, date]
+
+
+# Today in the timezone the prompts give the llm as the current date
+def local_today() -> date:
+    return datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).date()
+
+
+# Case, punctuation and spacing carry no meaning for the sql
+def normalize_query(query: str) -> str:
+    return " ".join(_WORD.findall(query.lower().replace("'", "")))
+
+
+def shift_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def period_start(day: date, unit: str) -> date:
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    if unit == "month":
+        return day.replace(day=1)
+    if unit == "year":
+        return day.replace(month=1, day=1)
+    return day
+
+
+# Period resolvers by pattern, from the match and today
+def _span(match: re.Match, today: date) -> Period:
+    count, unit = int(match.group(1)), match.group(2)
+    if unit in ("month", "year"):
+        return shift_months(today, -count * (12 if unit == "year" else 1)), today
+    return today - timedelta(days=count * (7 if unit == "week" else 1)), today
+
+
+def _current(match: re.Match, today: date) -> Period:
+    return period_start(today, match.group(1)), today
+
+
+def _previous(match: re.Match, today: date) -> Period:
+    end = period_start(today, match.group(1)) - timedelta(days=1)
+    return period_start(end, match.group(1)), end
+
+
+def _day(match: re.Match, today: date) -> Period:
+    day = today - timedelta(days=1 if match.group(1) == "yesterday" else 0)
+    return day, day
+
+
+def _date_range(match: re.Match, today: date) -> Period:
+    return date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))
+
+
+def _single_date(match: re.Match, today: date) -> Period:
+    day = date.fromisoformat(match.group(1))
+    return day, day
+
+
+def _month_of_year(match: re.Match, today: date) -> Period:
+    month, year = _MONTH_NUMBERS[match.group(1)], int(match.group(2))
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _year(match: re.Match, today: date) -> Period:
+    year = int(match.group(1))
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+_RELATIVE_PERIODS: List[Tuple[re.Pattern, Callable[[re.Match, date], Period]]] = [
+    (_RELATIVE_SPAN, _span),
+    (_CURRENT_PERIOD, _current),
+    (_PREVIOUS_PERIOD, _previous),
+    (_DAY, _day),
+]
+_EXPLICIT_PERIODS: List[Tuple[re.Pattern, Callable[[re.Match, date], Period]]] = [
+    (_DATE_RANGE, _date_range),
+    (_SINGLE_DATE, _single_date),
+    (_MONTH_OF_YEAR, _month_of_year),
+    (_YEAR, _year),
+]
+
+
+# Remove the periods matched by the patterns from a query, collecting them resolved
+def extract_periods(
+    query: str,
+    today: date,
+    patterns: List[Tuple[re.Pattern, Callable[[re.Match, date], Period]]],
+) -> Tuple[List[Period], str]:
+    periods = []
+
+    def resolve(match: re.Match, resolver) -> str:
+        periods.append(resolver(match, today))
+        return " "
+
+    for pattern, resolver in patterns:
+        query = pattern.sub(lambda match: resolve(match, resolver), query)
+    return periods, " ".join(query.split())
+
+
+# Resolve the relative time expressions of a normalized query into explicit date windows.
+# Explicit dates, months and years are part of the query text already. Windows reaching
+# today change every day, and relative wording that is not resolved pins the window to
+# today, so a plan is never reused once its dates could mean something else.
+def resolve_date_windows(query: str, today: date) -> List[str]:
+    periods, rest = extract_periods(query, today, _RELATIVE_PERIODS)
+    windows = [f"{start}..{end}" for start, end in periods]
+    if _RELATIVE_MARKER.search(rest) or _MONTH_WITHOUT_YEAR.search(rest):
+        windows.append(f"as of {today}")
+    return sorted(windows)
+
+
+# The dates, months and years a normalized query names explicitly, which mean the same whenever
+# the query is asked
+def explicit_periods(query: str) -> List[Period]:
+    return extract_periods(query, local_today(), _EXPLICIT_PERIODS)[0]
+
+
+# The one period a normalized query asks about, with the query text left once the period
+# wording is removed. The period is None when the query names none. A query naming several
+# periods, or a month without its year, raises ValueError as it has no single date range.
+def resolve_period(query: str, today: date) -> Tuple[Optional[Period], str]:
+    periods, rest = extract_periods(query, today, _EXPLICIT_PERIODS + _RELATIVE_PERIODS)
+    if len(periods) > 1:
+        raise ValueError(f"Several periods in query: {periods}")
+    if _MONTH_WITHOUT_YEAR.search(rest):
+        raise ValueError("Month without a year in query")
+    return (periods[0] if periods else None), rest
@@ -0,0 +1,175 @@
+from pool import DB_POOL_BUSY_TIMEOUT_MS
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+from time import perf_counter
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Summary tables kept next to transactions, keyed by account, month and the grouped column.
+# A NULL category or merchant is stored as '' so that it still takes part in the primary key.
+SUMMARY_TABLES: Dict[str, str] = {
+    "monthly_category_summary": "category",
+    "monthly_merchant_summary": "merchant",
+}
+
+SUMMARY_STATE_TABLE = "summary_state"
+
+
+def create_summary_tables(conn: sqlite3.Connection):
+    for table, column in SUMMARY_TABLES.items():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                client_id INTEGER NOT NULL,
+                bank_id INTEGER NOT NULL,
+                account_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                {column} TEXT NOT NULL,
+                total_debit REAL NOT NULL,
+                total_credit REAL NOT NULL,
+                transaction_count INTEGER NOT NULL,
+                PRIMARY KEY (client_id, bank_id, account_id, month, {column})
+            )
+            """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SUMMARY_STATE_TABLE} (
+            name TEXT PRIMARY KEY,
+            last_rowid INTEGER NOT NULL
+        )
+        """)
+
+
+# Aggregate the transactions matching a filter and add them onto the summary rows
+def _add_to_summary(
+    conn: sqlite3.Connection, table: str, column: str, where: str, params: Tuple
+):
+    conn.execute(
+        f"""
+        INSERT INTO {table} (
+            client_id, bank_id, account_id, month, {column},
+            total_debit, total_credit, transaction_count
+        )
+        SELECT
+            client_id,
+            bank_id,
+            account_id,
+            COALESCE(strftime('%Y-%m', transaction_date), ''),
+            COALESCE({column}, ''),
+            COALESCE(SUM(debit), 0),
+            COALESCE(SUM(credit), 0),
+            COUNT(*)
+        FROM transactions
+        WHERE {where}
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, bank_id, account_id, month, {column}) DO UPDATE SET
+            total_debit = total_debit + excluded.total_debit,
+            total_credit = total_credit + excluded.total_credit,
+            transaction_count = transaction_count + excluded.transaction_count
+        """,
+        params,
+    )
+
+
+# Bring the summary tables up to date, inside the caller's transaction on an open connection.
+# New rows are folded in incrementally using the last aggregated rowid as a watermark; accounts
+# whose existing rows were updated or deleted are recomputed from scratch. full=True rebuilds
+# every summary table.
+def update_summary_tables(
+    conn: sqlite3.Connection,
+    accounts: Iterable[Tuple[int, int, int]] = (),
+    full: bool = False,
+) -> Dict:
+    create_summary_tables(conn)
+    max_rowid = conn.execute(
+        "SELECT COALESCE(MAX(rowid), 0) FROM transactions"
+    ).fetchone()[0]
+    accounts = sorted(set(accounts))
+
+    for table, column in SUMMARY_TABLES.items():
+        if full:
+            conn.execute(f"DELETE FROM {table}")
+            last_rowid = 0
+        else:
+            row = conn.execute(
+                f"SELECT last_rowid FROM {SUMMARY_STATE_TABLE} WHERE name = ?",
+                (table,),
+            ).fetchone()
+            last_rowid = row[0] if row else 0
+
+        if max_rowid > last_rowid:
+            _add_to_summary(
+                conn,
+                table,
+                column,
+                "rowid > ? AND rowid <= ?",
+                (last_rowid, max_rowid),
+            )
+
+        for client_id, bank_id, account_id in accounts:
+            conn.execute(
+                f"DELETE FROM {table} WHERE client_id = ? AND bank_id = ? AND account_id = ?",
+                (client_id, bank_id, account_id),
+            )
+            _add_to_summary(
+                conn,
+                table,
+                column,
+                "client_id = ? AND bank_id = ? AND account_id = ? AND rowid <= ?",
+                (client_id, bank_id, account_id, max_rowid),
+            )
+
+        conn.execute(
+            f"""
+            INSERT INTO {SUMMARY_STATE_TABLE} (name, last_rowid) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_rowid = excluded.last_rowid
+            """,
+            (table, max_rowid),
+        )
+
+    return {"last_rowid": max_rowid, "recomputed_accounts": len(accounts), "full": full}
+
+
+def refresh_aggregates(
+    db_path: Path,
+    accounts: Iterable[Tuple[int, int, int]] = (),
+    full: bool = False,
+) -> Dict:
+    start = perf_counter()
+    try:
+        conn = sqlite3.connect(db_path, timeout=DB_POOL_BUSY_TIMEOUT_MS / 1000)
+    except sqlite3.Error as e:
+        logger.info(
+            f"Error connecting to database when executing 'refresh_aggregates': {e}"
+        )
+        return {"status": "error", "message": "Database connection failed."}
+
+    try:
+        with conn:
+            summary = update_summary_tables(conn, accounts=accounts, full=full)
+
+        report = {
+            "status": "success",
+            **summary,
+            "seconds": round(perf_counter() - start, 3),
+        }
+        logger.info(f"Summary tables refreshed: {report}")
+        return report
+
+    except sqlite3.Error as e:
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing refresh_aggregates: {e}",
+        }
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    root_dir = Path(__file__).resolve().parent
+    db_path = root_dir / "transactions.db"
+
+    # Test refresh_aggregates
+    print(refresh_aggregates(db_path=db_path, full=True))
+    print(refresh_aggregates(db_path=db_path))
@@ -0,0 +1,286 @@
+from shards import DB_SHARD_COUNT, DB_SHARD_DIR, ShardRouter
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+from pathlib import Path
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import tracemalloc
+
+# Representative llm-generated queries, following the examples of the sql generator prompt in
+# agents/constants/models.py. Dates fall inside the range written by synthetic.py.
+QUERY_CORPUS: Dict[str, str] = {
+    "balance": "SELECT COALESCE(SUM(credit), 0) - COALESCE(SUM(debit), 0) AS balance FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id}",
+    "spending_by_category": "SELECT category, COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} AND strftime('%Y', transaction_date) = '2023' GROUP BY category ORDER BY COALESCE(SUM(debit), 0) DESC LIMIT 100",
+    "top_categories_summary": "SELECT category, SUM(total_debit) AS total_spending FROM monthly_category_summary WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} AND month BETWEEN '2023-01' AND '2023-03' GROUP BY category ORDER BY total_spending DESC LIMIT 3",
+    "keyword_search": "SELECT transaction_date, description, merchant, debit, credit FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} AND (LOWER(description) LIKE '%amazon%' OR LOWER(category) LIKE '%amazon%' OR LOWER(merchant) LIKE '%amazon%') ORDER BY transaction_date DESC LIMIT 100",
+    "last_transaction_to_merchant": "SELECT transaction_date, description, debit FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} AND (LOWER(description) LIKE '%uber%' OR LOWER(category) LIKE '%uber%' OR LOWER(merchant) LIKE '%uber%') ORDER BY transaction_date DESC LIMIT 1",
+    "monthly_spending": "SELECT strftime('%Y-%m', transaction_date) AS month, COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} AND date(transaction_date) BETWEEN date('2023-01-01') AND date('2023-12-31') GROUP BY strftime('%Y-%m', transaction_date) ORDER BY strftime('%Y-%m', transaction_date) LIMIT 100",
+    "recent_transactions": "SELECT transaction_date, description, category, merchant, debit, credit FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} AND date(transaction_date) >= date('2024-12-31', '-30 days') ORDER BY transaction_date DESC LIMIT 100",
+    "monthly_savings_cte": "WITH monthly_totals AS (SELECT strftime('%Y-%m', transaction_date) AS month, COALESCE(SUM(credit), 0) AS total_income, COALESCE(SUM(debit), 0) AS total_spending FROM transactions WHERE client_id = {client_id} AND bank_id = {bank_id} AND account_id = {account_id} GROUP BY strftime('%Y-%m', transaction_date)) SELECT month, total_income, total_spending, total_income - total_spending AS savings FROM monthly_totals ORDER BY month DESC LIMIT 12",
+}  # fmt: skip
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# Random (client_id, bank_id, account_id) triples spread over every shard
+def sample_accounts(
+    router: ShardRouter, n: int, seed: int = 0
+) -> List[Tuple[int, int, int]]:
+    accounts = []
+    for shard_path in router.shard_paths():
+        conn = sqlite3.connect(f"{shard_path.as_uri()}?mode=ro", uri=True)
+        try:
+            accounts.extend(
+                conn.execute(
+                    "SELECT DISTINCT client_id, bank_id, account_id FROM transactions"
+                ).fetchall()
+            )
+        finally:
+            conn.close()
+    rng = random.Random(seed)
+    return [rng.choice(accounts) for _ in range(n)]
+
+
+def summarize(timings_ms: List[float]) -> Dict[str, float]:
+    ordered = sorted(timings_ms)
+    summary = {"mean": statistics.fmean(ordered)}
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}"] = ordered[
+            min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        ]
+    summary["max"] = ordered[-1]
+    return summary
+
+
+# Latency percentiles over all cases, then python heap allocations of a few calls traced
+# separately (tracing slows every call down) and the process peak RSS afterwards
+def measure(
+    fn: Callable[[Any], Any], cases: List[Any], warmup: int, memory_samples: int
+) -> Dict[str, Any]:
+    for case in cases[:warmup]:
+        fn(case)
+
+    timings_ms = []
+    for case in cases:
+        start = perf_counter()
+        fn(case)
+        timings_ms.append((perf_counter() - start) * 1000)
+
+    peaks_kib = []
+    tracemalloc.start()
+    try:
+        for case in cases[:memory_samples]:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            fn(case)
+            peaks_kib.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "calls": len(cases),
+        "latency_ms": summarize(timings_ms),
+        "peak_alloc_kib": {
+            "mean": statistics.fmean(peaks_kib) if peaks_kib else 0.0,
+            "max": max(peaks_kib, default=0.0),
+        },
+        "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+# Benchmark the db functions directly, bypassing http
+def benchmark_functions(
+    function, router: ShardRouter, accounts: List[Tuple[int, int, int]], args
+) -> Dict[str, Dict]:
+    results = {}
+    for name, template in QUERY_CORPUS.items():
+        cases = [
+            (
+                router.shard_for_client(client_id),
+                template.format(
+                    client_id=client_id, bank_id=bank_id, account_id=account_id
+                ),
+            )
+            for client_id, bank_id, account_id in accounts
+        ]
+        results[f"execute_sql_query[{name}]"] = measure(
+            lambda case: function.execute_sql_query(db_path=case[0], query=case[1]),
+            cases,
+            args.warmup,
+            args.memory_samples,
+        )
+    results["validify_client_bank_account_ids"] = measure(
+        lambda account: function.validify_client_bank_account_ids(
+            db_path=router.shard_for_client(account[0]),
+            client_id=account[0],
+            bank_id=account[1],
+            account_id=account[2],
+        ),
+        accounts,
+        args.warmup,
+        args.memory_samples,
+    )
+    results["get_client_with_single_bank_and_account_id"] = measure(
+        lambda account: function.get_client_with_single_bank_and_account_id(
+            db_path=router.shard_for_client(account[0]), client_id=account[0]
+        ),
+        accounts,
+        args.warmup,
+        args.memory_samples,
+    )
+    return results
+
+
+# Benchmark the http endpoints, either in-process or against a running service
+def benchmark_endpoints(
+    client, accounts: List[Tuple[int, int, int]], args
+) -> Dict[str, Dict]:
+    def post(path: str, payload: Dict):
+        response = client.post(path, json=payload)
+        response.raise_for_status()
+        return response.content
+
+    # Every sampled account has transactions, so no data means the service reads other files
+    # than the benchmarked shards
+    client_id, bank_id, account_id = accounts[0]
+    validity = json.loads(
+        post(
+            "/api/validify/client-bank-account",
+            {"client_id": client_id, "bank_id": bank_id, "account_id": account_id},
+        )
+    )
+    result = json.loads(
+        post(
+            "/api/db/execute-query",
+            {
+                "sql_query": QUERY_CORPUS["monthly_savings_cte"].format(
+                    client_id=client_id, bank_id=bank_id, account_id=account_id
+                )
+            },
+        )
+    )
+    if validity.get("status") != "success" or not result.get("formatted_results"):
+        raise RuntimeError(
+            f"Endpoints returned no data for account {accounts[0]}: {validity}, {result}"
+        )
+
+    queries = [
+        template.format(client_id=client_id, bank_id=bank_id, account_id=account_id)
+        for (client_id, bank_id, account_id), template in zip(
+            accounts, itertools.cycle(QUERY_CORPUS.values())
+        )
+    ]
+    results = {}
+    results["POST /api/db/execute-query"] = measure(
+        lambda query: post("/api/db/execute-query", {"sql_query": query}),
+        queries,
+        args.warmup,
+        args.memory_samples,
+    )
+    results["POST /api/db/execute-query/stream"] = measure(
+        lambda query: post("/api/db/execute-query/stream", {"sql_query": query}),
+        queries,
+        args.warmup,
+        args.memory_samples,
+    )
+    results["POST /api/validify/client-bank-account"] = measure(
+        lambda account: post(
+            "/api/validify/client-bank-account",
+            {"client_id": account[0], "bank_id": account[1], "account_id": account[2]},
+        ),
+        accounts,
+        args.warmup,
+        args.memory_samples,
+    )
+    results["GET /api/client/{client_id}/bank-account"] = measure(
+        lambda account: client.get(f"/api/client/{account[0]}/bank-account").content,
+        accounts,
+        args.warmup,
+        args.memory_samples,
+    )
+    return results
+
+
+def print_results(title: str, results: Dict[str, Dict]):
+    print(f"\n{title}")
+    print(
+        f"{'target':<48}{'calls':>7}{'mean ms':>10}"
+        + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES)
+        + f"{'max ms':>10}{'alloc KiB':>11}{'rss MiB':>9}"
+    )
+    for name, result in results.items():
+        latency = result["latency_ms"]
+        print(
+            f"{name:<48}{result['calls']:>7}{latency['mean']:>10.3f}"
+            + "".join(f"{latency[f'p{p}']:>10.3f}" for p in PERCENTILES)
+            + f"{latency['max']:>10.3f}{result['peak_alloc_kib']['max']:>11.1f}"
+            + f"{result['max_rss_mib']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark db functions and endpoints on a (synthetic) transactions database"
+    )
+    parser.add_argument("--shard-dir", type=Path, default=DB_SHARD_DIR)
+    parser.add_argument("--shards", type=int, default=DB_SHARD_COUNT)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--memory-samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        choices=["functions", "endpoints"],
+        default=["functions", "endpoints"],
+    )
+    parser.add_argument(
+        "--url",
+        default=None,
+        help="Benchmark the endpoints of a running service instead of an in-process app",
+    )
+    parser.add_argument(
+        "--result-cache",
+        action="store_true",
+        help="Keep the result cache on (off by default so that every call hits sqlite)",
+    )
+    parser.add_argument("--json", type=Path, default=None, help="Write results here")
+    args = parser.parse_args()
+
+    # The service modules read their configuration from the environment on import
+    os.environ["DB_RESULT_CACHE_ENABLED"] = "true" if args.result_cache else "false"
+    import function
+
+    router = ShardRouter(shard_dir=args.shard_dir, shard_count=args.shards)
+    accounts = sample_accounts(router, n=args.calls, seed=args.seed)
+    report = {"shards": [str(path) for path in router.shard_paths()]}
+
+    if "functions" in args.targets:
+        report["functions"] = benchmark_functions(function, router, accounts, args)
+        print_results("Functions", report["functions"])
+
+    if "endpoints" in args.targets:
+        if args.url:
+            import httpx
+
+            with httpx.Client(base_url=args.url, timeout=60) as client:
+                report["endpoints"] = benchmark_endpoints(client, accounts, args)
+        else:
+            from fastapi.testclient import TestClient
+            import main
+
+            # The app routes to the shards of its module level router, built on import from
+            # the environment's shard layout rather than the one given here
+            main.router = router
+            with TestClient(main.app) as client:
+                report["endpoints"] = benchmark_endpoints(client, accounts, args)
+        print_results("Endpoints", report["endpoints"])
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
@@ -0,0 +1,121 @@
+from encoding import msgpack, encode_msgpack
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+import argparse
+import json
+import random
+import statistics
+
+
+# Rows shaped like a "list my transactions" result on the transactions table
+def make_rows(n_rows: int) -> Tuple[List[str], List[Tuple]]:
+    columns = [
+        "transaction_id",
+        "transaction_date",
+        "description",
+        "category",
+        "merchant",
+        "debit",
+        "credit",
+    ]
+    categories = ["shops", "utilities", "insurance", "restaurants", "transfer deposit"]
+    merchants = ["amazon", "uber", "nike", "starbucks", "shell"]
+    start = datetime(2023, 1, 1)
+    rows = []
+    for i in range(n_rows):
+        is_debit = random.random() < 0.7
+        rows.append(
+            (
+                i + 1,
+                (start + timedelta(minutes=37 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+                f"card purchase {random.randint(1000, 9999)}",
+                random.choice(categories),
+                random.choice(merchants),
+                round(random.uniform(1, 500), 2) if is_debit else None,
+                None if is_debit else round(random.uniform(1, 5000), 2),
+            )
+        )
+    return columns, rows
+
+
+def time_it(fn: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        timings.append(perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+# Compare payload size and encode/decode time of every wire format for one result size
+def benchmark(n_rows: int, repeat: int) -> List[Dict[str, Any]]:
+    columns, rows = make_rows(n_rows)
+    results = []
+
+    def encode_records():
+        return json.dumps(
+            {
+                "status": "success",
+                "formatted_results": [dict(zip(columns, row)) for row in rows],
+            }
+        ).encode()
+
+    def encode_columnar():
+        return json.dumps(
+            {"status": "success", "columns": columns, "rows": rows}
+        ).encode()
+
+    formats = [
+        ("records", encode_records, json.loads),
+        ("columnar", encode_columnar, json.loads),
+    ]
+    if msgpack is not None:
+        formats.append(
+            (
+                "msgpack",
+                lambda: encode_msgpack(
+                    {"status": "success", "columns": columns, "rows": rows}
+                ),
+                lambda payload: msgpack.unpackb(payload, raw=False),
+            )
+        )
+
+    for name, encode, decode in formats:
+        payload = encode()
+        results.append(
+            {
+                "format": name,
+                "rows": n_rows,
+                "payload_bytes": len(payload),
+                "encode_ms": time_it(encode, repeat),
+                "decode_ms": time_it(lambda: decode(payload), repeat),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark query result wire formats between db and agents"
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if msgpack is None:
+        print("msgpack is not installed, skipping the msgpack format\n")
+
+    print(
+        f"{'format':<10}{'rows':>8}{'bytes':>12}{'vs records':>12}"
+        f"{'encode ms':>12}{'decode ms':>12}"
+    )
+    for n_rows in args.rows:
+        results = benchmark(n_rows=n_rows, repeat=args.repeat)
+        baseline = results[0]["payload_bytes"]
+        for result in results:
+            print(
+                f"{result['format']:<10}{result['rows']:>8}{result['payload_bytes']:>12}"
+                f"{result['payload_bytes'] / baseline:>12.2f}"
+                f"{result['encode_ms']:>12.3f}{result['decode_ms']:>12.3f}"
+            )
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Tuple
+import os
+import sys
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Result cache budget, overridable through the service environment
+DB_RESULT_CACHE_ENABLED = os.getenv("DB_RESULT_CACHE_ENABLED", "true").lower() == "true"
+DB_RESULT_CACHE_MAX_BYTES = int(os.getenv("DB_RESULT_CACHE_MAX_BYTES", "67108864"))
+DB_RESULT_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("DB_RESULT_CACHE_MAX_ENTRY_BYTES", "4194304")
+)
+
+
+# Rough in-memory size of a query result, used to enforce the cache memory budget
+def estimate_size(value: Any) -> int:
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+# Thread-safe LRU cache of query results with a memory budget in bytes
+class ResultCache:
+    def __init__(
+        self,
+        max_bytes: int = DB_RESULT_CACHE_MAX_BYTES,
+        max_entry_bytes: int = DB_RESULT_CACHE_MAX_ENTRY_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    # Entries from an older data version can never be hit again, so drop them all at once
+    def _check_generation(self, generation: int):
+        if generation != self._generation:
+            if self._entries:
+                logger.info(
+                    f"Result cache cleared for data version generation {generation}"
+                )
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, generation: int) -> bool:
+        size = estimate_size(value)
+        with self._lock:
+            self._check_generation(generation)
+            if size > self.max_entry_bytes or size > self.max_bytes:
+                self.rejected += 1
+                return False
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            while self._entries and self._bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self._bytes += size
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": DB_RESULT_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entry_bytes": self.max_entry_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "rejected": self.rejected,
+                "generation": self._generation,
+            }
+
+
+_caches: Dict[Path, ResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+# Get (or lazily create) the result cache of a database file
+def get_result_cache(db_path: Path) -> ResultCache:
+    key = Path(db_path).resolve()
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                cache = ResultCache()
+                _caches[key] = cache
+    return cache
+
+
+def get_result_cache_stats() -> Dict:
+    with _caches_lock:
+        return {str(path.name): cache.stats() for path, cache in _caches.items()}
@@ -0,0 +1,35 @@
+from typing import Any, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# msgpack is optional, without it the binary format falls back to columnar JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Request header used by clients to pick the wire format of query results
+RESULT_FORMAT_HEADER = "X-Result-Format"
+
+# records:  {"formatted_results": [{column: value, ...}, ...]} (default, original format)
+# columnar: {"columns": [...], "rows": [[...], ...]}
+# msgpack:  columnar payload encoded with msgpack
+RESULT_FORMATS = ("records", "columnar", "msgpack")
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+# Map the requested header value onto a format this service can actually produce
+def resolve_result_format(requested: Optional[str]) -> str:
+    result_format = (requested or "records").strip().lower()
+    if result_format not in RESULT_FORMATS:
+        logger.info(f"Unknown result format '{requested}', using records")
+        return "records"
+    if result_format == "msgpack" and msgpack is None:
+        logger.info("msgpack is not installed, using columnar JSON instead")
+        return "columnar"
+    return result_format
+
+
+def encode_msgpack(payload: Dict[str, Any]) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
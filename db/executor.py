@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from time import monotonic
+from typing import Any, AsyncIterator, Callable, Dict, Iterable
+import asyncio
+import os
+import statistics
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Execution layer sizing, overridable through the service environment
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+DB_EXECUTOR_MAX_QUEUE = int(os.getenv("DB_EXECUTOR_MAX_QUEUE", "64"))
+DB_EXECUTOR_RETRY_AFTER_SECONDS = int(os.getenv("DB_EXECUTOR_RETRY_AFTER_SECONDS", "1"))
+
+# Number of recent queue wait samples kept for the exported wait time statistics
+WAIT_SAMPLE_SIZE = 1000
+
+
+# Raised when the admission queue is full and the call should be retried later
+class ExecutorSaturatedError(Exception):
+    pass
+
+
+# Dedicated worker threads for blocking sqlite work, fed through a bounded admission queue.
+# Each worker keeps its own pooled connection, so the pool size follows the worker count.
+class QueryExecutor:
+    def __init__(
+        self, workers: int = DB_EXECUTOR_WORKERS, max_queue: int = DB_EXECUTOR_MAX_QUEUE
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="db-worker"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._waits = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    # Run fn on a worker thread, refusing new work once max_queue calls are already waiting.
+    # Work that belongs to an admitted request (e.g. later batches of a stream) skips the check.
+    async def run(
+        self, fn: Callable[..., Any], *args, admitted: bool = False, **kwargs
+    ) -> Any:
+        with self._lock:
+            if not admitted and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturatedError(
+                    f"{self._queued} database calls already waiting for a worker"
+                )
+            self._queued += 1
+            self._admitted += 1
+        enqueued_at = monotonic()
+        # Whichever comes first, the worker starting the call or the caller being cancelled
+        # (e.g. a stream client disconnecting) while it is still queued, releases its queue slot
+        claimed = False
+
+        def claim() -> bool:
+            nonlocal claimed
+            with self._lock:
+                if claimed:
+                    return False
+                claimed = True
+                self._queued -= 1
+                return True
+
+        def task():
+            started_at = monotonic()
+            if not claim():
+                return None
+            with self._lock:
+                self._running += 1
+                self._waits.append(started_at - enqueued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, task)
+        except asyncio.CancelledError:
+            claim()
+            raise
+
+    # Pull items of a blocking iterable one at a time on the workers
+    async def iterate(self, iterable: Iterable) -> AsyncIterator:
+        iterator = iter(iterable)
+        sentinel = object()
+        while True:
+            item = await self.run(next, iterator, sentinel, admitted=True)
+            if item is sentinel:
+                return
+            yield item
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waits_ms = sorted(wait * 1000 for wait in self._waits)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "admitted_total": self._admitted,
+                "rejected_total": self._rejected,
+                "completed_total": self._completed,
+                "queue_wait_ms": {
+                    "samples": len(waits_ms),
+                    "mean": statistics.fmean(waits_ms) if waits_ms else 0.0,
+                    "p50": waits_ms[len(waits_ms) // 2] if waits_ms else 0.0,
+                    "p95": waits_ms[int(len(waits_ms) * 0.95)] if waits_ms else 0.0,
+                    "max": waits_ms[-1] if waits_ms else 0.0,
+                },
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Test the admission queue locally: calls cancelled while still queued release their slot
+    async def main():
+        executor = QueryExecutor(workers=1, max_queue=2)
+        release = threading.Event()
+        busy = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        queued = [
+            asyncio.ensure_future(executor.run(lambda: "queued")) for _ in range(2)
+        ]
+        await asyncio.sleep(0.05)
+        assert executor.stats()["queue_depth"] == 2, executor.stats()
+        for call in queued:
+            call.cancel()
+        await asyncio.gather(*queued, return_exceptions=True)
+        release.set()
+        await busy
+
+        stats = executor.stats()
+        assert stats["queue_depth"] == 0 and stats["running"] == 0, stats
+        assert await executor.run(lambda: "after") == "after"
+        print(executor.stats())
+        executor.shutdown()
+
+    asyncio.run(main())
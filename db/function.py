@@ -1,15 +1,31 @@
+from pool import get_pool, ConnectionPool, PooledConnection
+from hierarchy import get_client_hierarchy
+from version import get_data_version_watcher
+from cache import DB_RESULT_CACHE_ENABLED, ResultCache, get_result_cache
+from statements import parameterize_sql, is_read_query, get_statement_stats
+from governor import DB_QUERY_MAX_ROWS, QueryGovernor, QueryTooExpensiveError
 import sqlite3
+import threading
 from pathlib import Path
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+import base64
+import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Number of rows pulled from sqlite per fetchmany call when streaming results
+DB_STREAM_FETCH_SIZE = int(os.getenv("DB_STREAM_FETCH_SIZE", "500"))
+# Maximum number of statements accepted in one batch
+DB_BATCH_MAX_STATEMENTS = int(os.getenv("DB_BATCH_MAX_STATEMENTS", "20"))
 
-# Establish connection to sqlite db
+
+# Borrow the calling thread's pooled read-only connection to sqlite db
 def connect_db(db_path: Path):
 
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_pool(db_path=db_path).acquire()
         cursor = conn.cursor()
         return conn, cursor
     except sqlite3.Error as e:
@@ -37,40 +53,429 @@ def get_table_schema(db_path: Path):
 
         finally:
             cursor.close()
-            conn.close()
 
         return table_schema
     else:
         return "Database connection failed."
 
 
-# Execute sql query and get results from sqlite db
-def execute_sql_query(db_path: Path, query: str):
+# Run one parameterized sql query under the query governor on an open connection and format
+# its results, either as one dict per row or as a single column list plus plain row lists
+def run_governed_query(
+    conn: sqlite3.Connection,
+    cursor: sqlite3.Cursor,
+    query: str,
+    params: Tuple,
+    columnar: bool,
+    caller: str,
+) -> Dict:
+    governor = QueryGovernor(conn)
+    if not is_read_query(query):
+        return governor.reject()
+    try:
+        with governor:
+            cursor.execute(query, params)
+            rows = []
+            while True:
+                batch = cursor.fetchmany(DB_STREAM_FETCH_SIZE)
+                if not batch:
+                    break
+                rows.extend(batch)
+                governor.check_row_count(len(rows))
+        columns = [desc[0] for desc in cursor.description or []]
+        if columnar:
+            return {"status": "success", "columns": columns, "rows": rows}
+        formatted_results = [dict(zip(columns, row)) for row in rows]
+        return {"status": "success", "formatted_results": formatted_results}
+
+    except QueryTooExpensiveError as e:
+        logger.info(f"Query stopped by governor: {e.message}")
+        return e.to_dict()
+
+    except sqlite3.DatabaseError as e:
+        verdict = governor.classify_error(e)
+        if verdict is not None:
+            logger.info(f"Query stopped by governor: {verdict['message']}")
+            return verdict
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing {caller}: {e}",
+        }
+
+
+# Key of a parameterized query, typed so that e.g. 1 and 1.0 do not share an entry
+def statement_key(template: str, params: Tuple) -> Tuple:
+    return (template, tuple((type(param).__name__, param) for param in params))
+
+
+# Execute sql query and get results from sqlite db. The query runs as a parameterized template
+# through the connection's prepared-statement cache, and successful results are cached per
+# parameterized query and database data version.
+def execute_sql_query(db_path: Path, query: str, columnar: bool = False):
+    template, params = parameterize_sql(query)
+    cache = get_result_cache(db_path=db_path) if DB_RESULT_CACHE_ENABLED else None
+    if cache is not None:
+        generation = get_data_version_watcher(db_path=db_path).current()
+        cache_key = (statement_key(template, params), columnar)
+        cached = cache.get(cache_key, generation=generation)
+        if cached is not None:
+            return dict(cached)
+
     conn, cursor = connect_db(db_path=db_path)
 
     if not conn and not cursor:
         return {"status": "error", "message": "Database connection failed."}
 
     try:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        formatted_results = [dict(zip(columns, row)) for row in rows]
-        return {"status": "success", "formatted_results": formatted_results}
+        get_statement_stats(db_path=db_path).record(template)
+        result = run_governed_query(
+            conn=conn,
+            cursor=cursor,
+            query=template,
+            params=params,
+            columnar=columnar,
+            caller="execute_sql_query",
+        )
+        if cache is not None and result["status"] == "success":
+            cache.put(cache_key, result, generation=generation)
+        return dict(result)
+
+    finally:
+        cursor.close()
+
+
+# Execute several named sql queries on one connection inside a single read transaction,
+# so that they all see the same snapshot, and report results and errors per statement
+def execute_sql_batch(
+    db_path: Path, statements: Dict[str, str], columnar: bool = False
+):
+    if len(statements) > DB_BATCH_MAX_STATEMENTS:
+        return {
+            "status": "error",
+            "message": f"A batch holds at most {DB_BATCH_MAX_STATEMENTS} statements.",
+        }
+
+    conn, cursor = connect_db(db_path=db_path)
+
+    if not conn and not cursor:
+        return {"status": "error", "message": "Database connection failed."}
+
+    try:
+        cursor.execute("BEGIN;")
+        results = {}
+        statement_stats = get_statement_stats(db_path=db_path)
+        for name, query in statements.items():
+            template, params = parameterize_sql(query)
+            statement_stats.record(template)
+            results[name] = run_governed_query(
+                conn=conn,
+                cursor=cursor,
+                query=template,
+                params=params,
+                columnar=columnar,
+                caller=f"execute_sql_batch ({name})",
+            )
+        failed = [
+            name for name, result in results.items() if result["status"] != "success"
+        ]
+        return {
+            "status": "success" if not failed else "partial",
+            "results": results,
+            "failed": failed,
+        }
 
     except sqlite3.DatabaseError as e:
         return {
             "status": "error",
-            "message": f"Database error occurred when executing execute_sql_query: {e}",
+            "message": f"Database error occurred when executing execute_sql_batch: {e}",
         }
 
     finally:
+        if conn.in_transaction:
+            conn.rollback()
         cursor.close()
-        conn.close()
+
+
+# Run EXPLAIN QUERY PLAN for a sql query and flag steps that scan a whole table
+def explain_sql_query(db_path: Path, query: str):
+    conn, cursor = connect_db(db_path=db_path)
+
+    if not conn and not cursor:
+        return {"status": "error", "message": "Database connection failed."}
+
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in cursor.fetchall()}
+
+        # Plan the parameterized form, which is what execute_sql_query runs
+        template, params = parameterize_sql(query)
+        cursor.execute(f"EXPLAIN QUERY PLAN {template}", params)
+        plan = [
+            {"id": row[0], "parent": row[1], "detail": row[3]}
+            for row in cursor.fetchall()
+        ]
+
+        # "SCAN <table>" without an index is a full-table scan, while
+        # "SEARCH ... USING INDEX" and scans of CTEs or subqueries are fine
+        full_table_scans = []
+        for step in plan:
+            words = step["detail"].split()
+            if (
+                len(words) >= 2
+                and words[0] == "SCAN"
+                and words[1] in tables
+                and "USING" not in words
+            ):
+                full_table_scans.append(step["detail"])
+
+        if full_table_scans:
+            logger.info(f"Full-table scans in query plan: {full_table_scans}")
+
+        return {
+            "status": "success",
+            "plan": plan,
+            "full_table_scans": full_table_scans,
+            "has_full_table_scan": bool(full_table_scans),
+        }
+
+    except sqlite3.DatabaseError as e:
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing explain_sql_query: {e}",
+        }
+
+    finally:
+        cursor.close()
+
+
+# Encode the row offset of the next page as an opaque cursor for clients
+def encode_page_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+def decode_page_cursor(cursor: str) -> int:
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Invalid page cursor: {cursor}")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError(f"Invalid page cursor: {cursor}")
+    return offset
+
+
+# Incrementally readable result of a sql query, holding a leased connection (and the query
+# governor installed on it) until closed. A query stopped mid-stream leaves its verdict in error.
+# Pages are cut with LIMIT/OFFSET around the original query, so stable paging relies on
+# the query having a deterministic ORDER BY (which the sql generator always emits).
+# Given a result cache, a page read to its end is stored in it once complete.
+class QueryStream:
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        pooled: PooledConnection,
+        governor: QueryGovernor,
+        cursor: sqlite3.Cursor,
+        offset: int,
+        page_size: int,
+        fetch_size: int,
+        cache: Optional[ResultCache] = None,
+        cache_key: Hashable = None,
+        generation: int = None,
+    ):
+        self._pool = pool
+        self._pooled = pooled
+        self._governor = governor
+        self._cursor = cursor
+        self._offset = offset
+        self._page_size = page_size
+        self._fetch_size = fetch_size
+        self._cache = cache
+        self._cache_key = cache_key
+        self._generation = generation
+        self._closed = False
+        # Fetches and close may run on different executor workers (close after a client
+        # disconnect, while the last fetch is still running), and a sqlite connection must not
+        # be used from two threads at once
+        self._lock = threading.Lock()
+        self.columns = [desc[0] for desc in cursor.description or []]
+        self.row_count = 0
+        self.next_cursor = None
+        self.error: Optional[Dict] = None
+
+    # Yield batches of row tuples, at most fetch_size rows at a time
+    def __iter__(self) -> Iterator[List[Tuple]]:
+        page_rows = [] if self._cache is not None else None
+        try:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        return
+                    rows = self._cursor.fetchmany(self._fetch_size)
+                if not rows:
+                    break
+                remaining = self._page_size - self.row_count
+                if len(rows) > remaining:
+                    # The extra row fetched beyond the page only signals that more rows exist
+                    rows = rows[:remaining]
+                    self.next_cursor = encode_page_cursor(
+                        self._offset + self._page_size
+                    )
+                if rows:
+                    self.row_count += len(rows)
+                    if page_rows is not None:
+                        page_rows.extend(rows)
+                    yield rows
+                if self.next_cursor is not None:
+                    break
+            if page_rows is not None:
+                self._cache.put(
+                    self._cache_key,
+                    {
+                        "columns": self.columns,
+                        "rows": page_rows,
+                        "next_cursor": self.next_cursor,
+                    },
+                    generation=self._generation,
+                )
+        except sqlite3.DatabaseError as e:
+            self.error = self._governor.classify_error(e) or {
+                "status": "error",
+                "message": f"Database error occurred when streaming results: {e}",
+            }
+            logger.info(f"Query stream stopped: {self.error['message']}")
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._cursor.close()
+                self._governor.uninstall()
+            except sqlite3.Error:
+                self._pool.checkin(self._pooled, discard=True)
+                return
+            self._pool.checkin(self._pooled)
+
+
+# A page of results from the result cache, read with the same interface as QueryStream
+class CachedQueryStream:
+    def __init__(self, page: Dict, fetch_size: int):
+        self._rows = page["rows"]
+        self._fetch_size = fetch_size
+        self.columns = page["columns"]
+        self.row_count = len(page["rows"])
+        self.next_cursor = page["next_cursor"]
+        self.error: Optional[Dict] = None
+
+    def __iter__(self) -> Iterator[List[Tuple]]:
+        for start in range(0, len(self._rows), self._fetch_size):
+            yield self._rows[start : start + self._fetch_size]
+
+    def close(self):
+        pass
+
+
+# Execute sql query and return a stream that reads results page by page with fetchmany.
+# Pages are cached like execute_sql_query results, per parameterized query, page size and
+# offset, and database data version.
+def stream_sql_query(
+    db_path: Path,
+    query: str,
+    page_size: int = None,
+    cursor: str = None,
+    fetch_size: int = DB_STREAM_FETCH_SIZE,
+):
+    try:
+        offset = decode_page_cursor(cursor) if cursor else 0
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    # Streams never return more than the governor row limit at once, larger results are paged
+    page_size = min(page_size or DB_QUERY_MAX_ROWS, DB_QUERY_MAX_ROWS)
+
+    template, params = parameterize_sql(query)
+    cache = get_result_cache(db_path=db_path) if DB_RESULT_CACHE_ENABLED else None
+    cache_key = generation = None
+    if cache is not None:
+        generation = get_data_version_watcher(db_path=db_path).current()
+        cache_key = (statement_key(template, params), "page", page_size, offset)
+        cached = cache.get(cache_key, generation=generation)
+        if cached is not None:
+            stream = CachedQueryStream(page=cached, fetch_size=fetch_size)
+            return {"status": "success", "stream": stream}
+
+    pool = get_pool(db_path=db_path)
+    try:
+        pooled = pool.checkout()
+    except sqlite3.Error as e:
+        logger.info(
+            f"Error connecting to database when executing 'stream_sql_query': {e}"
+        )
+        return {"status": "error", "message": "Database connection failed."}
+
+    governor = QueryGovernor(pooled.conn)
+    if not is_read_query(template):
+        pool.checkin(pooled)
+        return governor.reject()
+    get_statement_stats(db_path=db_path).record(template)
+
+    governor.install()
+    db_cursor = pooled.conn.cursor()
+    try:
+        # Fetch one row past the page to know whether a next cursor is needed
+        db_cursor.execute(
+            f"SELECT * FROM ({template}) LIMIT ? OFFSET ?",
+            params + (page_size + 1, offset),
+        )
+    except sqlite3.DatabaseError as e:
+        db_cursor.close()
+        governor.uninstall()
+        pool.checkin(pooled)
+        verdict = governor.classify_error(e)
+        if verdict is not None:
+            logger.info(f"Query stopped by governor: {verdict['message']}")
+            return verdict
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing stream_sql_query: {e}",
+        }
+
+    stream = QueryStream(
+        pool=pool,
+        pooled=pooled,
+        governor=governor,
+        cursor=db_cursor,
+        offset=offset,
+        page_size=page_size,
+        fetch_size=fetch_size,
+        cache=cache,
+        cache_key=cache_key,
+        generation=generation,
+    )
+    return {"status": "success", "stream": stream}
 
 
 # Check whether a specific client having multiple banks and accounts
 def get_client_with_single_bank_and_account_id(db_path: Path, client_id: int):
+    # Answer from the in-memory client hierarchy, falling back to sqlite if it is unavailable
+    clients = get_client_hierarchy(db_path=db_path).get()
+    if clients is not None:
+        banks = clients.get(client_id, {})
+        accounts = frozenset().union(*banks.values())
+        if len(banks) == 1 and len(accounts) == 1:
+            return {
+                "status": "success",
+                "bank_id": next(iter(banks)),
+                "account_id": next(iter(accounts)),
+            }
+        return {
+            "status": "conflict",
+            "message": f"Client ID-{client_id} has {len(banks)} banks and {len(accounts)} accounts.",
+        }
+
     conn, cursor = connect_db(db_path=db_path)
 
     if not conn and not cursor:
@@ -109,12 +514,32 @@ def get_client_with_single_bank_and_account_id(db_path: Path, client_id: int):
 
     finally:
         cursor.close()
-        conn.close()
 
 
 def validify_client_bank_account_ids(
     db_path: Path, client_id: int, bank_id: int = None, account_id: int = None
 ):
+    # Answer from the in-memory client hierarchy, falling back to sqlite if it is unavailable
+    clients = get_client_hierarchy(db_path=db_path).get()
+    if clients is not None:
+        if client_id not in clients:
+            return {
+                "status": "error",
+                "message": f"Client ID-{client_id} does not exist.",
+            }
+        if bank_id and account_id:
+            if bank_id not in clients[client_id]:
+                return {
+                    "status": "error",
+                    "message": f"Client ID-{client_id} exists, but Bank ID-{bank_id} does not.",
+                }
+            if account_id not in clients[client_id][bank_id]:
+                return {
+                    "status": "error",
+                    "message": f"Client ID-{client_id}, Bank ID-{bank_id}, and Account ID-{account_id} combination does not exist.",
+                }
+        return {"status": "success"}
+
     conn, cursor = connect_db(db_path=db_path)
 
     if not conn or not cursor:
@@ -180,7 +605,6 @@ def validify_client_bank_account_ids(
 
     finally:
         cursor.close()
-        conn.close()
 
 
 if __name__ == "__main__":
@@ -190,6 +614,10 @@ if __name__ == "__main__":
     # Test get_table_schema
     print(get_table_schema(db_path=db_path))
 
+    # Test explain_sql_query
+    sql_query = "SELECT * FROM transactions WHERE client_id = 2 AND bank_id = 1 AND account_id = 1 ORDER BY transaction_date DESC LIMIT 100;"
+    print(explain_sql_query(db_path=db_path, query=sql_query))
+
     # Test execute_sql_query
     sql_query = "SELECT category, SUM(COALESCE(debit, 0)) AS total_savings FROM transactions WHERE client_id = 2 AND bank_id = 1 AND account_id = 1 AND transaction_date >= '2023-07-01' AND transaction_date < '2023-08-01' GROUP BY category ORDER BY total_savings DESC LIMIT 3;"
     print(execute_sql_query(db_path=db_path, query=sql_query))
@@ -0,0 +1,153 @@
+from time import monotonic
+from typing import Dict, Optional
+import sqlite3
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Limits for llm-generated sql, overridable through the service environment
+DB_QUERY_MAX_SECONDS = float(os.getenv("DB_QUERY_MAX_SECONDS", "5"))
+DB_QUERY_MAX_VM_STEPS = int(os.getenv("DB_QUERY_MAX_VM_STEPS", "200000000"))
+DB_QUERY_MAX_ROWS = int(os.getenv("DB_QUERY_MAX_ROWS", "10000"))
+# Number of sqlite VM instructions between two progress handler calls
+DB_QUERY_PROGRESS_INTERVAL = int(os.getenv("DB_QUERY_PROGRESS_INTERVAL", "10000"))
+
+# Everything a plain read-only SELECT needs, any other action is denied by the authorizer
+ALLOWED_AUTHORIZER_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+# Pragmas that only read, used by the service itself on pooled connections
+READ_ONLY_PRAGMAS = {"table_info"}
+# Read transactions opened and closed by the service around batches
+ALLOWED_TRANSACTIONS = {"BEGIN", "ROLLBACK"}
+
+# Authorizer denials are recorded per thread: a statement is prepared by the thread executing it
+_denials = threading.local()
+
+
+def _authorize(action, arg1, arg2, db_name, trigger_name):
+    if (
+        action in ALLOWED_AUTHORIZER_ACTIONS
+        or (action == sqlite3.SQLITE_PRAGMA and arg1 in READ_ONLY_PRAGMAS)
+        or (action == sqlite3.SQLITE_TRANSACTION and arg1 in ALLOWED_TRANSACTIONS)
+    ):
+        return sqlite3.SQLITE_OK
+    _denials.action = f"{action}:{arg1 or ''}"
+    return sqlite3.SQLITE_DENY
+
+
+# Restrict a connection to read-only statements for its whole lifetime. The authorizer is set
+# once when the connection is opened, since setting it expires every prepared statement
+# of the connection and would defeat the statement cache.
+def install_authorizer(conn: sqlite3.Connection):
+    conn.set_authorizer(_authorize)
+
+
+# Raised when a query exceeds one of the governor limits
+class QueryTooExpensiveError(sqlite3.DatabaseError):
+    def __init__(self, reason: str, message: str, limits: Dict):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.limits = limits
+
+    def to_dict(self) -> Dict:
+        return {
+            "status": "too_expensive",
+            "reason": self.reason,
+            "message": self.message,
+            "limits": self.limits,
+        }
+
+
+# Caps execution time, VM steps and returned rows of the queries run on a connection.
+# Statements other than read-only SELECTs are rejected by the connection's authorizer.
+class QueryGovernor:
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        max_seconds: float = DB_QUERY_MAX_SECONDS,
+        max_vm_steps: int = DB_QUERY_MAX_VM_STEPS,
+        max_rows: int = DB_QUERY_MAX_ROWS,
+    ):
+        self.conn = conn
+        self.max_seconds = max_seconds
+        self.max_vm_steps = max_vm_steps
+        self.max_rows = max_rows
+        self.vm_steps = 0
+        self.interrupt_reason: Optional[str] = None
+        self._deadline = None
+
+    def _on_progress(self) -> int:
+        self.vm_steps += DB_QUERY_PROGRESS_INTERVAL
+        if self.vm_steps > self.max_vm_steps:
+            self.interrupt_reason = "vm_steps"
+            return 1
+        if monotonic() > self._deadline:
+            self.interrupt_reason = "timeout"
+            return 1
+        return 0
+
+    def limits(self) -> Dict:
+        return {
+            "max_seconds": self.max_seconds,
+            "max_vm_steps": self.max_vm_steps,
+            "max_rows": self.max_rows,
+        }
+
+    def install(self):
+        self.vm_steps = 0
+        self.interrupt_reason = None
+        _denials.action = None
+        self._deadline = monotonic() + self.max_seconds
+        self.conn.set_progress_handler(self._on_progress, DB_QUERY_PROGRESS_INTERVAL)
+
+    def uninstall(self):
+        self.conn.set_progress_handler(None, DB_QUERY_PROGRESS_INTERVAL)
+
+    def __enter__(self) -> "QueryGovernor":
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.uninstall()
+        return False
+
+    # Turn an error raised while the governor was installed into a governor verdict, if any
+    def classify_error(self, error: sqlite3.DatabaseError) -> Optional[Dict]:
+        if self.interrupt_reason == "timeout":
+            return QueryTooExpensiveError(
+                "timeout",
+                f"Query exceeded the {self.max_seconds}s time limit.",
+                self.limits(),
+            ).to_dict()
+        if self.interrupt_reason == "vm_steps":
+            return QueryTooExpensiveError(
+                "vm_steps",
+                f"Query exceeded the {self.max_vm_steps} VM step limit.",
+                self.limits(),
+            ).to_dict()
+        denied_action = getattr(_denials, "action", None)
+        if denied_action is not None:
+            logger.info(f"Query rejected by authorizer: {denied_action}")
+            return self.reject()
+        return None
+
+    def reject(self) -> Dict:
+        return {
+            "status": "rejected",
+            "message": "Only read-only SELECT statements are allowed.",
+        }
+
+    def check_row_count(self, row_count: int):
+        if row_count > self.max_rows:
+            raise QueryTooExpensiveError(
+                "row_limit",
+                f"Query returned more than {self.max_rows} rows.",
+                self.limits(),
+            )
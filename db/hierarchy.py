@@ -0,0 +1,78 @@
+from pool import get_pool
+from version import get_data_version_watcher
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# In-memory client -> bank -> accounts map of the transactions table, rebuilt whenever
+# the database's data version moves so that id validation never has to scan the table
+class ClientHierarchy:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._watcher = get_data_version_watcher(db_path=db_path)
+        self._lock = threading.Lock()
+        self._clients: Optional[Dict[int, Dict[int, FrozenSet[int]]]] = None
+        self._generation = None
+
+    def _build(self) -> Dict[int, Dict[int, FrozenSet[int]]]:
+        conn = get_pool(db_path=self.db_path).acquire()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT DISTINCT client_id, bank_id, account_id FROM transactions"
+            )
+            clients = {}
+            for client_id, bank_id, account_id in cursor:
+                clients.setdefault(client_id, {}).setdefault(bank_id, set()).add(
+                    account_id
+                )
+        finally:
+            cursor.close()
+        return {
+            client_id: {
+                bank_id: frozenset(accounts) for bank_id, accounts in banks.items()
+            }
+            for client_id, banks in clients.items()
+        }
+
+    # Return the up to date map, or None when it cannot be built
+    def get(self) -> Optional[Dict[int, Dict[int, FrozenSet[int]]]]:
+        generation = self._watcher.current()
+        if generation == self._generation:
+            return self._clients
+
+        with self._lock:
+            if generation != self._generation:
+                try:
+                    self._clients = self._build()
+                    self._generation = generation
+                    logger.info(
+                        f"Client hierarchy of {self.db_path.name} rebuilt with {len(self._clients)} clients"
+                    )
+                except sqlite3.Error as e:
+                    logger.info(f"Unable to build client hierarchy: {e}")
+                    self._clients = None
+                    self._generation = None
+            return self._clients
+
+
+_hierarchies: Dict[Path, ClientHierarchy] = {}
+_hierarchies_lock = threading.Lock()
+
+
+# Get (or lazily create) the shared client hierarchy for a database file
+def get_client_hierarchy(db_path: Path) -> ClientHierarchy:
+    key = Path(db_path).resolve()
+    hierarchy = _hierarchies.get(key)
+    if hierarchy is None:
+        with _hierarchies_lock:
+            hierarchy = _hierarchies.get(key)
+            if hierarchy is None:
+                hierarchy = ClientHierarchy(key)
+                _hierarchies[key] = hierarchy
+    return hierarchy
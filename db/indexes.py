@@ -0,0 +1,112 @@
+from pool import DB_POOL_BUSY_TIMEOUT_MS
+from pathlib import Path
+from typing import Dict, List
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Composite indexes backing the mandatory client/bank/account filters that every generated
+# query carries, followed by the column the query most often ranges or groups on
+TRANSACTIONS_INDEXES: Dict[str, List[str]] = {
+    "idx_transactions_client_bank_account_date": [
+        "client_id",
+        "bank_id",
+        "account_id",
+        "transaction_date",
+    ],
+    "idx_transactions_client_bank_account_category": [
+        "client_id",
+        "bank_id",
+        "account_id",
+        "category",
+    ],
+    "idx_transactions_client_bank_account_merchant": [
+        "client_id",
+        "bank_id",
+        "account_id",
+        "merchant",
+    ],
+}
+
+
+# Read the columns of every existing index on a table
+def get_existing_indexes(
+    conn: sqlite3.Connection, table: str = "transactions"
+) -> Dict[str, List[str]]:
+    indexes = {}
+    for row in conn.execute(f"PRAGMA index_list({table});").fetchall():
+        index_name = row[1]
+        columns = conn.execute(f"PRAGMA index_info({index_name});").fetchall()
+        indexes[index_name] = [col[2] for col in sorted(columns, key=lambda c: c[0])]
+    return indexes
+
+
+# Create missing indexes, rebuild ones whose columns drifted and refresh planner statistics,
+# inside the caller's transaction on an open connection
+def apply_indexes(
+    conn: sqlite3.Connection, indexes: Dict[str, List[str]] = None
+) -> Dict:
+    indexes = TRANSACTIONS_INDEXES if indexes is None else indexes
+    report = {"created": [], "rebuilt": [], "verified": []}
+
+    existing = get_existing_indexes(conn)
+    for index_name, columns in indexes.items():
+        if existing.get(index_name) == columns:
+            report["verified"].append(index_name)
+            continue
+        if index_name in existing:
+            conn.execute(f"DROP INDEX {index_name};")
+            report["rebuilt"].append(index_name)
+        else:
+            report["created"].append(index_name)
+        conn.execute(
+            f"CREATE INDEX {index_name} ON transactions ({', '.join(columns)});"
+        )
+
+    if report["created"] or report["rebuilt"]:
+        conn.execute("ANALYZE transactions;")
+    else:
+        conn.execute("PRAGMA optimize;")
+    return report
+
+
+def ensure_indexes(db_path: Path, indexes: Dict[str, List[str]] = None) -> Dict:
+    indexes = TRANSACTIONS_INDEXES if indexes is None else indexes
+
+    try:
+        conn = sqlite3.connect(db_path, timeout=DB_POOL_BUSY_TIMEOUT_MS / 1000)
+    except sqlite3.Error as e:
+        logger.info(
+            f"Error connecting to database when executing 'ensure_indexes': {e}"
+        )
+        return {"status": "error", "message": "Database connection failed."}
+
+    try:
+        with conn:
+            report = apply_indexes(conn, indexes)
+
+        existing = get_existing_indexes(conn)
+        missing = [name for name, cols in indexes.items() if existing.get(name) != cols]
+        if missing:
+            return {"status": "error", "message": f"Indexes not in place: {missing}"}
+
+        logger.info(f"Transactions indexes: {report}")
+        return {"status": "success", **report}
+
+    except sqlite3.Error as e:
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing ensure_indexes: {e}",
+        }
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    root_dir = Path(__file__).resolve().parent
+    db_path = root_dir / "transactions.db"
+
+    # Test ensure_indexes
+    print(ensure_indexes(db_path=db_path))
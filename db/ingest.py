@@ -0,0 +1,282 @@
+from indexes import TRANSACTIONS_INDEXES, apply_indexes
+from aggregates import update_summary_tables
+from pool import DB_POOL_BUSY_TIMEOUT_MS
+from shards import DB_SHARD_COUNT, DB_SHARD_DIR, ShardRouter
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterator, List, Set, Tuple
+import argparse
+import csv
+import sqlite3
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# pyarrow is optional, it is only needed to load parquet files
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+TRANSACTIONS_COLUMNS = [
+    "client_id",
+    "bank_id",
+    "account_id",
+    "transaction_id",
+    "transaction_date",
+    "description",
+    "category",
+    "merchant",
+    "debit",
+    "credit",
+]
+INTEGER_COLUMNS = {"client_id", "bank_id", "account_id", "transaction_id"}
+REAL_COLUMNS = {"debit", "credit"}
+LOWER_CASED_COLUMNS = {"description", "category", "merchant"}
+
+DEFAULT_BATCH_SIZE = 50000
+
+UPSERT_SQL = f"""
+    INSERT INTO transactions ({", ".join(TRANSACTIONS_COLUMNS)})
+    VALUES ({", ".join("?" for _ in TRANSACTIONS_COLUMNS)})
+    ON CONFLICT (transaction_id) DO UPDATE SET
+        {", ".join(f"{col} = excluded.{col}" for col in TRANSACTIONS_COLUMNS if col != "transaction_id")}
+"""
+
+
+def create_transactions_table(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            client_id INTEGER,
+            bank_id INTEGER,
+            account_id INTEGER,
+            transaction_id INTEGER,
+            transaction_date TIMESTAMP,
+            description TEXT,
+            category TEXT,
+            merchant TEXT,
+            debit REAL,
+            credit REAL
+        )
+        """)
+    # Upserts resolve conflicts on transaction_id, so it has to be unique
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_transaction_id ON transactions (transaction_id)"
+    )
+
+
+# Convert one source record into a row tuple in TRANSACTIONS_COLUMNS order
+def to_row(record: Dict) -> Tuple:
+    row = []
+    for col in TRANSACTIONS_COLUMNS:
+        value = record.get(col)
+        if value == "" or value is None:
+            value = None
+        elif col in INTEGER_COLUMNS:
+            value = int(value)
+        elif col in REAL_COLUMNS:
+            value = float(value)
+        elif col in LOWER_CASED_COLUMNS:
+            value = str(value).lower()
+        else:
+            value = str(value)
+        row.append(value)
+    return tuple(row)
+
+
+def read_csv_batches(path: Path, batch_size: int) -> Iterator[List[Tuple]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        batch = []
+        for record in csv.DictReader(f):
+            batch.append(to_row(record))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def read_parquet_batches(path: Path, batch_size: int) -> Iterator[List[Tuple]]:
+    if pq is None:
+        raise RuntimeError("pyarrow is required to load parquet files")
+    parquet_file = pq.ParquetFile(path)
+    for record_batch in parquet_file.iter_batches(
+        batch_size=batch_size, columns=TRANSACTIONS_COLUMNS
+    ):
+        yield [to_row(record) for record in record_batch.to_pylist()]
+
+
+def read_batches(path: Path, batch_size: int) -> Iterator[List[Tuple]]:
+    if path.suffix.lower() == ".parquet":
+        return read_parquet_batches(path, batch_size)
+    return read_csv_batches(path, batch_size)
+
+
+# Accounts an upsert batch touches through rows that already exist: the account owning each
+# row before the update and the account it belongs to afterwards
+def get_updated_accounts(
+    conn: sqlite3.Connection, batch: List[Tuple]
+) -> Set[Tuple[int, int, int]]:
+    incoming = {row[3]: row[:3] for row in batch}
+    transaction_ids = list(incoming)
+    accounts = set()
+    # Stay below sqlite's bound parameter limit
+    for i in range(0, len(transaction_ids), 900):
+        chunk = transaction_ids[i : i + 900]
+        for transaction_id, *account in conn.execute(
+            f"SELECT transaction_id, client_id, bank_id, account_id FROM transactions WHERE transaction_id IN ({', '.join('?' for _ in chunk)})",
+            chunk,
+        ):
+            accounts.add(tuple(account))
+            accounts.add(incoming[transaction_id])
+    return accounts
+
+
+# Writable connection tuned for bulk loading, with the transactions table in place
+def connect_for_load(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=DB_POOL_BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-262144;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    with conn:
+        create_transactions_table(conn)
+    return conn
+
+
+# Create the files of shards that have no clients yet, so every shard can be queried
+def create_missing_shards(router: ShardRouter):
+    for shard_path in router.shard_paths():
+        if not shard_path.exists():
+            connect_for_load(shard_path).close()
+            logger.info(f"Created empty shard {shard_path.name}")
+
+
+# Load transaction files into the shard databases. Each shard is loaded in a single write
+# transaction, together with its indexes and summary tables, committed once everything is in:
+# readers never see a half-loaded shard, and since every commit changes the data version that
+# the result cache and client hierarchy are invalidated on, they are invalidated once per run
+# rather than per batch. On the initial load into an empty shard the composite indexes are
+# dropped and rebuilt at the end, otherwise rows are upserted by transaction_id and the
+# accounts they touched are tracked so the summary tables can be recomputed.
+def ingest_files(
+    router: ShardRouter, paths: List[Path], batch_size: int = DEFAULT_BATCH_SIZE
+) -> Dict:
+    start = perf_counter()
+    conns: Dict[int, sqlite3.Connection] = {}
+    initial_loads: Dict[int, bool] = {}
+    changed_accounts: Dict[int, Set[Tuple[int, int, int]]] = {}
+    shard_rows: Dict[int, int] = {}
+    rows_loaded = 0
+
+    def open_shard(shard: int) -> sqlite3.Connection:
+        conn = connect_for_load(router.shard_path(shard))
+        conns[shard] = conn
+        conn.execute("BEGIN IMMEDIATE;")
+        initial_load = (
+            conn.execute("SELECT 1 FROM transactions LIMIT 1").fetchone() is None
+        )
+        if initial_load:
+            for index_name in TRANSACTIONS_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index_name};")
+            logger.info(
+                f"Initial load of {router.shard_path(shard).name}, index creation deferred until the end"
+            )
+        initial_loads[shard] = initial_load
+        changed_accounts[shard] = set()
+        shard_rows[shard] = 0
+        return conn
+
+    try:
+        for path in paths:
+            file_start = perf_counter()
+            file_rows = 0
+            for batch in read_batches(Path(path), batch_size):
+                shard_batches: Dict[int, List[Tuple]] = {}
+                for row in batch:
+                    shard_batches.setdefault(router.shard_of(row[0]), []).append(row)
+                for shard, rows in shard_batches.items():
+                    conn = conns.get(shard) or open_shard(shard)
+                    if not initial_loads[shard]:
+                        changed_accounts[shard].update(get_updated_accounts(conn, rows))
+                    conn.executemany(UPSERT_SQL, rows)
+                    shard_rows[shard] += len(rows)
+                file_rows += len(batch)
+            elapsed = perf_counter() - file_start
+            logger.info(
+                f"Loaded {file_rows} rows from {Path(path).name} in {elapsed:.2f}s ({file_rows / max(elapsed, 1e-9):,.0f} rows/s)"
+            )
+            rows_loaded += file_rows
+
+        load_seconds = perf_counter() - start
+        shards = {}
+        for shard in sorted(conns):
+            conn = conns[shard]
+            indexes = apply_indexes(conn)
+            aggregates_start = perf_counter()
+            aggregates = update_summary_tables(conn, accounts=changed_accounts[shard])
+            shards[router.shard_path(shard).name] = {
+                "rows_loaded": shard_rows[shard],
+                "initial_load": initial_loads[shard],
+                "indexes": {"status": "success", **indexes},
+                "aggregates": {
+                    "status": "success",
+                    **aggregates,
+                    "seconds": round(perf_counter() - aggregates_start, 3),
+                },
+            }
+
+        for conn in conns.values():
+            conn.commit()
+        total_seconds = perf_counter() - start
+
+    except (sqlite3.Error, OSError, ValueError, RuntimeError) as e:
+        # Closing the connections rolls back the shards that were not committed yet
+        return {
+            "status": "error",
+            "message": f"Error occurred when executing ingest_files, the load was rolled back: {e}",
+            "rows_loaded": rows_loaded,
+        }
+
+    finally:
+        for conn in conns.values():
+            conn.close()
+
+    report = {
+        "status": "success",
+        "rows_loaded": rows_loaded,
+        "load_seconds": round(load_seconds, 3),
+        "rows_per_second": round(rows_loaded / max(load_seconds, 1e-9)),
+        "total_seconds": round(total_seconds, 3),
+        "shards": shards,
+    }
+    logger.info(
+        f"Ingested {rows_loaded} rows into {len(shards)} shard(s) at {report['rows_per_second']:,} rows/s"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Load transaction CSV/Parquet files into the transactions shard databases"
+    )
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--shard-dir", type=Path, default=DB_SHARD_DIR)
+    parser.add_argument("--shards", type=int, default=DB_SHARD_COUNT)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    result = ingest_files(
+        router=ShardRouter(shard_dir=args.shard_dir, shard_count=args.shards),
+        paths=args.files,
+        batch_size=args.batch_size,
+    )
+    print(result)
+    sys.exit(0 if result["status"] == "success" else 1)
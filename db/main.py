@@ -2,12 +2,39 @@ from function import (
     get_client_with_single_bank_and_account_id,
     validify_client_bank_account_ids,
     execute_sql_query,
+    execute_sql_batch,
+    explain_sql_query,
+    stream_sql_query,
+    QueryStream,
 )
-from fastapi import FastAPI
+from pool import get_pool, close_all_pools, get_pool_stats
+from indexes import ensure_indexes
+from aggregates import refresh_aggregates
+from hierarchy import get_client_hierarchy
+from version import close_all_watchers
+from cache import get_result_cache_stats
+from statements import get_all_statement_stats
+from shards import ShardRouter, ShardRoutingError
+from ingest import create_missing_shards
+from executor import (
+    QueryExecutor,
+    ExecutorSaturatedError,
+    DB_EXECUTOR_RETRY_AFTER_SECONDS,
+)
+from encoding import (
+    RESULT_FORMAT_HEADER,
+    MSGPACK_MEDIA_TYPE,
+    resolve_result_format,
+    encode_msgpack,
+)
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 import uvicorn
-from pathlib import Path
-from pydantic import BaseModel
-from typing import Dict
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Dict, List, Literal, Optional
+import json
 import logging
 import warnings
 import sys
@@ -22,16 +49,54 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)],
 )
 
+# Route every call to the sqlite shard holding its client (a single transactions.db by default)
+router = ShardRouter()
+
+# All blocking sqlite work runs on the executor's workers behind its admission queue
+executor = QueryExecutor()
+
+
+# Make sure every shard exists with up-to-date indexes and summary tables, create the connection
+# pools and load the client hierarchies on startup, then release every sqlite connection on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    create_missing_shards(router)
+    for shard_path in router.shard_paths():
+        ensure_indexes(db_path=shard_path)
+        refresh_aggregates(db_path=shard_path)
+        get_pool(db_path=shard_path)
+        get_client_hierarchy(db_path=shard_path).get()
+    yield
+    executor.shutdown()
+    close_all_watchers()
+    close_all_pools()
+
+
 # Initialize fastapi
 app = FastAPI(
     title="Transactions Database API",
     description="APIs for executing SQL queries, get bank and account ids, validify ids and check health",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
-# Initialize sqlite db path
-ROOT_DIR = Path(__file__).resolve().parent
-DB_PATH = ROOT_DIR / "transactions.db"
+
+# Shed load quickly when the admission queue is full instead of letting latency grow
+@app.exception_handler(ExecutorSaturatedError)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturatedError):
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": f"Database service is busy: {exc}"},
+        headers={"Retry-After": str(DB_EXECUTOR_RETRY_AFTER_SECONDS)},
+    )
+
+
+# Queries that cannot be routed to one shard are rejected as bad requests
+@app.exception_handler(ShardRoutingError)
+async def shard_routing_handler(request: Request, exc: ShardRoutingError):
+    return JSONResponse(
+        status_code=400, content={"status": "error", "message": str(exc)}
+    )
 
 
 # Create expected request payload to validify user info
@@ -46,32 +111,245 @@ class ExecuteQueryRequest(BaseModel):
     sql_query: str
 
 
+# Create expected request payload to execute several named sql queries in one snapshot
+class BatchStatement(BaseModel):
+    name: str
+    sql_query: str
+
+
+class ExecuteBatchRequest(BaseModel):
+    statements: List[BatchStatement] = Field(..., min_length=1)
+
+
+# Create expected request payload to stream sql query results page by page
+class ExecuteQueryStreamRequest(BaseModel):
+    sql_query: str
+    page_size: Optional[int] = Field(default=None, ge=1)
+    cursor: Optional[str] = None
+    format: Literal["ndjson", "json"] = "ndjson"
+
+
+# One JSON object per line: a header with the columns, the rows and an end trailer.
+# Rows are sent one object per line, or one line per fetched batch when columnar.
+# A query stopped mid-stream ends with an error line carrying its status instead.
+async def generate_ndjson(
+    stream: QueryStream, columnar: bool = False
+) -> AsyncIterator[str]:
+    yield json.dumps({"type": "header", "columns": stream.columns}) + "\n"
+    try:
+        async for rows in executor.iterate(stream):
+            if columnar:
+                yield json.dumps({"type": "rows", "rows": rows}) + "\n"
+                continue
+            yield "".join(
+                json.dumps({"type": "row", "data": dict(zip(stream.columns, row))})
+                + "\n"
+                for row in rows
+            )
+    except Exception as e:
+        stream.error = {"status": "error", "message": f"Streaming failed: {e}"}
+    if stream.error is not None:
+        yield json.dumps({"type": "error", **stream.error}) + "\n"
+        return
+    yield json.dumps(
+        {
+            "type": "end",
+            "row_count": stream.row_count,
+            "next_cursor": stream.next_cursor,
+        }
+    ) + "\n"
+
+
+# The same document as the buffered endpoint, written out chunk by chunk
+async def generate_chunked_json(
+    stream: QueryStream, columnar: bool = False
+) -> AsyncIterator[str]:
+    yield '{"columns": ' + json.dumps(stream.columns)
+    yield ', "rows": [' if columnar else ', "formatted_results": ['
+    separator = ""
+    try:
+        async for rows in executor.iterate(stream):
+            if columnar:
+                yield separator + ", ".join(json.dumps(row) for row in rows)
+            else:
+                yield separator + ", ".join(
+                    json.dumps(dict(zip(stream.columns, row))) for row in rows
+                )
+            separator = ", "
+    except Exception as e:
+        stream.error = {"status": "error", "message": f"Streaming failed: {e}"}
+    if stream.error is not None:
+        yield "], " + json.dumps(stream.error)[1:]
+        return
+    yield '], "status": "success", "row_count": ' + json.dumps(stream.row_count)
+    yield ', "next_cursor": ' + json.dumps(stream.next_cursor) + "}"
+
+
 @app.post("/api/validify/client-bank-account", response_model=Dict)
-def validify_client_bank_account(request: ValidifyIDRequest):
-    return validify_client_bank_account_ids(
-        db_path=DB_PATH,
+async def validify_client_bank_account(request: ValidifyIDRequest):
+    return await executor.run(
+        validify_client_bank_account_ids,
+        db_path=router.shard_for_client(request.client_id),
         client_id=request.client_id,
         bank_id=request.bank_id,
         account_id=request.account_id,
     )
 
 
+# Encode a result document in the negotiated result format
+def encode_result(result: Dict, result_format: str) -> Response:
+    headers = {RESULT_FORMAT_HEADER: result_format}
+    if result_format == "msgpack":
+        return Response(
+            content=encode_msgpack(result),
+            media_type=MSGPACK_MEDIA_TYPE,
+            headers=headers,
+        )
+    return JSONResponse(content=result, headers=headers)
+
+
+# Results are encoded according to the X-Result-Format request header (see encoding.py)
 @app.post("/api/db/execute-query", response_model=Dict)
-def process_sql_query(request: ExecuteQueryRequest):
-    return execute_sql_query(db_path=DB_PATH, query=request.sql_query)
+async def process_sql_query(
+    request: ExecuteQueryRequest,
+    x_result_format: Optional[str] = Header(default=None),
+):
+    result_format = resolve_result_format(x_result_format)
+    result = await executor.run(
+        execute_sql_query,
+        db_path=router.route_query(request.sql_query),
+        query=request.sql_query,
+        columnar=result_format != "records",
+    )
+    return encode_result(result=result, result_format=result_format)
+
+
+@app.post("/api/db/execute-batch", response_model=Dict)
+async def process_sql_batch(
+    request: ExecuteBatchRequest,
+    x_result_format: Optional[str] = Header(default=None),
+):
+    statements = {
+        statement.name: statement.sql_query for statement in request.statements
+    }
+    if len(statements) != len(request.statements):
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "message": "Statement names must be unique."},
+        )
+
+    result_format = resolve_result_format(x_result_format)
+    result = await executor.run(
+        execute_sql_batch,
+        db_path=router.route_queries(statements.values()),
+        statements=statements,
+        columnar=result_format != "records",
+    )
+    return encode_result(result=result, result_format=result_format)
+
+
+# Streams support the records and columnar formats, msgpack is served as columnar
+@app.post("/api/db/execute-query/stream")
+async def process_sql_query_stream(
+    request: ExecuteQueryStreamRequest,
+    x_result_format: Optional[str] = Header(default=None),
+):
+    result_format = resolve_result_format(x_result_format)
+    if result_format == "msgpack":
+        result_format = "columnar"
+    columnar = result_format == "columnar"
+    headers = {RESULT_FORMAT_HEADER: result_format}
+
+    result = await executor.run(
+        stream_sql_query,
+        db_path=router.route_query(request.sql_query),
+        query=request.sql_query,
+        page_size=request.page_size,
+        cursor=request.cursor,
+    )
+    if result["status"] != "success":
+        return JSONResponse(content=result, headers=headers)
+
+    stream = result["stream"]
+    # Closed on the workers, after the last fetch, even when the client disconnected mid-stream
+    close_stream = BackgroundTask(executor.run, stream.close, admitted=True)
+    if request.format == "ndjson":
+        return StreamingResponse(
+            generate_ndjson(stream, columnar=columnar),
+            media_type="application/x-ndjson",
+            headers=headers,
+            background=close_stream,
+        )
+    return StreamingResponse(
+        generate_chunked_json(stream, columnar=columnar),
+        media_type="application/json",
+        headers=headers,
+        background=close_stream,
+    )
+
+
+# Diagnose how sqlite would execute a query, flagging full-table scans
+@app.post("/api/db/explain-query", response_model=Dict)
+async def explain_query(request: ExecuteQueryRequest):
+    return await executor.run(
+        explain_sql_query,
+        db_path=router.route_query(request.sql_query),
+        query=request.sql_query,
+    )
 
 
 @app.get("/api/client/{client_id}/bank-account", response_model=Dict)
-def get_client_bank_account(client_id: int):
-    return get_client_with_single_bank_and_account_id(
-        db_path=DB_PATH, client_id=client_id
+async def get_client_bank_account(client_id: int):
+    return await executor.run(
+        get_client_with_single_bank_and_account_id,
+        db_path=router.shard_for_client(client_id),
+        client_id=client_id,
     )
 
 
+@app.get("/api/db/cache-stats", response_model=Dict)
+def cache_stats():
+    return {"status": "success", "result_cache": get_result_cache_stats()}
+
+
+@app.get("/api/db/statement-stats", response_model=Dict)
+def statement_stats():
+    return {"status": "success", "statements": get_all_statement_stats()}
+
+
+@app.get("/api/db/executor-stats", response_model=Dict)
+def executor_stats():
+    return {"status": "success", "executor": executor.stats()}
+
+
 @app.get("/api/health", response_model=Dict)
 def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "shards": router.shard_count,
+        "connection_pools": get_pool_stats(),
+        "executor": executor.stats(),
+    }
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8070, reload=True)
+    if sys.argv[1:] == ["--check"]:
+        # Test request validation locally: rejected before any database is opened, so the
+        # app runs without its lifespan
+        from fastapi.testclient import TestClient
+
+        client = TestClient(app)
+        response = client.post(
+            "/api/db/execute-batch",
+            json={
+                "statements": [
+                    {"name": "total", "sql_query": "SELECT 1"},
+                    {"name": "total", "sql_query": "SELECT 2"},
+                ]
+            },
+        )
+        assert response.status_code == 400, response
+        assert response.json()["status"] == "error", response.json()
+        print(response.status_code, response.json())
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8070, reload=True)
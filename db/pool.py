@@ -0,0 +1,216 @@
+from governor import install_authorizer
+import sqlite3
+import threading
+import logging
+import os
+from pathlib import Path
+from time import monotonic
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Connection tuning, overridable through the service environment
+DB_POOL_CACHE_SIZE_KIB = int(os.getenv("DB_POOL_CACHE_SIZE_KIB", "65536"))
+DB_POOL_MMAP_SIZE_BYTES = int(os.getenv("DB_POOL_MMAP_SIZE_BYTES", "268435456"))
+DB_POOL_BUSY_TIMEOUT_MS = int(os.getenv("DB_POOL_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_MAX_CONNECTION_AGE_SECONDS = float(
+    os.getenv("DB_POOL_MAX_CONNECTION_AGE_SECONDS", "900")
+)
+DB_POOL_MAX_CONNECTION_USES = int(os.getenv("DB_POOL_MAX_CONNECTION_USES", "50000"))
+DB_POOL_HEALTH_CHECK_INTERVAL_SECONDS = float(
+    os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL_SECONDS", "30")
+)
+DB_POOL_MAX_IDLE_LEASED = int(os.getenv("DB_POOL_MAX_IDLE_LEASED", "4"))
+# Prepared statements kept per connection, keyed by the normalized sql text
+DB_POOL_STATEMENT_CACHE_SIZE = int(os.getenv("DB_POOL_STATEMENT_CACHE_SIZE", "256"))
+
+
+# Bookkeeping for one long-lived connection, owned by a worker thread or a lease
+class PooledConnection:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.created_at = monotonic()
+        self.last_checked_at = self.created_at
+        self.uses = 0
+
+    def is_expired(self) -> bool:
+        return (
+            monotonic() - self.created_at > DB_POOL_MAX_CONNECTION_AGE_SECONDS
+            or self.uses >= DB_POOL_MAX_CONNECTION_USES
+        )
+
+    def is_healthy(self) -> bool:
+        if monotonic() - self.last_checked_at < DB_POOL_HEALTH_CHECK_INTERVAL_SECONDS:
+            return True
+        try:
+            self.conn.execute("SELECT 1").fetchone()
+            self.last_checked_at = monotonic()
+            return True
+        except sqlite3.Error as e:
+            logger.info(f"Pooled connection failed health check: {e}")
+            return False
+
+
+# Per-thread pool of read-only sqlite connections for a single database file
+class ConnectionPool:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, PooledConnection] = {}
+        self._idle_leased: List[PooledConnection] = []
+        self._leased = 0
+        self._opened = 0
+        self._recycled = 0
+        self._enable_wal()
+
+    # WAL is persisted in the database file, so it has to be switched on once through a writable connection
+    def _enable_wal(self):
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=DB_POOL_BUSY_TIMEOUT_MS / 1000)
+            try:
+                journal_mode = conn.execute("PRAGMA journal_mode=WAL;").fetchone()[0]
+                logger.info(f"Journal mode for {self.db_path.name}: {journal_mode}")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.info(f"Unable to enable WAL mode for {self.db_path}: {e}")
+
+    def _connect(self) -> PooledConnection:
+        conn = sqlite3.connect(
+            f"{self.db_path.as_uri()}?mode=ro",
+            uri=True,
+            timeout=DB_POOL_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_POOL_STATEMENT_CACHE_SIZE,
+        )
+        conn.execute(f"PRAGMA cache_size=-{DB_POOL_CACHE_SIZE_KIB};")
+        conn.execute(f"PRAGMA mmap_size={DB_POOL_MMAP_SIZE_BYTES};")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        install_authorizer(conn)
+        with self._lock:
+            self._opened += 1
+        return PooledConnection(conn)
+
+    def _open(self) -> PooledConnection:
+        pooled = self._connect()
+        with self._lock:
+            self._connections[threading.get_ident()] = pooled
+        return pooled
+
+    def _discard(self, pooled: PooledConnection):
+        with self._lock:
+            if self._connections.get(threading.get_ident()) is pooled:
+                del self._connections[threading.get_ident()]
+            self._recycled += 1
+        try:
+            pooled.conn.close()
+        except sqlite3.Error:
+            pass
+        self._local.pooled = None
+
+    # Return the calling thread's connection, reopening it when it is stale or broken
+    def acquire(self) -> sqlite3.Connection:
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is not None and (pooled.is_expired() or not pooled.is_healthy()):
+            self._discard(pooled)
+            pooled = None
+        if pooled is None:
+            pooled = self._open()
+            self._local.pooled = pooled
+        pooled.uses += 1
+        return pooled.conn
+
+    # Drop the calling thread's connection after an unrecoverable error
+    def invalidate(self):
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is not None:
+            self._discard(pooled)
+
+    # Lease a connection that is not tied to the calling thread, for cursors that
+    # outlive a single call (e.g. streamed results consumed across threadpool hops)
+    def checkout(self) -> PooledConnection:
+        pooled = None
+        with self._lock:
+            if self._idle_leased:
+                pooled = self._idle_leased.pop()
+            self._leased += 1
+        if pooled is not None and (pooled.is_expired() or not pooled.is_healthy()):
+            self._close_leased(pooled)
+            pooled = None
+        if pooled is None:
+            pooled = self._connect()
+        pooled.uses += 1
+        return pooled
+
+    def checkin(self, pooled: PooledConnection, discard: bool = False):
+        with self._lock:
+            self._leased -= 1
+            if not discard and len(self._idle_leased) < DB_POOL_MAX_IDLE_LEASED:
+                self._idle_leased.append(pooled)
+                return
+        self._close_leased(pooled)
+
+    def _close_leased(self, pooled: PooledConnection):
+        with self._lock:
+            self._recycled += 1
+        try:
+            pooled.conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values()) + self._idle_leased
+            self._connections.clear()
+            self._idle_leased = []
+        for pooled in connections:
+            try:
+                pooled.conn.close()
+            except sqlite3.Error:
+                pass
+        # Connections cached in other threads' locals are now closed and will fail
+        # their next health check, so force an immediate reopen on next use
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "db": self.db_path.name,
+                "open_connections": len(self._connections),
+                "leased_connections": self._leased,
+                "idle_leased_connections": len(self._idle_leased),
+                "opened_total": self._opened,
+                "recycled_total": self._recycled,
+                "statement_cache_size": DB_POOL_STATEMENT_CACHE_SIZE,
+            }
+
+
+_pools: Dict[Path, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+# Get (or lazily create) the shared pool for a database file
+def get_pool(db_path: Path) -> ConnectionPool:
+    key = Path(db_path).resolve()
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(key)
+                _pools[key] = pool
+    return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+
+def get_pool_stats() -> Dict:
+    with _pools_lock:
+        return {str(path.name): pool.stats() for path, pool in _pools.items()}
@@ -0,0 +1,297 @@
+from ingest import TRANSACTIONS_COLUMNS, connect_for_load
+from indexes import TRANSACTIONS_INDEXES, ensure_indexes
+from aggregates import refresh_aggregates
+from shards import DB_SHARD_COUNT, DB_SHARD_DIR, ShardRouter
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List
+import argparse
+import sqlite3
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+COLUMNS_SQL = ", ".join(TRANSACTIONS_COLUMNS)
+
+
+def _bump_data_version(conn: sqlite3.Connection, schema: str = "main"):
+    user_version = conn.execute(f"PRAGMA {schema}.user_version;").fetchone()[0]
+    conn.execute(f"PRAGMA {schema}.user_version = {user_version + 1};")
+
+
+# Number of rows of every client, per shard
+def get_client_rows(router: ShardRouter) -> Dict[int, Dict[int, int]]:
+    client_rows = {}
+    for shard, shard_path in enumerate(router.shard_paths()):
+        client_rows[shard] = {}
+        if not shard_path.exists():
+            continue
+        conn = sqlite3.connect(f"{shard_path.as_uri()}?mode=ro", uri=True)
+        try:
+            client_rows[shard] = dict(
+                conn.execute(
+                    "SELECT client_id, COUNT(*) FROM transactions GROUP BY client_id"
+                ).fetchall()
+            )
+        finally:
+            conn.close()
+    return client_rows
+
+
+def shard_status(router: ShardRouter) -> Dict:
+    try:
+        client_rows = get_client_rows(router)
+    except sqlite3.Error as e:
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing shard_status: {e}",
+        }
+    return {
+        "status": "success",
+        "shards": [
+            {
+                "shard": shard,
+                "file": router.shard_path(shard).name,
+                "clients": len(clients),
+                "rows": sum(clients.values()),
+            }
+            for shard, clients in client_rows.items()
+        ],
+        "moved_clients": len(router.assignments()),
+    }
+
+
+# Split a single transactions database into the shard layout of the router
+def split_database(source_path: Path, router: ShardRouter) -> Dict:
+    start = perf_counter()
+    source_path = Path(source_path)
+    if source_path.resolve() in {path.resolve() for path in router.shard_paths()}:
+        return {"status": "error", "message": "The source must not be a shard file."}
+
+    report = {"status": "success", "shards": {}}
+    try:
+        source = sqlite3.connect(f"{source_path.as_uri()}?mode=ro", uri=True)
+        try:
+            client_ids = [
+                row[0]
+                for row in source.execute(
+                    "SELECT DISTINCT client_id FROM transactions"
+                ).fetchall()
+            ]
+        finally:
+            source.close()
+
+        for shard, shard_path in enumerate(router.shard_paths()):
+            shard_clients = [
+                (client_id,)
+                for client_id in client_ids
+                if router.shard_of(client_id) == shard
+            ]
+            conn = connect_for_load(shard_path)
+            try:
+                if conn.execute("SELECT 1 FROM transactions LIMIT 1").fetchone():
+                    raise ValueError(f"Shard {shard_path.name} is not empty")
+                # Indexes are built once the rows are in, as on an initial ingestion
+                for index_name in TRANSACTIONS_INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {index_name};")
+                conn.execute("ATTACH DATABASE ? AS source", (str(source_path),))
+                conn.execute(
+                    "CREATE TEMP TABLE shard_clients (client_id INTEGER PRIMARY KEY)"
+                )
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO temp.shard_clients VALUES (?)", shard_clients
+                    )
+                    rows = conn.execute(f"""
+                        INSERT INTO main.transactions ({COLUMNS_SQL})
+                        SELECT {COLUMNS_SQL} FROM source.transactions
+                        WHERE client_id IN (SELECT client_id FROM temp.shard_clients)
+                        """).rowcount
+                    _bump_data_version(conn)
+            finally:
+                conn.close()
+
+            ensure_indexes(db_path=shard_path)
+            refresh_aggregates(db_path=shard_path, full=True)
+            report["shards"][shard_path.name] = {
+                "clients": len(shard_clients),
+                "rows": rows,
+            }
+            logger.info(
+                f"Split {rows} rows of {len(shard_clients)} clients into {shard_path.name}"
+            )
+
+    except (sqlite3.Error, ValueError) as e:
+        return {
+            "status": "error",
+            "message": f"Error occurred when executing split_database: {e}",
+        }
+
+    report["seconds"] = round(perf_counter() - start, 3)
+    return report
+
+
+# Move all rows of a client to another shard. Rows are copied first, then the shard map is
+# switched over and only then are the rows deleted from the old shard, so the client stays
+# readable throughout.
+def move_client(router: ShardRouter, client_id: int, target: int) -> Dict:
+    start = perf_counter()
+    source = router.shard_of(client_id)
+    if source == target:
+        return {"status": "success", "moved_rows": 0, "message": "Already on shard."}
+    source_path, target_path = router.shard_path(source), router.shard_path(target)
+
+    try:
+        conn = connect_for_load(target_path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS source", (str(source_path),))
+            accounts = conn.execute(
+                "SELECT DISTINCT client_id, bank_id, account_id FROM source.transactions WHERE client_id = ?",
+                (client_id,),
+            ).fetchall()
+            # Leftovers of an interrupted move are replaced by the current rows
+            stale_accounts = conn.execute(
+                "SELECT DISTINCT client_id, bank_id, account_id FROM main.transactions WHERE client_id = ?",
+                (client_id,),
+            ).fetchall()
+            with conn:
+                conn.execute(
+                    "DELETE FROM main.transactions WHERE client_id = ?", (client_id,)
+                )
+                moved_rows = conn.execute(
+                    f"""
+                    INSERT INTO main.transactions ({COLUMNS_SQL})
+                    SELECT {COLUMNS_SQL} FROM source.transactions WHERE client_id = ?
+                    """,
+                    (client_id,),
+                ).rowcount
+                _bump_data_version(conn)
+
+            router.assign_client(client_id=client_id, shard=target)
+
+            with conn:
+                conn.execute(
+                    "DELETE FROM source.transactions WHERE client_id = ?", (client_id,)
+                )
+                _bump_data_version(conn, schema="source")
+        finally:
+            conn.close()
+
+    except (sqlite3.Error, OSError, ValueError) as e:
+        return {
+            "status": "error",
+            "message": f"Error occurred when executing move_client: {e}",
+        }
+
+    refresh_aggregates(db_path=target_path, accounts=stale_accounts)
+    refresh_aggregates(db_path=source_path, accounts=accounts)
+    logger.info(
+        f"Moved {moved_rows} rows of client {client_id} from {source_path.name} to {target_path.name}"
+    )
+    return {
+        "status": "success",
+        "client_id": client_id,
+        "source": source,
+        "target": target,
+        "moved_rows": moved_rows,
+        "seconds": round(perf_counter() - start, 3),
+    }
+
+
+# Greedily move clients from the largest to the smallest shard until the row counts differ by
+# at most tolerance times the mean shard size. Only moves that shrink the gap are planned.
+def balance_shards(
+    router: ShardRouter, tolerance: float = 0.1, dry_run: bool = False
+) -> Dict:
+    try:
+        client_rows = get_client_rows(router)
+    except sqlite3.Error as e:
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing balance_shards: {e}",
+        }
+
+    moves: List[Dict] = []
+    while True:
+        totals = {
+            shard: sum(clients.values()) for shard, clients in client_rows.items()
+        }
+        heaviest = max(totals, key=totals.get)
+        lightest = min(totals, key=totals.get)
+        gap = totals[heaviest] - totals[lightest]
+        if gap <= tolerance * sum(totals.values()) / len(totals):
+            break
+        candidates = [
+            (abs(gap / 2 - rows), client_id)
+            for client_id, rows in client_rows[heaviest].items()
+            if rows < gap
+        ]
+        if not candidates:
+            break
+        _, client_id = min(candidates)
+        rows = client_rows[heaviest].pop(client_id)
+        client_rows[lightest][client_id] = rows
+        moves.append(
+            {
+                "client_id": client_id,
+                "source": heaviest,
+                "target": lightest,
+                "rows": rows,
+            }
+        )
+
+    if not dry_run:
+        for move in moves:
+            result = move_client(
+                router=router, client_id=move["client_id"], target=move["target"]
+            )
+            if result["status"] != "success":
+                return {**result, "moves": moves}
+
+    return {"status": "success", "dry_run": dry_run, "moves": moves}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Inspect, split and rebalance the transactions shards"
+    )
+    parser.add_argument("--shard-dir", type=Path, default=DB_SHARD_DIR)
+    parser.add_argument("--shards", type=int, default=DB_SHARD_COUNT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show clients and rows per shard")
+    split_parser = commands.add_parser(
+        "split", help="Split a single database into the shard layout"
+    )
+    split_parser.add_argument("source", type=Path)
+    move_parser = commands.add_parser("move", help="Move a client to another shard")
+    move_parser.add_argument("client_id", type=int)
+    move_parser.add_argument("target", type=int)
+    balance_parser = commands.add_parser(
+        "balance", help="Move clients until shard sizes are even"
+    )
+    balance_parser.add_argument("--tolerance", type=float, default=0.1)
+    balance_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    router = ShardRouter(shard_dir=args.shard_dir, shard_count=args.shards)
+    if args.command == "status":
+        result = shard_status(router)
+    elif args.command == "split":
+        result = split_database(source_path=args.source, router=router)
+    elif args.command == "move":
+        result = move_client(
+            router=router, client_id=args.client_id, target=args.target
+        )
+    else:
+        result = balance_shards(
+            router=router, tolerance=args.tolerance, dry_run=args.dry_run
+        )
+    print(result)
+    sys.exit(0 if result["status"] == "success" else 1)
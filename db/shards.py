@@ -0,0 +1,138 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Storage layout, overridable through the service environment. A single shard keeps the
+# original transactions.db file, N shards use transactions_0.db ... transactions_{N-1}.db.
+DB_SHARD_COUNT = int(os.getenv("DB_SHARD_COUNT", "1"))
+DB_SHARD_DIR = Path(os.getenv("DB_SHARD_DIR", str(Path(__file__).resolve().parent)))
+
+# Clients moved off their hash shard by the rebalancing tool, next to the shard files
+SHARD_MAP_FILE = "shard_map.json"
+
+# The sql generator always filters on one client, e.g. "client_id = 12" or "t.client_id = '12'"
+_CLIENT_FILTER = re.compile(r"\bclient_id\s*=\s*'?(\d+)'?", re.IGNORECASE)
+
+
+# Raised when a query cannot be sent to a single shard
+class ShardRoutingError(Exception):
+    pass
+
+
+# Maps clients to shard files: client_id modulo the shard count, unless the shard map
+# assigns the client elsewhere. The map is reloaded whenever the file changes on disk.
+class ShardRouter:
+    def __init__(
+        self, shard_dir: Path = DB_SHARD_DIR, shard_count: int = DB_SHARD_COUNT
+    ):
+        if shard_count < 1:
+            raise ValueError(f"Invalid shard count: {shard_count}")
+        self.shard_dir = Path(shard_dir)
+        self.shard_count = shard_count
+        self.map_path = self.shard_dir / SHARD_MAP_FILE
+        self._lock = threading.Lock()
+        self._assignments: Dict[int, int] = {}
+        self._map_mtime: Optional[Tuple[int, int]] = None
+
+    @property
+    def sharded(self) -> bool:
+        return self.shard_count > 1
+
+    def shard_path(self, shard: int) -> Path:
+        if not self.sharded:
+            return self.shard_dir / "transactions.db"
+        return self.shard_dir / f"transactions_{shard}.db"
+
+    def shard_paths(self) -> List[Path]:
+        return [self.shard_path(shard) for shard in range(self.shard_count)]
+
+    def _refresh_map(self):
+        # The map is replaced rather than rewritten, so a new inode means a new map
+        try:
+            stat = self.map_path.stat()
+            mtime = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._map_mtime:
+            return
+        with self._lock:
+            if mtime == self._map_mtime:
+                return
+            assignments = {}
+            if mtime is not None:
+                shard_map = json.loads(self.map_path.read_text())
+                if shard_map["shard_count"] != self.shard_count:
+                    raise ValueError(
+                        f"{self.map_path} was written for {shard_map['shard_count']} shards, not {self.shard_count}"
+                    )
+                assignments = {
+                    int(client_id): shard
+                    for client_id, shard in shard_map["clients"].items()
+                }
+                logger.info(f"Shard map loaded with {len(assignments)} moved clients")
+            self._assignments = assignments
+            self._map_mtime = mtime
+
+    def assignments(self) -> Dict[int, int]:
+        self._refresh_map()
+        return dict(self._assignments)
+
+    def shard_of(self, client_id: int) -> int:
+        if not self.sharded:
+            return 0
+        self._refresh_map()
+        return self._assignments.get(client_id, client_id % self.shard_count)
+
+    def shard_for_client(self, client_id: int) -> Path:
+        return self.shard_path(self.shard_of(client_id))
+
+    # Pin a client to a shard, written atomically so readers never see a partial map
+    def assign_client(self, client_id: int, shard: int):
+        if not 0 <= shard < self.shard_count:
+            raise ValueError(f"Invalid shard: {shard}")
+        assignments = self.assignments()
+        if shard == client_id % self.shard_count:
+            assignments.pop(client_id, None)
+        else:
+            assignments[client_id] = shard
+        tmp_path = self.map_path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "shard_count": self.shard_count,
+                    "clients": {
+                        str(client_id): shard
+                        for client_id, shard in sorted(assignments.items())
+                    },
+                },
+                indent=2,
+            )
+        )
+        os.replace(tmp_path, self.map_path)
+        self._refresh_map()
+
+    # Shard of a sql query, taken from its mandatory client_id filter
+    def route_query(self, query: str) -> Path:
+        if not self.sharded:
+            return self.shard_path(0)
+        client_ids = {int(client_id) for client_id in _CLIENT_FILTER.findall(query)}
+        if len(client_ids) != 1:
+            raise ShardRoutingError(
+                "Query must filter on exactly one client_id (e.g. client_id = 12) to be routed to a shard."
+            )
+        return self.shard_for_client(client_ids.pop())
+
+    # Shard of several queries that have to run on the same snapshot
+    def route_queries(self, queries: Iterable[str]) -> Path:
+        shard_paths = {self.route_query(query) for query in queries}
+        if len(shard_paths) != 1:
+            raise ShardRoutingError(
+                "All queries of a batch must filter on clients stored in the same shard."
+            )
+        return shard_paths.pop()
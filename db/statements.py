@@ -0,0 +1,221 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import os
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of distinct normalized statements tracked for the repeat statistics
+DB_STATEMENT_STATS_MAX_ENTRIES = int(
+    os.getenv("DB_STATEMENT_STATS_MAX_ENTRIES", "10000")
+)
+# Number of most repeated statements listed in the statistics
+DB_STATEMENT_STATS_TOP = int(os.getenv("DB_STATEMENT_STATS_TOP", "10"))
+
+_SQL_TOKEN = re.compile(
+    r"""
+    (?P<blob>[xX]'[0-9A-Fa-f]*')
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    |(?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    |(?P<number>0[xX][0-9A-Fa-f]+|(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<parameter>[?:@$][A-Za-z0-9_]*)
+    |(?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<space>\s+)
+    |(?P<operator><=|>=|<>|!=|==|\|\||<<|>>)
+    |(?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Keywords written in upper case in normalized statements. Function names and identifiers
+# keep their case, since sqlite uses the written text for unaliased result column names.
+SQL_KEYWORDS = {
+    "ALL", "AND", "AS", "ASC", "BETWEEN", "BY", "CASE", "CAST", "COLLATE", "CROSS",
+    "CURRENT", "DESC", "DISTINCT", "ELSE", "END", "ESCAPE", "EXCEPT", "EXISTS", "FILTER",
+    "FIRST", "FOLLOWING", "FROM", "FULL", "GLOB", "GROUP", "GROUPS", "HAVING", "IN",
+    "INDEXED", "INNER", "INTERSECT", "IS", "ISNULL", "JOIN", "LAST", "LEFT", "LIKE",
+    "LIMIT", "MATCH", "MATERIALIZED", "NATURAL", "NOT", "NOTNULL", "NULL", "NULLS",
+    "OFFSET", "ON", "OR", "ORDER", "OUTER", "OVER", "PARTITION", "PRECEDING", "RANGE",
+    "RECURSIVE", "REGEXP", "RIGHT", "ROW", "ROWS", "SELECT", "THEN", "UNBOUNDED", "UNION",
+    "USING", "VALUES", "WHEN", "WHERE", "WINDOW", "WITH",
+}  # fmt: skip
+
+# Keywords ending an ORDER BY / GROUP BY term list at the same nesting level
+_BY_LIST_END = {
+    "FROM", "HAVING", "LIMIT", "OFFSET", "SELECT", "UNION", "EXCEPT", "INTERSECT",
+    "WHERE", "WINDOW",
+}  # fmt: skip
+
+# Statements the db service runs for callers, anything else is rejected before execution
+READ_QUERY_KEYWORDS = {"SELECT", "WITH", "VALUES"}
+
+_MAX_SQLITE_INTEGER = 2**63 - 1
+
+
+def _literal_value(kind: str, text: str) -> Any:
+    if kind == "string":
+        return text[1:-1].replace("''", "'")
+    if text[:2] in ("0x", "0X"):
+        return int(text, 16)
+    if any(c in text for c in ".eE"):
+        return float(text)
+    return int(text)
+
+
+# Whitespace between two canonical tokens: none inside brackets, before commas, around dots
+# and between a function name and its arguments, a single space anywhere else
+def _separator(previous_kind: str, previous: str, kind: str, text: str) -> str:
+    if previous in ("(", ".") or text in (")", ",", "."):
+        return ""
+    if text == "(" and previous_kind == "word" and previous not in SQL_KEYWORDS:
+        return ""
+    return " "
+
+
+# Rewrite a sql query into a canonical template with its literals lifted into bound
+# parameters, so queries that only differ in ids, dates or layout share one prepared statement.
+# Comments are dropped, spacing is made uniform and keywords are upper-cased. Select lists
+# keep their expressions as written (they name the unaliased result columns), and positional
+# ORDER BY / GROUP BY terms are not lifted since they would turn into constant expressions.
+# Queries that already carry parameters are only canonicalized.
+def parameterize_sql(query: str) -> Tuple[str, Tuple]:
+    tokens = [
+        (m.lastgroup, m.group()) for m in _SQL_TOKEN.finditer(query.strip().rstrip(";"))
+    ]
+    lift = not any(kind == "parameter" for kind, _ in tokens)
+
+    parts: List[str] = []
+    params: List[Any] = []
+    # One entry per parenthesis level: [in select list, in ORDER/GROUP BY list, verbatim]
+    levels = [[False, False, False]]
+    previous_kind, previous = "", ""
+    previous_verbatim = False
+    spaced = False
+    for kind, text in tokens:
+        if kind in ("space", "comment"):
+            spaced = True
+            continue
+
+        level = levels[-1]
+        verbatim = level[0] or level[2]
+        upper = text.upper()
+
+        if text == "(":
+            levels.append([False, False, verbatim])
+        elif text == ")" and len(levels) > 1:
+            levels.pop()
+        elif kind == "word":
+            if upper == "SELECT":
+                level[0] = True
+                level[1] = False
+            elif upper == "FROM":
+                level[0] = False
+            if upper in _BY_LIST_END:
+                level[1] = False
+            if upper == "BY" and previous in ("ORDER", "GROUP"):
+                level[1] = True
+        # SELECT and FROM open and close a select list, both belong to the outer clause
+        in_select_list = verbatim and (level[0] or level[2])
+
+        if kind == "word" and upper in SQL_KEYWORDS:
+            # Aliases and DISTINCT/ALL are not part of a column name
+            if not in_select_list or (
+                not level[2] and (upper == "AS" or previous == "SELECT")
+            ):
+                text = upper
+        elif (
+            lift
+            and not in_select_list
+            and kind in ("string", "number")
+            and not (kind == "number" and level[1] and previous in ("BY", ","))
+        ):
+            value = _literal_value(kind, text)
+            if not isinstance(value, int) or abs(value) <= _MAX_SQLITE_INTEGER:
+                params.append(value)
+                text = "?"
+
+        if parts:
+            if in_select_list and previous_verbatim:
+                parts.append(" " if spaced else "")
+            else:
+                parts.append(_separator(previous_kind, previous, kind, text))
+        parts.append(text)
+        previous_kind = kind
+        previous = upper if kind == "word" else text
+        previous_verbatim = in_select_list
+        spaced = False
+
+    return "".join(parts), tuple(params)
+
+
+def is_read_query(template: str) -> bool:
+    words = template.split(None, 1)
+    return bool(words) and words[0].upper() in READ_QUERY_KEYWORDS
+
+
+# Thread-safe counts of how often statements repeat once normalized, which is what decides
+# whether the per-connection prepared-statement caches get reused
+class StatementStats:
+    def __init__(self, max_entries: int = DB_STATEMENT_STATS_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.repeats = 0
+        self.dropped = 0
+
+    def record(self, template: str):
+        with self._lock:
+            self.executions += 1
+            count = self._counts.pop(template, 0)
+            if count:
+                self.repeats += 1
+            elif len(self._counts) >= self.max_entries:
+                self._counts.popitem(last=False)
+                self.dropped += 1
+            self._counts[template] = count + 1
+
+    def stats(self, top: int = DB_STATEMENT_STATS_TOP) -> Dict:
+        with self._lock:
+            most_repeated = sorted(
+                self._counts.items(), key=lambda item: item[1], reverse=True
+            )[:top]
+            return {
+                "executions": self.executions,
+                "distinct_statements": len(self._counts),
+                "repeats": self.repeats,
+                "repeat_rate": (
+                    self.repeats / self.executions if self.executions else 0.0
+                ),
+                "dropped": self.dropped,
+                "most_repeated": [
+                    {"statement": template, "count": count}
+                    for template, count in most_repeated
+                ],
+            }
+
+
+_stats: Dict[Path, StatementStats] = {}
+_stats_lock = threading.Lock()
+
+
+# Get (or lazily create) the statement statistics of a database file
+def get_statement_stats(db_path: Path) -> StatementStats:
+    key = Path(db_path).resolve()
+    stats = _stats.get(key)
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.get(key)
+            if stats is None:
+                stats = StatementStats()
+                _stats[key] = stats
+    return stats
+
+
+def get_all_statement_stats() -> Dict:
+    with _stats_lock:
+        return {str(path.name): stats.stats() for path, stats in _stats.items()}
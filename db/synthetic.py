@@ -0,0 +1,191 @@
+from ingest import TRANSACTIONS_COLUMNS, connect_for_load
+from indexes import TRANSACTIONS_INDEXES, ensure_indexes
+from aggregates import refresh_aggregates
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterator, List, Tuple
+import argparse
+import itertools
+import random
+import sqlite3
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Named dataset sizes used by the benchmark suite
+DATASET_SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+# Average number of transactions per account, which sets the number of clients for a size
+TRANSACTIONS_PER_ACCOUNT = 1500
+
+# Spending categories with their merchants and typical debit range
+SPENDING = {
+    "restaurants": (["starbucks", "mcdonalds", "subway", "chipotle", "dominos"], 4, 80),
+    "shops": (["amazon", "walmart", "target", "nike", "adidas", "ikea"], 5, 400),
+    "groceries": (["whole foods", "trader joes", "costco", "kroger"], 10, 250),
+    "transport": (["uber", "lyft", "shell", "chevron"], 5, 120),
+    "utilities": (["pg&e", "comcast", "verizon", "at&t"], 30, 300),
+    "insurance": (["geico", "state farm", "allstate"], 50, 600),
+    "entertainment": (["netflix", "spotify", "steam", "amc theatres"], 5, 60),
+    "uncategorized": ([None], 1, 200),
+}  # fmt: skip
+SPENDING_WEIGHTS = [22, 20, 18, 12, 8, 4, 8, 8]
+
+# Incoming money, as category, merchant and credit range
+INCOME = [
+    ("transfer deposit", None, 50, 2000),
+    ("salary", "payroll", 1500, 6000),
+    ("refund", "amazon", 5, 300),
+]  # fmt: skip
+INCOME_WEIGHTS = [45, 45, 10]
+CREDIT_SHARE = 0.12
+
+DATE_START = datetime(2023, 1, 1)
+DATE_SPAN_SECONDS = int((datetime(2025, 1, 1) - DATE_START).total_seconds())
+
+
+def parse_size(size: str) -> int:
+    return DATASET_SIZES.get(size.lower()) or int(size)
+
+
+# Clients with one to three banks each, and one to three accounts per bank. Account activity
+# is skewed, so a few accounts carry many more transactions than the rest.
+def make_accounts(
+    rng: random.Random, n_rows: int
+) -> Tuple[List[Tuple[int, int, int]], List[float]]:
+    accounts = []
+    n_accounts = max(1, n_rows // TRANSACTIONS_PER_ACCOUNT)
+    client_id = bank_id = account_id = 0
+    while len(accounts) < n_accounts:
+        client_id += 1
+        for _ in range(rng.choices([1, 2, 3], weights=[70, 25, 5])[0]):
+            bank_id += 1
+            for _ in range(rng.choices([1, 2, 3], weights=[60, 30, 10])[0]):
+                account_id += 1
+                accounts.append((client_id, bank_id, account_id))
+    weights = [rng.paretovariate(2.0) for _ in accounts]
+    return accounts, weights
+
+
+def generate_rows(n_rows: int, seed: int = 0) -> Iterator[Tuple]:
+    rng = random.Random(seed)
+    accounts, weights = make_accounts(rng, n_rows)
+    cum_weights = list(itertools.accumulate(weights))
+    spending = list(SPENDING.items())
+    account_draws: List[Tuple[int, int, int]] = []
+    for transaction_id in range(1, n_rows + 1):
+        if not account_draws:
+            account_draws = rng.choices(accounts, cum_weights=cum_weights, k=10000)
+        client_id, bank_id, account_id = account_draws.pop()
+        transaction_date = (
+            DATE_START + timedelta(seconds=rng.randrange(DATE_SPAN_SECONDS))
+        ).strftime("%Y-%m-%d %H:%M:%S")
+        if rng.random() < CREDIT_SHARE:
+            (income,) = rng.choices(INCOME, weights=INCOME_WEIGHTS)
+            category, merchant, low, high = income
+            description = f"{category} {merchant or 'bank transfer'}"
+            debit, credit = None, round(rng.uniform(low, high), 2)
+        else:
+            ((category, (merchants, low, high)),) = rng.choices(
+                spending, weights=SPENDING_WEIGHTS
+            )
+            merchant = rng.choice(merchants)
+            description = f"card purchase {merchant or 'pos'} {rng.randint(1000, 9999)}"
+            debit, credit = round(rng.uniform(low, high), 2), None
+        yield (
+            client_id,
+            bank_id,
+            account_id,
+            transaction_id,
+            transaction_date,
+            description,
+            category,
+            merchant,
+            debit,
+            credit,
+        )
+
+
+# Write a synthetic transactions table, with indexes and summary tables built afterwards
+def generate_database(
+    db_path: Path, n_rows: int, seed: int = 0, batch_size: int = 50000
+) -> Dict:
+    start = perf_counter()
+    db_path = Path(db_path)
+    if db_path.exists():
+        return {"status": "error", "message": f"{db_path} already exists."}
+
+    conn = connect_for_load(db_path)
+    try:
+        for index_name in TRANSACTIONS_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index_name};")
+        insert_sql = f"INSERT INTO transactions ({', '.join(TRANSACTIONS_COLUMNS)}) VALUES ({', '.join('?' for _ in TRANSACTIONS_COLUMNS)})"
+        batch = []
+        for row in generate_rows(n_rows=n_rows, seed=seed):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                with conn:
+                    conn.executemany(insert_sql, batch)
+                batch = []
+        with conn:
+            conn.executemany(insert_sql, batch)
+            conn.execute("PRAGMA user_version = 1;")
+        clients, accounts = conn.execute(
+            "SELECT COUNT(DISTINCT client_id), COUNT(DISTINCT account_id) FROM transactions"
+        ).fetchone()
+
+    except sqlite3.Error as e:
+        return {
+            "status": "error",
+            "message": f"Database error occurred when executing generate_database: {e}",
+        }
+
+    finally:
+        conn.close()
+
+    load_seconds = perf_counter() - start
+    ensure_indexes(db_path=db_path)
+    refresh_aggregates(db_path=db_path, full=True)
+    report = {
+        "status": "success",
+        "db": str(db_path),
+        "rows": n_rows,
+        "clients": clients,
+        "accounts": accounts,
+        "load_seconds": round(load_seconds, 3),
+        "total_seconds": round(perf_counter() - start, 3),
+        "size_bytes": db_path.stat().st_size,
+    }
+    logger.info(f"Synthetic database generated: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic transactions database for benchmarking"
+    )
+    parser.add_argument(
+        "--size", default="10k", help="Row count, or one of: 10k, 1m, 10m"
+    )
+    parser.add_argument(
+        "--out",
+        type=Path,
+        required=True,
+        help="Output file, name it transactions.db to serve it directly",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = generate_database(
+        db_path=args.out, n_rows=parse_size(args.size), seed=args.seed
+    )
+    print(result)
+    sys.exit(0 if result["status"] == "success" else 1)